@@ -1,20 +1,40 @@
 import os
+import json
+import logging
+import hashlib
+import queue
+import time
 import uuid
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
 
-import psycopg2
+from psycopg2.errors import DeadlockDetected, SerializationFailure
 from psycopg2.extras import RealDictCursor
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, flash, session, send_from_directory, jsonify, abort
+    url_for, flash, session, send_from_directory, jsonify, abort,
+    g, has_request_context, Response
 )
-from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
 
 # Módulos internos
-from notificaciones.notificaciones import enviar_whatsapp, enviar_correo
+from notificaciones.notificaciones import encolar_whatsapp
+from notificaciones.outbox import encolar as encolar_notificacion
 from pagos.wompi import generar_link_de_pago, verificar_evento_webhook
+from basedatos.pool import conexion, pool_stats, configurar_conexiones
+from basedatos import instrumentacion, verde
+from basedatos.copia import copiar_filas
+from basedatos.cache import CacheTTL, FALTA
+from talonario.snapshot import obtener_snapshot, invalidar as invalidar_snapshot
+from talonario import eventos, rangos
+from talonario.busqueda import buscar_disponibles
+from talonario.azar import candidatos_al_azar
+from bot import motor as motor_bot
+from imagenes import premio as imagen_premio_mod
+from tareas import planificador
+from tareas.archivador import archivar_rifas_vencidas
+from tareas.reservas import liberar_reservas_vencidas
 from flask import url_for
 from twilio.twiml.messaging_response import MessagingResponse
 import re
@@ -25,6 +45,13 @@ SUPERADMIN_TOKEN = "geica-dev"  # cámbialo si quieres otro valor
 # ================== CONFIG INICIAL ==================
 load_dotenv()
 
+# 📝 Logs de la app y de los módulos de fondo (outbox, tareas, imágenes, LISTEN)
+#    a stderr, con el mismo formato de gunicorn. LOG_LEVEL=DEBUG para más detalle.
+logging.basicConfig(
+    level=(os.getenv("LOG_LEVEL") or "INFO").strip().upper(),
+    format="[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s",
+)
+
 BASE_DIR   = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "static", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -40,29 +67,6 @@ import re
 
 from datetime import datetime
 
-def archivar_rifas_vencidas():
-    """
-    Archiva toda rifa 'activa' cuya fecha_fin ya pasó.
-    Si fecha_fin es NULL, no hace nada.
-    Es idempotente y silencioso (no rompe requests).
-    """
-    try:
-        con = db()
-        cur = con.cursor()
-        cur.execute("""
-            UPDATE rifas
-               SET estado = 'archivada'
-             WHERE estado = 'activa'
-               AND fecha_fin IS NOT NULL
-               AND NOW() >= fecha_fin
-        """)
-        con.commit()
-        con.close()
-    except Exception:
-        # no levantamos error para no afectar la UX
-        pass
-
-
 def _normalize_msisdn(s: str) -> str:
     """Deja solo dígitos del MSISDN. Ej: 'whatsapp:+57 310-123-4567' -> '573101234567'"""
     if not s: return ""
@@ -71,29 +75,89 @@ def _normalize_msisdn(s: str) -> str:
 
 def db():
     """
-    Conecta a PostgreSQL usando DATABASE_URL.
-    Agrega sslmode=require si no viene.
+    Conexión PostgreSQL tomada del pool del worker (ver basedatos/pool.py).
+    - Dentro de un request: todas las llamadas comparten UNA conexión,
+      que se devuelve al pool en el teardown. close() solo hace rollback
+      de lo no confirmado.
+    - Fuera de un request (hilos, tareas): close() la devuelve al pool.
     """
-    db_url = os.getenv("DATABASE_URL", "").strip()
-    if not db_url:
-        raise RuntimeError("DATABASE_URL no está configurada. Defínela en Render.")
-    if "sslmode=" not in db_url:
-        sep = "&" if "?" in db_url else "?"
-        db_url = db_url + f"{sep}sslmode=require"
-    return psycopg2.connect(db_url)
+    if not has_request_context():
+        return conexion(devolver=True)
+    con = g.get("_db_con")
+    if con is None:
+        con = conexion(devolver=False)
+        g._db_con = con
+    return con
+
+@app.teardown_request
+def _devolver_conexion_db(exc=None):
+    con = g.pop("_db_con", None)
+    if con is not None:
+        con.liberar()
+    m = instrumentacion.terminar()
+    if m is not None:
+        histograma_rutas.registrar(_ruta_actual(), m, m.total_ms())
+
+# ================== INSTRUMENTACIÓN DB POR REQUEST ==================
+# Cada conexión del pool cronometra sus sentencias (basedatos/instrumentacion.py).
+# Por request: préstamos y espera de conexión, sentencias, tiempo SQL, la más
+# lenta y filas. Se agregan en histogramas por ruta (/superadmin/db-rutas) y,
+# en modo debug o con DB_SERVER_TIMING=1, salen en el header Server-Timing.
+DB_INSTRUMENTAR  = os.getenv("DB_INSTRUMENTAR", "1").strip() != "0"
+DB_SERVER_TIMING = os.getenv("DB_SERVER_TIMING", "0").strip() == "1"
+histograma_rutas = instrumentacion.HistogramaRutas()
+if DB_INSTRUMENTAR:
+    configurar_conexiones(connection_factory=instrumentacion.ConexionInstrumentada)
+
+def _ruta_actual() -> str:
+    regla = request.url_rule.rule if request.url_rule is not None else "<sin ruta>"
+    return f"{request.method} {regla}"
+
+@app.before_request
+def _iniciar_medicion_db():
+    if DB_INSTRUMENTAR:
+        instrumentacion.iniciar()
+
+@app.after_request
+def _server_timing_db(resp):
+    m = instrumentacion.actual()
+    if m is not None and (app.debug or DB_SERVER_TIMING):
+        resp.headers.add("Server-Timing", ", ".join([
+            f'db-conn;dur={m.conexion_ms:.2f};desc="{m.conexiones} prestadas, {m.conexiones_nuevas} nuevas"',
+            f'db;dur={m.sql_ms:.2f};desc="{m.sentencias} sentencias, {m.filas} filas"',
+            f"db-max;dur={m.max_ms:.2f}",
+            f"app;dur={m.total_ms():.2f}",
+        ]))
+    return resp
+
+# Negocio logueado: memoizado en flask.g durante el request y en un cache TTL
+# por id entre requests. Solo columnas de panel: sin llaves Wompi ni bot_config.
+NEGOCIO_PANEL_COLUMNAS = "id, nombre_negocio, correo, celular, estado"
+NEGOCIO_ACTUAL_TTL = float(os.getenv("NEGOCIO_ACTUAL_TTL", "30"))
+_cache_negocio_actual = CacheTTL(maximo=256, ttl=NEGOCIO_ACTUAL_TTL)
 
 def negocio_actual():
-    """Retorna el registro del negocio logueado (dict) o None."""
+    """Retorna el registro (columnas de panel) del negocio logueado (dict) o None."""
     nid = session.get("negocio_id")
     if not nid:
         return None
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM negocios WHERE id = %s", (nid,))
-    row = cur.fetchone()
-    con.close()
+    if "negocio_actual" in g:
+        return g.negocio_actual
+    row = _cache_negocio_actual.get(int(nid))
+    if row is FALTA:
+        # usa la conexión del request sin cerrarla: close() haría rollback de
+        # lo que el llamador aún no confirmó (la devuelve el teardown)
+        with db().cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SELECT {NEGOCIO_PANEL_COLUMNAS} FROM negocios WHERE id = %s", (nid,))
+            row = cur.fetchone()
+        row = dict(row) if row else None
+        _cache_negocio_actual.set(int(nid), row)
+    g.negocio_actual = row
     return row
 
+def invalidar_negocio_actual(negocio_id):
+    _cache_negocio_actual.borrar(int(negocio_id))
+
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -106,15 +170,23 @@ def numero_estado_css(estado: str) -> str:
 
 def generar_numeros(cifras: int, cantidad: int):
     """
+    Generador (no arma listas completas):
     2 cifras -> 00..99 (ordenado, fijo 100)
-    3/4 cifras -> lista aleatoria de longitud 'cantidad'
+    3/4 cifras -> 'cantidad' números distintos al azar de 0..10**cifras-1
+    Usa el algoritmo de Floyd: memoria O(cantidad), sin materializar ni
+    barajar el universo completo de 10**cifras strings.
     """
     if cifras == 2:
-        return [f"{i:02d}" for i in range(100)]
+        yield from (f"{i:02d}" for i in range(100))
+        return
     maximo = 10 ** cifras
-    todos = [f"{i:0{cifras}d}" for i in range(maximo)]
-    random.shuffle(todos)
-    return todos[:cantidad]
+    cantidad = max(0, min(cantidad, maximo))
+    elegidos = set()
+    for j in range(maximo - cantidad, maximo):
+        t = random.randint(0, j)
+        elegido = t if t not in elegidos else j
+        elegidos.add(elegido)
+        yield f"{elegido:0{cifras}d}"
 
 def crear_link_publico():
     return uuid.uuid4().hex[:12]
@@ -122,38 +194,198 @@ def crear_link_publico():
 # minutos que dura una reserva sin pagar
 RESERVA_MINUTOS = int(os.getenv("RESERVA_MINUTOS", "30"))
 
-def liberar_reservas_expiradas(rifa_id: int):
-    """Pone 'disponible' todo número 'reservado' cuyo reservado_hasta ya pasó."""
-    con = db()
-    cur = con.cursor()
-    ahora = datetime.now()
+# Contadores por rifa (tabla rifa_stats, mantenida por triggers en numeros).
+# Cada rifa tiene hasta 8 shards: se suman con un LATERAL que usa la PK.
+SQL_JOIN_STATS = """
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(SUM(total), 0)::int       AS total,
+               COALESCE(SUM(disponibles), 0)::int AS disponibles,
+               COALESCE(SUM(reservados), 0)::int  AS reservados,
+               COALESCE(SUM(pagados), 0)::int     AS pagados,
+               COALESCE(SUM(recaudado), 0)::bigint AS recaudado
+          FROM rifa_stats
+         WHERE id_rifa = r.id
+    ) s ON TRUE
+"""
+
+def stats_rifa(cur, rifa_id: int) -> dict:
+    """total / disponibles / reservados / pagados / recaudado de una rifa (O(1))."""
     cur.execute("""
-        UPDATE numeros
-           SET estado='disponible', reservado_hasta=NULL, id_comprador=NULL
-         WHERE id_rifa=%s
-           AND estado='reservado'
-           AND reservado_hasta IS NOT NULL
-           AND reservado_hasta < %s
-    """, (rifa_id, ahora))
-    con.commit()
-    con.close()
+        SELECT COALESCE(SUM(total), 0)::int       AS total,
+               COALESCE(SUM(disponibles), 0)::int AS disponibles,
+               COALESCE(SUM(reservados), 0)::int  AS reservados,
+               COALESCE(SUM(pagados), 0)::int     AS pagados,
+               COALESCE(SUM(recaudado), 0)::bigint AS recaudado
+          FROM rifa_stats
+         WHERE id_rifa = %s
+    """, (rifa_id,))
+    row = cur.fetchone()
+    if isinstance(row, dict):
+        return dict(row)
+    return dict(zip(("total", "disponibles", "reservados", "pagados", "recaudado"), row))
+
+# Estado "efectivo" de un número para lecturas: una reserva vencida cuenta como
+# disponible aunque el liberador de fondo (tareas/reservas.py) aún no la haya
+# pasado a 'disponible'. Así las lecturas no escriben nada.
+SQL_ESTADO_EFECTIVO = (
+    "CASE WHEN estado='reservado' AND reservado_hasta < NOW() "
+    "THEN 'disponible' ELSE estado END"
+)
+
+def _sql_reservar(al_azar: bool) -> str:
+    """
+    CTE 'reservados' de reservar_y_crear_compra: las filas se bloquean primero
+    en una subconsulta y luego se marcan (un UPDATE directo con numero = ANY
+    bloquea en el orden del plan y dos checkouts cruzados pueden bloquearse
+    mutuamente).
+    - Pedidos: en orden de id y esperando el bloqueo; quien llega segundo
+      re-evalúa el WHERE y simplemente no obtiene el número.
+    - Al azar: los primeros 'cantidad' candidatos (ya en orden aleatorio) que
+      sigan libres; SKIP LOCKED pasa al siguiente en vez de esperar.
+    """
+    if al_azar:
+        orden = "array_position(%(numeros)s, numero)\n                      LIMIT %(cantidad)s"
+        bloqueo = "FOR UPDATE SKIP LOCKED"
+    else:
+        orden, bloqueo = "id", "FOR UPDATE"
+    return f"""
+            UPDATE numeros
+               SET estado='reservado', id_comprador=NULL,
+                   reservado_hasta = NOW() + make_interval(mins => %(minutos)s)
+             WHERE id IN (
+                     SELECT id FROM numeros
+                      WHERE id_rifa = %(rifa_id)s
+                        AND numero = ANY(%(numeros)s)
+                        AND (estado='disponible' OR (estado='reservado' AND reservado_hasta < NOW()))
+                      ORDER BY {orden}
+                        {bloqueo})
+         RETURNING id, numero
+"""
+
+def reservar_y_crear_compra(cur, rifa_id: int, numeros: list, total: int,
+                            nombre: str, cedula: str, correo: str, telefono: str,
+                            cantidad: int | None = None):
+    """
+    Checkout atómico en UNA sola sentencia (un round trip):
+    - UPDATE condicional que reserva los números pedidos solo si están
+      disponibles (o con reserva vencida). Las filas se bloquean siempre en
+      orden de id; si dos compradores compiten por el mismo número, el
+      segundo espera, re-evalúa el WHERE y simplemente no lo obtiene (no hay
+      doble venta). Si aun así Postgres aborta por deadlock o serialización
+      (p. ej. contra el liberador o un webhook), se trata como "no disponible".
+      Con 'cantidad', 'numeros' son candidatos al azar (talonario/azar.py) y
+      se reservan los primeros 'cantidad' que sigan libres.
+    - Upsert del comprador por cédula (ON CONFLICT sobre compradores_cedula_unq:
+      dos checkouts simultáneos con la misma cédula no lo duplican).
+    - INSERT de la compra 'pendiente' solo si se reservaron TODOS, y de su
+      relación compra_numeros (por id de número).
+    Retorna dict(compra_id, comprador_id, ids_numeros, numeros) o None si no se
+    pudieron reservar todos; en ese caso el llamador debe hacer rollback (nada
+    queda reservado). No hace commit.
+    """
+    if cantidad is None:
+        pedidos = sorted(numeros)
+        cantidad = len(pedidos)
+        sql_reservar = _sql_reservar(al_azar=False)
+        numeros_str = ",".join(numeros)
+    else:
+        pedidos = list(numeros)
+        sql_reservar = _sql_reservar(al_azar=True)
+        numeros_str = None  # se arma con los que salgan reservados
+    sql = """
+        WITH reservados AS (""" + sql_reservar + """        ),
+        cmp AS (
+            INSERT INTO compradores (nombre, cedula, correo, telefono)
+            SELECT %(nombre)s, %(cedula)s, %(correo)s, %(telefono)s
+             WHERE (SELECT COUNT(*) FROM reservados) = %(cantidad)s
+            ON CONFLICT (cedula) DO UPDATE
+               SET nombre=EXCLUDED.nombre, correo=EXCLUDED.correo, telefono=EXCLUDED.telefono
+         RETURNING id
+        ),
+        compra AS (
+            INSERT INTO compras (id_comprador, id_rifa, numeros, total, fecha, estado)
+            SELECT cmp.id, %(rifa_id)s,
+                   COALESCE(%(numeros_str)s,
+                            (SELECT string_agg(numero, ',' ORDER BY numero) FROM reservados)),
+                   %(total)s, NOW(), 'pendiente'
+              FROM cmp
+         RETURNING id, id_comprador
+        ),
+        enlace AS (
+            INSERT INTO compra_numeros (id_compra, id_numero)
+            SELECT compra.id, reservados.id FROM compra, reservados
+        )
+        SELECT (SELECT COUNT(*) FROM reservados)          AS reservados,
+               (SELECT array_agg(id) FROM reservados)     AS ids_numeros,
+               (SELECT array_agg(numero ORDER BY numero) FROM reservados) AS numeros,
+               (SELECT id FROM compra)                    AS compra_id,
+               (SELECT id_comprador FROM compra)          AS comprador_id
+    """
+    params = {
+        "rifa_id": rifa_id,
+        "numeros": pedidos,
+        "cantidad": cantidad,
+        "minutos": RESERVA_MINUTOS,
+        "nombre": nombre, "cedula": cedula, "correo": correo, "telefono": telefono,
+        "numeros_str": numeros_str,
+        "total": total,
+    }
+    try:
+        cur.execute(sql, params)
+    except (DeadlockDetected, SerializationFailure):
+        return None  # la transacción quedó abortada: el llamador hace rollback
+    row = cur.fetchone()
+    if not row or row["reservados"] != cantidad or not row["compra_id"]:
+        return None
+    return {
+        "compra_id": row["compra_id"],
+        "comprador_id": row["comprador_id"],
+        "ids_numeros": list(row["ids_numeros"] or []),
+        "numeros": list(row["numeros"] or []),
+    }
+
+# Cache negocio por MSISDN receptor (webhooks de WhatsApp). Se invalida cuando
+# el superadmin crea/edita un negocio; en otros workers expira por TTL.
+NEGOCIO_MSISDN_TTL = float(os.getenv("NEGOCIO_MSISDN_TTL", "60"))
+_cache_negocio_msisdn = CacheTTL(maximo=512, ttl=NEGOCIO_MSISDN_TTL)
+
+def negocio_por_msisdn(numero: str):
+    """
+    Negocio cuyo número receptor (o celular, si no tiene receptor) coincide con
+    'numero' en dígitos. Usa la columna indexada negocios.wa_msisdn y un cache
+    TTL/LRU en proceso (también cachea el "no existe").
+    """
+    msisdn = _normalize_msisdn(numero)
+    if not msisdn:
+        return None
+    row = _cache_negocio_msisdn.get(msisdn)
+    if row is not FALTA:
+        return row
+    # conexión del request sin cerrarla (ver negocio_actual)
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT * FROM negocios
+             WHERE wa_msisdn = %s
+             ORDER BY (wa_numero_receptor IS NULL OR TRIM(wa_numero_receptor) = ''), id DESC
+             LIMIT 1
+        """, (msisdn,))
+        row = cur.fetchone()
+    row = dict(row) if row else None
+    _cache_negocio_msisdn.set(msisdn, row)
+    return row
+
+def invalidar_negocio_msisdn(negocio_id=None):
+    """Sin id limpia todo (p. ej. negocio nuevo que antes se cacheó como 'no existe')."""
+    if negocio_id is None:
+        _cache_negocio_msisdn.limpiar()
+    else:
+        _cache_negocio_msisdn.borrar_si(lambda _k, v: v is not None and v.get("id") == int(negocio_id))
 
 def find_negocio_by_twilio_to(twilio_to: str):
-    """Modo A: resolución por número receptor (To). Debe estar guardado tal cual en negocios.wa_numero_receptor"""
+    """Modo A: resolución por número receptor (To), comparando solo dígitos (negocios.wa_msisdn)."""
     if not twilio_to:
         return None
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT * FROM negocios 
-         WHERE wa_numero_receptor IS NOT NULL 
-           AND TRIM(wa_numero_receptor) <> ''
-           AND REPLACE(REPLACE(wa_numero_receptor,' ',''),'+','') = REPLACE(REPLACE(%s,' ',''),'+','')
-        LIMIT 1
-    """, (twilio_to,))
-    row = cur.fetchone()
-    con.close()
-    return row
+    return negocio_por_msisdn(twilio_to)
 
 def find_negocio_by_hint(body_text: str):
     """
@@ -167,116 +399,234 @@ def find_negocio_by_hint(body_text: str):
         return None
     txt = body_text.strip()
 
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-
-    # 1) @alias
-    m = re.search(r'@([A-Za-z0-9_\-\.]{2,32})', txt)
-    if m:
-        alias = m.group(1)
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        # 1) @alias
+        m = re.search(r'@([A-Za-z0-9_\-\.]{2,32})', txt)
+        if m:
+            alias = m.group(1)
+            cur.execute("""
+                SELECT * FROM negocios 
+                 WHERE LOWER(nombre_negocio) LIKE LOWER(%s) 
+                    OR LOWER(nombre_propietario) LIKE LOWER(%s)
+                LIMIT 1
+            """, (f"%{alias}%", f"%{alias}%"))
+            row = cur.fetchone()
+            if row:
+                return row
+
+        # 2) link público /r/<link>
+        m = re.search(r'/r/([A-Za-z0-9]{6,})', txt)
+        if m:
+            link = m.group(1)
+            cur.execute("""
+                SELECT n.* FROM rifas r
+                JOIN negocios n ON n.id = r.id_negocio
+                WHERE r.link_publico = %s
+                LIMIT 1
+            """, (link,))
+            row = cur.fetchone()
+            if row:
+                return row
+
+        # 3) fuzzy por nombre del negocio (muy laxo)
         cur.execute("""
             SELECT * FROM negocios 
-             WHERE LOWER(nombre_negocio) LIKE LOWER(%s) 
-                OR LOWER(nombre_propietario) LIKE LOWER(%s)
-            LIMIT 1
-        """, (f"%{alias}%", f"%{alias}%"))
-        row = cur.fetchone()
-        if row:
-            con.close()
-            return row
+             WHERE LOWER(nombre_negocio) LIKE LOWER(%s)
+             ORDER BY id DESC LIMIT 1
+        """, (f"%{txt[:40]}%",))
+        return cur.fetchone()
 
-    # 2) link público /r/<link>
-    m = re.search(r'/r/([A-Za-z0-9]{6,})', txt)
-    if m:
-        link = m.group(1)
-        cur.execute("""
-            SELECT n.* FROM rifas r
-            JOIN negocios n ON n.id = r.id_negocio
-            WHERE r.link_publico = %s
-            LIMIT 1
-        """, (link,))
-        row = cur.fetchone()
-        if row:
-            con.close()
-            return row
+# ================== BOT: DATOS DE CADA INTENCIÓN ==================
+# El motor (bot/motor.py) decide la intención con el bot_config compilado del
+# negocio; aquí va lo que cada una consulta: a lo sumo UNA consulta de datos.
+# La rifa activa más reciente de cada negocio se cachea unos segundos porque
+# casi todas las intenciones la usan.
+BOT_RIFA_TTL = float(os.getenv("BOT_RIFA_TTL", "30"))
+BOT_BUSCAR_LIMITE = int(os.getenv("BOT_BUSCAR_LIMITE", "20"))
+_cache_rifa_bot = CacheTTL(maximo=512, ttl=BOT_RIFA_TTL)
+_TEXTO_MODO_BUSCAR = {"termina": "terminan en", "empieza": "empiezan por", "contiene": "contienen"}
+
+def rifa_activa_bot(negocio_id: int):
+    """Rifa ACTIVA más reciente del negocio (cache TTL; también cachea 'no hay')."""
+    rifa = _cache_rifa_bot.get(negocio_id)
+    if rifa is FALTA:
+        # conexión del request sin cerrarla (ver negocio_actual)
+        with db().cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT id, nombre, cifras, link_publico, valor_numero
+                  FROM rifas
+                 WHERE id_negocio=%s AND estado='activa'
+                 ORDER BY id DESC LIMIT 1
+            """, (negocio_id,))
+            rifa = cur.fetchone()
+        rifa = dict(rifa) if rifa else None
+        _cache_rifa_bot.set(negocio_id, rifa)
+    return rifa
+
+def invalidar_rifa_bot(negocio_id):
+    _cache_rifa_bot.borrar(int(negocio_id))
+
+def _pesos(valor) -> str:
+    return f"{int(valor or 0):,}".replace(",", ".")
+
+def _link_rifa(rifa, base_url) -> str:
+    return f"{base_url.rstrip('/')}/r/{rifa['link_publico']}"
+
+def _bot_con_rifa(manejador):
+    """Las intenciones que necesitan la rifa activa responden igual si no hay."""
+    def envoltura(b, dato):
+        rifa = rifa_activa_bot(b["negocio"]["id"])
+        if not rifa:
+            return ["No hay rifas activas en este momento."]
+        return manejador(b, dato, rifa)
+    return envoltura
 
-    # 3) fuzzy por nombre del negocio (muy laxo)
-    cur.execute("""
-        SELECT * FROM negocios 
-         WHERE LOWER(nombre_negocio) LIKE LOWER(%s)
-         ORDER BY id DESC LIMIT 1
-    """, (f"%{txt[:40]}%",))
-    row = cur.fetchone()
-    con.close()
-    return row
+def _bot_saludo(b, _dato):
+    return [b["render"](b["cfg"].saludo), b["menu"]]
 
-def bot_menu_text(negocio):
-    nom = negocio.get("nombre_negocio", "tu negocio")
-    return (
-        f"🤖 *GEICACONTROLRIFAS* — {nom}\n"
-        f"Elige una opción:\n"
-        f"1) Comprar números\n"
-        f"2) Ver estado de un número\n"
-        f"3) Ver rifas activas\n"
-        f"4) Ayuda\n\n"
-        f"Puedes escribir: *comprar*, *estado 1234*, *rifas*, *ayuda*"
-    )
+def _bot_menu(b, _dato):
+    return [b["menu"]]
 
-def bot_rifas_activas_text(negocio_id, base_url):
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT id, nombre, link_publico, valor_numero, estado
-          FROM rifas 
-         WHERE id_negocio=%s AND estado='activa'
-         ORDER BY id DESC LIMIT 6
-    """, (negocio_id,))
-    rows = cur.fetchall()
-    con.close()
-    if not rows:
-        return "Por ahora no hay rifas activas."
-    lines = []
-    for r in rows:
-        link = f"{base_url.rstrip('/')}/r/{r['link_publico']}"
-        lines.append(f"• {r['nombre']} — ${r['valor_numero']:,} COP\n  {link}".replace(",", "."))
-    return "🎟️ *Rifas activas:*\n" + "\n".join(lines)
-
-def bot_estado_numero_text(negocio_id, numero):
+def _bot_ayuda(b, _dato):
+    return [b["render"](b["cfg"].plantillas["ayuda"])]
+
+def _bot_rifas(b, _dato):
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT nombre, link_publico, valor_numero
+              FROM rifas
+             WHERE id_negocio=%s AND estado='activa'
+             ORDER BY id DESC LIMIT 6
+        """, (b["negocio"]["id"],))
+        rifas = cur.fetchall()
+    if not rifas:
+        return ["Por ahora no hay rifas activas."]
+    lineas = [f"• {r['nombre']} — ${_pesos(r['valor_numero'])} COP\n  {_link_rifa(r, b['base_url'])}"
+              for r in rifas]
+    return ["🎟️ *Rifas activas:*\n" + "\n".join(lineas), b["menu"]]
+
+@_bot_con_rifa
+def _bot_disponibles(b, _dato, rifa):
+    # contador O(1) de rifa_stats
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        libres = stats_rifa(cur, rifa["id"])["disponibles"]
+    return [f"🔢 Disponibles en *{rifa['nombre']}*: {libres}\n{_link_rifa(rifa, b['base_url'])}",
+            b["menu"]]
+
+@_bot_con_rifa
+def _bot_precio(b, _dato, rifa):
+    return [b["render"](b["cfg"].plantillas["precio"], rifa=rifa), _link_rifa(rifa, b["base_url"])]
+
+@_bot_con_rifa
+def _bot_comprar(b, _dato, rifa):
+    return [f"💳 Para comprar ingresa aquí:\n{_link_rifa(rifa, b['base_url'])}"]
+
+@_bot_con_rifa
+def _bot_estado(b, numero, rifa):
+    if not numero:
+        return ["Escribe: *estado 05* (o el número que quieras consultar)."]
+    numero = rangos.normalizar(numero, int(rifa["cifras"]))
+    with db().cursor() as cur:
+        cur.execute(f"""
+            SELECT {SQL_ESTADO_EFECTIVO}
+              FROM numeros
+             WHERE id_rifa=%s AND numero=%s
+        """, (rifa["id"], numero))
+        row = cur.fetchone()
+    if not row:
+        return [f"El número *{numero}* no existe en la rifa activa."]
+    textos = {
+        "disponible": f"El número *{numero}* está *DISPONIBLE* ✅",
+        "reservado":  f"El número *{numero}* está *RESERVADO* ⏳",
+        "pagado":     f"El número *{numero}* ya fue *VENDIDO* ❌",
+    }
+    return [textos.get(row[0], f"El número *{numero}* está en estado: {row[0]}")]
+
+@_bot_con_rifa
+def _bot_buscar(b, busqueda, rifa):
+    modo, patron = busqueda
+    with db().cursor() as cur:
+        numeros, hay_mas = buscar_disponibles(cur, rifa["id"], int(rifa["cifras"]),
+                                              patron, modo, limite=BOT_BUSCAR_LIMITE)
+    link = _link_rifa(rifa, b["base_url"])
+    que = f"{_TEXTO_MODO_BUSCAR[modo]} *{patron}*"
+    if not numeros:
+        return [f"No quedan números disponibles que {que} en *{rifa['nombre']}* 😕\n{link}"]
+    extra = "\n(y hay más… prueba con más dígitos)" if hay_mas else ""
+    return [f"🔎 Disponibles que {que} en *{rifa['nombre']}*:\n"
+            f"{' · '.join(numeros)}{extra}\n\nElige los tuyos aquí: {link}"]
+
+@_bot_con_rifa
+def _bot_azar(b, cantidad, rifa):
     """
-    Busca el estado de ese número en la rifa ACTIVA más reciente del negocio.
+    Elige N disponibles al azar sobre la foto del talonario y responde con el
+    link de la rifa que los deja preseleccionados (/r/<link>?numeros=...).
+    La reserva se hace en generar_pago, cuando el comprador pone sus datos.
     """
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT r.id, r.nombre
-          FROM rifas r
-         WHERE r.id_negocio=%s AND r.estado='activa'
-         ORDER BY r.id DESC LIMIT 1
-    """, (negocio_id,))
-    rifa = cur.fetchone()
+    cantidad = max(1, min(int(cantidad or 1), AZAR_MAX_NUMEROS))
+    with db().cursor() as cur:
+        snap = obtener_snapshot(cur, rifa["id"], int(rifa["cifras"]))
+    numeros = candidatos_al_azar(snap, cantidad, holgura=1)
+    if not numeros:
+        return [f"En *{rifa['nombre']}* ya no quedan {cantidad} números disponibles 😕"]
+    numeros.sort()
+    link = f"{_link_rifa(rifa, b['base_url'])}?numeros={','.join(numeros)}"
+    return [f"🎲 Te elegí al azar en *{rifa['nombre']}*:\n{' · '.join(numeros)}\n"
+            f"Total: ${_pesos(int(rifa['valor_numero']) * len(numeros))} COP\n\n"
+            f"Completa tus datos y paga aquí (se separan al pagar):\n{link}"]
+
+def _bot_rifa_link(b, link_publico):
+    """Resumen en vivo de la rifa cuyo link vino en el mensaje."""
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT r.nombre, r.link_publico, r.valor_numero, s.pagados, s.disponibles
+              FROM rifas r
+              {SQL_JOIN_STATS}
+             WHERE r.link_publico=%s AND r.id_negocio=%s AND r.estado='activa'
+        """, (link_publico, b["negocio"]["id"]))
+        rifa = cur.fetchone()
     if not rifa:
-        con.close()
-        return "No hay rifas activas en este momento."
-
-    cur.execute("""
-        SELECT estado, id_comprador 
-          FROM numeros 
-         WHERE id_rifa=%s AND numero=%s
-         LIMIT 1
-    """, (rifa["id"], numero))
-    row = cur.fetchone()
-    con.close()
+        return ["Ese link no corresponde a una rifa activa.", b["menu"]]
+    return [
+        f"📌 *Rifa:* {rifa['nombre']}\n"
+        f"💰 *Precio por número:* ${_pesos(rifa['valor_numero'])} COP\n"
+        f"🧮 *Vendidos:* {rifa['pagados']}  |  *Disponibles:* {rifa['disponibles']}\n"
+        f"🔗 Link: {_link_rifa(rifa, b['base_url'])}",
+        "¿Te ayudo a separar tus números? Escribe *comprar* para continuar. 🧾",
+    ]
 
-    if not row:
-        return f"El número *{numero}* no existe en la rifa activa."
-    est = row["estado"]
-    if est == "disponible":
-        return f"El número *{numero}* está *DISPONIBLE* ✅"
-    if est == "reservado":
-        return f"El número *{numero}* está *RESERVADO* ⏳"
-    if est == "pagado":
-        return f"El número *{numero}* ya fue *VENDIDO* ❌"
-    return f"El número *{numero}* está en estado: {est}"
+MANEJADORES_BOT = {
+    "saludo": _bot_saludo,
+    "menu": _bot_menu,
+    "ayuda": _bot_ayuda,
+    "rifas": _bot_rifas,
+    "disponibles": _bot_disponibles,
+    "precio": _bot_precio,
+    "comprar": _bot_comprar,
+    "estado": _bot_estado,
+    "buscar": _bot_buscar,
+    "azar": _bot_azar,
+    "rifa_link": _bot_rifa_link,
+}
+
+def responder_bot(negocio: dict, texto: str) -> list:
+    """Mensajes de respuesta del bot para 'texto' (lista de strings)."""
+    cfg = motor_bot.config_de(negocio)
+    intencion, dato = cfg.clasificar(texto)
+    app_ctx = {"base_url": _base_url()}
+
+    def render(plantilla, rifa=None):
+        return plantilla.render(negocio=negocio, rifa=rifa, app=app_ctx)
+
+    b = {"negocio": negocio, "cfg": cfg, "base_url": app_ctx["base_url"],
+         "render": render, "menu": render(cfg.menu)}
+    manejador = MANEJADORES_BOT.get(intencion)
+    if manejador is not None:
+        return manejador(b, dato)
+    if intencion in cfg.plantillas:
+        # intención propia del negocio (bot_config.intents): solo su plantilla
+        return [render(cfg.plantillas[intencion], rifa_activa_bot(negocio["id"]))]
+    return [render(cfg.fallback), b["menu"]]
 
 # ================== SUPERADMIN HELPER (nuevo, mínimo) ==================
 def is_superadmin():
@@ -388,16 +738,18 @@ def superadmin_crear_negocio():
             INSERT INTO negocios
                 (nombre_negocio, nombre_propietario, celular, correo, contrasena,
                  public_key_wompi, private_key_wompi, integrity_secret_wompi,
-                 checkout_url_wompi, estado, wa_numero_receptor, bot_config)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                 checkout_url_wompi, estado, wa_numero_receptor, bot_config, wa_msisdn)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (
             nombre, propietario or nombre, celular, correo, contrasena,
             pub, prv, itg, chk, estado,
             wa_numero_receptor or None,
-            bot_config  # psycopg2 serializa dict→jsonb si la columna es JSON/JSONB
+            bot_config,  # psycopg2 serializa dict→jsonb si la columna es JSON/JSONB
+            _normalize_msisdn(wa_numero_receptor or celular)
         ))
         con.commit()
         con.close()
+        invalidar_negocio_msisdn()
         flash("Negocio creado ✅", "success")
     except Exception as e:
         try:
@@ -461,6 +813,8 @@ def superadmin_estado_negocio():
         cur.execute("UPDATE negocios SET estado=%s WHERE id=%s", (nuevo_estado, negocio_id))
         con.commit()
         con.close()
+        invalidar_negocio_msisdn(negocio_id)
+        invalidar_negocio_actual(negocio_id)
         flash(f"Negocio {accion}do correctamente.", "success")
     except Exception as e:
         try:
@@ -471,6 +825,29 @@ def superadmin_estado_negocio():
 
     return redirect(url_for("superadmin_panel"))
 
+@app.get("/superadmin/db-pool")
+def superadmin_db_pool():
+    """Estadísticas del pool de conexiones de ESTE worker (para dimensionarlo)."""
+    if not is_superadmin():
+        abort(403)
+    return jsonify(pool_stats())
+
+@app.get("/superadmin/db-rutas")
+def superadmin_db_rutas():
+    """Histogramas por ruta (tiempo total, SQL y espera de conexión) de ESTE worker."""
+    if not is_superadmin():
+        abort(403)
+    if request.args.get("limpiar") == "1":
+        histograma_rutas.limpiar()
+    return jsonify(histograma_rutas.resumen())
+
+@app.get("/superadmin/tareas")
+def superadmin_tareas():
+    """Estado de las tareas en segundo plano de ESTE worker."""
+    if not is_superadmin():
+        abort(403)
+    return jsonify(planificador.estado_tareas())
+
 @app.route("/")
 def home():
     if session.get("negocio_id"):
@@ -486,12 +863,14 @@ def login():
         con = db()
         cur = con.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            "SELECT * FROM negocios WHERE correo = %s AND contrasena = %s AND estado = 'activo'",
+            f"SELECT {NEGOCIO_PANEL_COLUMNAS} FROM negocios "
+            "WHERE correo = %s AND contrasena = %s AND estado = 'activo'",
             (correo, contrasena)
         )
         row = cur.fetchone()
         con.close()
         if row:
+            _cache_negocio_actual.set(row["id"], dict(row))  # el panel no vuelve a consultar
             session["negocio_id"] = row["id"]
             session["negocio_nombre"] = row["nombre_negocio"]
             flash("¡Bienvenido! ✅", "success")
@@ -531,15 +910,17 @@ def crear_rifa():
             except Exception:
                 fecha_fin = None  # si viene mal, guardamos NULL
 
-        # Imagen
+        # Imagen: se valida y se guarda con nombre = hash del contenido; las
+        # variantes WebP (thumb/card/og) se generan en otro hilo (imagenes/premio.py)
         imagen_premio = None
         file = request.files.get("imagen_premio")
         if file and file.filename and allowed_file(file.filename):
-            fname   = secure_filename(file.filename)
-            unique  = f"{uuid.uuid4().hex}_{fname}"
-            save_as = os.path.join(UPLOAD_DIR, unique)
-            file.save(save_as)
-            imagen_premio = f"uploads/{unique}"
+            try:
+                guardado = imagen_premio_mod.guardar_original(file, UPLOAD_DIR)
+                imagen_premio = f"uploads/{guardado}"
+                imagen_premio_mod.procesar_en_segundo_plano(os.path.join(UPLOAD_DIR, guardado))
+            except imagen_premio_mod.ImagenInvalida as e:
+                flash(f"La imagen no se guardó: {e}", "warning")
 
         # Reglas de generación
         if cifras == 2:
@@ -562,14 +943,18 @@ def crear_rifa():
         ))
         rifa_id = cur.fetchone()["id"]
 
-        # Generar talonario
-        lista = generar_numeros(cifras, cantidad)
-        cur.executemany(
-            "INSERT INTO numeros (id_rifa, numero, estado) VALUES (%s, %s, 'disponible')",
-            [(rifa_id, n) for n in lista]
+        # Generar talonario: COPY en streaming (con gevent, INSERT por lotes)
+        copiar_filas(
+            cur, "numeros", ["id_rifa", "numero", "estado"],
+            ((rifa_id, n, "disponible") for n in generar_numeros(cifras, cantidad))
         )
         con.commit()
         con.close()
+        invalidar_rifa_bot(negocio["id"])  # el bot ya debe ofrecer la nueva rifa
+
+        # que el archivador recalcule su próximo despertar con la nueva fecha_fin
+        if fecha_fin:
+            planificador.tarea("archivar_rifas").despertar()
 
         flash("Rifa creada con éxito. ¡Comparte tu link!", "success")
         return redirect(url_for("ver_rifas"))
@@ -585,10 +970,11 @@ def ver_rifas():
 
     con = db()
     cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT r.*, 
-               (SELECT COUNT(*) FROM numeros n WHERE n.id_rifa = r.id AND n.estado='pagado') AS vendidos
+    cur.execute(f"""
+        SELECT r.id, r.nombre, r.descripcion, r.valor_numero, r.cantidad_numeros,
+               r.estado, r.link_publico, s.pagados AS vendidos
         FROM rifas r
+        {SQL_JOIN_STATS}
         WHERE r.id_negocio = %s
         ORDER BY r.id DESC
     """, (negocio["id"],))
@@ -599,38 +985,78 @@ def ver_rifas():
 # --------------- VISTA PÚBLICA RIFA -----------------
 from urllib.parse import quote  # al inicio del archivo o cerca de otros imports
 
+# Cache del HTML de /r/<link>: llave (rifa_id, versión, host). La versión es
+# SUM(rifa_stats.version), que los triggers suben en cada cambio de números,
+# así que una vista repetida cuesta UNA consulta barata. La entrada además
+# vence cuando expira la primera reserva que muestra (y a los RIFA_RENDER_TTL
+# segundos, por si cambian datos del negocio). LRU acotado a RIFA_RENDER_MAX.
+RIFA_RENDER_TTL = float(os.getenv("RIFA_RENDER_TTL", "300"))
+RIFA_RENDER_MAX = int(os.getenv("RIFA_RENDER_MAX", "128"))
+_cache_render_rifa = CacheTTL(maximo=RIFA_RENDER_MAX, ttl=RIFA_RENDER_TTL)
+
+# Rifas con más números que esto (4 cifras) no mandan la foto completa: la
+# grilla es virtual y pide a /r/<link>/numeros solo los rangos que se ven.
+GRILLA_SNAPSHOT_MAX = int(os.getenv("GRILLA_SNAPSHOT_MAX", "1000"))
+
 @app.route("/r/<link_publico>", methods=["GET"])
 def rifa_publica(link_publico):
     con = db()
     cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM rifas WHERE link_publico = %s AND estado='activa'", (link_publico,))
-    rifa = cur.fetchone()
-    if not rifa:
+    cur.execute("""
+        SELECT r.id, r.cantidad_numeros,
+               (SELECT COALESCE(SUM(version), 0) FROM rifa_stats WHERE id_rifa = r.id) AS version
+          FROM rifas r
+         WHERE r.link_publico = %s AND r.estado='activa'
+    """, (link_publico,))
+    fila = cur.fetchone()
+    if not fila:
         con.close()
         abort(404)
-    con.close()
 
-    # limpiar reservas vencidas antes de mostrar
-    liberar_reservas_expiradas(rifa["id"])
+    # los mensajes flash se consumen al renderizar: esa vista no se cachea
+    cacheable = "_flashes" not in session
+    # por rangos el HTML no lleva estados: no depende de la versión
+    por_rangos = int(fila["cantidad_numeros"] or 0) > GRILLA_SNAPSHOT_MAX
+    clave = (fila["id"], 0 if por_rangos else int(fila["version"]), request.host_url)
+    if cacheable:
+        html = _cache_render_rifa.get(clave)
+        if html is not FALTA:
+            con.close()
+            return html
 
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT * FROM rifas WHERE id = %s", (fila["id"],))
+    rifa = cur.fetchone()
+
+    # Variantes WebP de la imagen del premio (srcset / og:image). Si faltan
+    # (imagen recién subida o anterior al pipeline) se encolan y, solo mientras
+    # ese trabajo está en curso, la vista no se cachea para que la próxima ya
+    # las muestre. Sin Pillow o con un original roto se cachea con lo que hay.
+    imagen = imagen_premio_mod.variantes(app.static_folder, rifa.get("imagen_premio"))
+    if rifa.get("imagen_premio") and len(imagen) < len(imagen_premio_mod.VARIANTES):
+        if imagen_premio_mod.procesar_en_segundo_plano(
+                os.path.join(app.static_folder, rifa["imagen_premio"])):
+            cacheable = False
+
+    # (las reservas vencidas se leen como disponibles; las libera tareas/reservas.py)
     cur.execute("SELECT * FROM negocios WHERE id = %s", (rifa["id_negocio"],))
     negocio = cur.fetchone()
 
-    cur.execute("""
-        SELECT id, numero, estado FROM numeros
-        WHERE id_rifa = %s
-        ORDER BY numero ASC
-    """, (rifa["id"],))
-    numeros = cur.fetchall()
+    # Talonario: foto compacta (2 bits por número) cacheada en el proceso;
+    # el navegador la decodifica y arma la grilla (ver rifa_publica.html).
+    # Por rangos solo va el universo (qué números existen), sin estados.
+    cifras = int(rifa["cifras"])
+    snapshot, vence = None, float("inf")
+    if por_rangos:
+        total, universo = rangos.universo(con.cursor(), rifa["id"], cifras)
+        if universo is not None:
+            snapshot = {"cifras": cifras, "total": total, "universo": universo}
+        else:
+            cacheable = False  # la llave no lleva versión y esta vista sí
+    if snapshot is None:
+        snap = obtener_snapshot(con.cursor(), rifa["id"], cifras, version=int(fila["version"]))
+        snapshot, vence = snap.payload(), snap.vence
     con.close()
 
-    numeros_fmt = [
-        {"id": row["id"], "numero": row["numero"], "estado": numero_estado_css(row["estado"])}
-        for row in numeros
-    ]
-
     # ===== BOT WHATSAPP: construir link al número del bot =====
     # 1) Número BOT: por negocio (wa_numero_receptor) o global .env (TWILIO_PHONE)
     wa_bot = (negocio.get("wa_numero_receptor") or os.getenv("TWILIO_PHONE") or "").strip()
@@ -647,24 +1073,203 @@ def rifa_publica(link_publico):
     # 3) Pasar también la base absoluta (meta OG)
     app_base_url = (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
 
-    return render_template(
+    html = render_template(
         "rifa_publica.html",
         rifa=rifa,
         negocio=negocio,
-        numeros=numeros_fmt,
+        snapshot=snapshot,
+        imagen=imagen,
+        azar_max=AZAR_MAX_NUMEROS,
+        version=int(fila["version"]),
+        sse_activo=sse_activo(),
+        sondeo=SONDEO_SEGUNDOS,
         wa_link=wa_link,
         app_base_url=app_base_url
     )
+    if cacheable:
+        # las versiones anteriores de esta rifa ya no se van a pedir
+        _cache_render_rifa.borrar_si(lambda k, _v: k[0] == clave[0] and k[1] < clave[1])
+        _cache_render_rifa.set(clave, html, ttl=max(0.0, min(RIFA_RENDER_TTL, vence - time.time())))
+    return html
+
+# ------- TALONARIO POR RANGOS (grilla virtual) ------
+@app.get("/r/<link_publico>/numeros")
+def rifa_numeros(link_publico):
+    """
+    Estado de un rango de números, para la grilla virtual y otros clientes.
+      ?desde=0&hasta=500   -> '0000' <= numero < '0500' (se rellenan con ceros)
+      &estado=disponible   -> solo ese estado (efectivo)
+      &despues=0123        -> cursor de la página anterior ('siguiente')
+      &limite=500          -> máximo RANGO_LIMITE_MAX
+      &version=N           -> si el talonario sigue en la versión N no se leen
+                              números (sondeo de la página cuando no hay SSE)
+    Respuesta: {"ok": true, "version": N, "numeros": [["0003","disponible"], ...],
+                "siguiente": "0497"|null}
+    """
+    con = db()
+    cur = con.cursor()
+    cur.execute("""
+        SELECT r.id, r.cifras,
+               (SELECT COALESCE(SUM(version), 0) FROM rifa_stats WHERE id_rifa = r.id)
+          FROM rifas r
+         WHERE r.link_publico = %s AND r.estado='activa'
+    """, (link_publico,))
+    rifa = cur.fetchone()
+    if not rifa:
+        con.close()
+        abort(404)
+    rifa_id, cifras, version = rifa[0], int(rifa[1]), int(rifa[2])
+    if request.args.get("version") == str(version):
+        con.close()
+        return jsonify(ok=True, version=version, numeros=[], siguiente=None, sin_cambios=True)
+
+    estado = (request.args.get("estado") or "").strip().lower() or None
+    try:
+        limite = int(request.args.get("limite", "500"))
+        filas, siguiente = rangos.numeros_en_rango(
+            cur, rifa_id,
+            desde=rangos.normalizar(request.args.get("desde"), cifras),
+            hasta=rangos.normalizar(request.args.get("hasta"), cifras),
+            despues=rangos.normalizar(request.args.get("despues"), cifras),
+            estado=estado, limite=limite,
+        )
+    except ValueError as e:
+        con.close()
+        return jsonify(ok=False, error=str(e)), 400
+    con.close()
+    return jsonify(ok=True, version=version, numeros=filas, siguiente=siguiente)
+
+@app.get("/r/<link_publico>/buscar")
+def rifa_buscar(link_publico):
+    """
+    Números DISPONIBLES que cumplen un patrón (talonario/busqueda.py).
+      ?q=13&modo=contiene|empieza|termina&limite=20
+    Respuesta: {"ok": true, "numeros": ["0013", "0130", ...], "hay_mas": false}
+    """
+    con = db()
+    cur = con.cursor()
+    cur.execute("SELECT id, cifras FROM rifas WHERE link_publico = %s AND estado='activa'", (link_publico,))
+    rifa = cur.fetchone()
+    if not rifa:
+        con.close()
+        abort(404)
+    try:
+        numeros, hay_mas = buscar_disponibles(
+            cur, rifa[0], int(rifa[1]),
+            request.args.get("q", ""),
+            (request.args.get("modo") or "contiene").strip().lower(),
+            limite=int(request.args.get("limite", "20")),
+        )
+    except ValueError as e:
+        con.close()
+        return jsonify(ok=False, error=str(e)), 400
+    con.close()
+    return jsonify(ok=True, numeros=numeros, hay_mas=hay_mas)
+
+# --------- GRILLA EN VIVO (Server-Sent Events) -------
+# Un stream SSE ocupa su worker mientras dure: con workers sync (uno por
+# request) una sola pestaña abierta dejaría el sitio sin atender. Por eso SSE
+# solo se usa con workers cooperativos (gevent/gthread, ver gunicorn.conf.py);
+# si no, la página sondea /r/<link>/numeros?version=N cada SONDEO_SEGUNDOS.
+# SSE_ACTIVO=1/0 lo fuerza (p. ej. en desarrollo con el servidor de Flask).
+SSE_ACTIVO = (os.getenv("SSE_ACTIVO") or "").strip()
+SONDEO_SEGUNDOS = float(os.getenv("SONDEO_SEGUNDOS", "20"))
+SSE_MAX_SEGUNDOS = float(os.getenv("SSE_MAX_SEGUNDOS", "300"))
+SSE_PING_SEGUNDOS = float(os.getenv("SSE_PING_SEGUNDOS", "15"))
+
+def sse_activo() -> bool:
+    """
+    Según el worker que corre de verdad: gevent activa el wait callback
+    (basedatos/verde.py) y gunicorn.conf.py (post_fork) deja la clase real en
+    GUNICORN_WORKER_CLASS, aunque haya venido por -k en la línea de comandos.
+    """
+    if SSE_ACTIVO in ("0", "1"):
+        return SSE_ACTIVO == "1"
+    if verde.activo():
+        return True
+    return (os.getenv("GUNICORN_WORKER_CLASS") or "sync").strip().lower() in ("gthread", "eventlet")
+
+def _sse_max_segundos() -> float:
+    """Duración de cada stream, siempre por debajo del timeout de gunicorn;
+    el navegador (EventSource) reconecta solo."""
+    timeout = float(os.getenv("GUNICORN_TIMEOUT", "60"))
+    return min(SSE_MAX_SEGUNDOS, max(5.0, timeout - 10.0))
+
+@app.get("/r/<link_publico>/eventos")
+def rifa_eventos(link_publico):
+    """
+    Stream SSE con SOLO los cambios de estado de los números de la rifa.
+    - event: snapshot -> foto completa (al conectar/reconectar o si se atrasó)
+    - event: cambios  -> {"r": rifa_id, "c": [["05","reservado"], ...]}
+    Con ?rangos=1 (grilla virtual) no se arma la foto: en su lugar llega
+    event: resincronizar y el navegador vuelve a pedir los rangos visibles.
+    La conexión a la DB se usa solo para armar la foto inicial y se devuelve
+    al pool antes de empezar a transmitir.
+    Sin workers cooperativos (sse_activo) responde 204: EventSource no
+    reconecta y la página queda sondeando /r/<link>/numeros.
+    """
+    if not sse_activo():
+        return "", 204
+    con = db()
+    cur = con.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT id, cifras FROM rifas WHERE link_publico = %s AND estado='activa'", (link_publico,))
+    rifa = cur.fetchone()
+    if not rifa:
+        con.close()
+        abort(404)
+    rifa_id, cifras = rifa["id"], int(rifa["cifras"])
+    por_rangos = request.args.get("rangos") == "1"
+    inicial = None if por_rangos else obtener_snapshot(con.cursor(), rifa_id, cifras).payload()
+    con.close()
+
+    def _stream():
+        q = eventos.suscribir(rifa_id)
+        try:
+            yield "retry: 3000\n"
+            if por_rangos:
+                yield "event: resincronizar\ndata: {}\n\n"
+            else:
+                yield f"event: snapshot\ndata: {json.dumps(inicial)}\n\n"
+            duracion = _sse_max_segundos()
+            ping = min(SSE_PING_SEGUNDOS, duracion / 2)
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin:
+                try:
+                    msg = q.get(timeout=ping)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if msg == eventos.RESINCRONIZAR and por_rangos:
+                    yield "event: resincronizar\ndata: {}\n\n"
+                elif msg == eventos.RESINCRONIZAR:
+                    with conexion() as c2:
+                        snap = obtener_snapshot(c2.cursor(), rifa_id, cifras)
+                    yield f"event: snapshot\ndata: {json.dumps(snap.payload())}\n\n"
+                else:
+                    yield f"event: cambios\ndata: {msg}\n\n"
+        finally:
+            eventos.desuscribir(rifa_id, q)
+
+    return Response(_stream(), mimetype="text/event-stream", headers={
+        "X-Accel-Buffering": "no",
+    })
 
 # ------- GENERAR PAGO (SELECCIÓN + DATOS CLIENTE) ---
+# "N al azar": máximo por compra y reintentos si la foto del talonario estaba
+# atrasada y no alcanzaron los candidatos
+AZAR_MAX_NUMEROS = int(os.getenv("AZAR_MAX_NUMEROS", "20"))
+AZAR_REINTENTOS = int(os.getenv("AZAR_REINTENTOS", "3"))
+
 @app.route("/generar-pago", methods=["POST"])
 def generar_pago():
     """
-    1) Valida datos y rifa activa
-    2) Limpia reservas vencidas
-    3) Verifica disponibilidad y RESERVA con expiración
-    4) Crea/actualiza comprador y compra 'pendiente'
-    5) Genera link Wompi (producción o sandbox)
+    1) Valida datos, rifa activa y llaves Wompi (una sola consulta rifa+negocio)
+    2) (las reservas vencidas cuentan como disponibles; no se limpian aquí)
+    3) En UNA sentencia (reservar_y_crear_compra): RESERVA todos los números o
+       ninguno, crea/actualiza comprador y crea compra 'pendiente'.
+       Sin 'numeros' y con 'azar=N' se eligen N disponibles al azar
+       (talonario/azar.py) y se reservan en esa misma sentencia.
+    4) Genera link Wompi (producción o sandbox) y recién ahí hace COMMIT
     * Ajuste: Comisión Wompi 50/50 -> al monto cobrado al comprador se suma la mitad de la comisión estimada.
       - La comisión se estima como: total * WOMPI_FEE_PCT + WOMPI_FEE_FIX
       - WOMPI_FEE_PCT (float, ej 0.0299) y WOMPI_FEE_FIX (int, ej 900) vienen de variables de entorno.
@@ -676,87 +1281,47 @@ def generar_pago():
     except Exception:
         return jsonify({"ok": False, "error": "Rifa inválida"}), 400
 
-    numeros_req = [x.strip() for x in (data.get("numeros", "")).split(",") if x.strip()]
+    # sin duplicados, conservando el orden en que el comprador los eligió
+    numeros_req = list(dict.fromkeys(x.strip() for x in (data.get("numeros", "")).split(",") if x.strip()))
     nombre   = (data.get("nombre") or "").strip()
     cedula   = (data.get("cedula") or "").strip()
     correo   = (data.get("correo") or "").strip()
     telefono = (data.get("telefono") or "").strip()
 
-    if not (rifa_id and numeros_req and nombre and cedula and correo and telefono):
+    azar = 0
+    if not numeros_req:
+        try:
+            azar = int(data.get("azar") or 0)
+        except ValueError:
+            azar = 0
+        if azar > AZAR_MAX_NUMEROS:
+            return jsonify({"ok": False, "error": f"Máximo {AZAR_MAX_NUMEROS} números al azar por compra"}), 400
+
+    if not (rifa_id and (numeros_req or azar > 0) and nombre and cedula and correo and telefono):
         return jsonify({"ok": False, "error": "Datos incompletos"}), 400
 
     con = db(); cur = con.cursor(cursor_factory=RealDictCursor)
 
-    # 1) Rifa activa
-    cur.execute("SELECT * FROM rifas WHERE id = %s AND estado='activa'", (rifa_id,))
+    # 1) Rifa activa + llaves Wompi del negocio
+    cur.execute("""
+        SELECT r.id, r.nombre, r.valor_numero, r.id_negocio, r.cifras,
+               n.public_key_wompi, n.private_key_wompi,
+               n.integrity_secret_wompi, n.checkout_url_wompi
+          FROM rifas r
+          JOIN negocios n ON n.id = r.id_negocio
+         WHERE r.id = %s AND r.estado='activa'
+    """, (rifa_id,))
     rifa = cur.fetchone()
     if not rifa:
         con.close()
         return jsonify({"ok": False, "error": "Rifa no disponible"}), 400
 
-    # 2) Limpia reservas vencidas
-    con.commit(); con.close()
-    liberar_reservas_expiradas(rifa_id)
-
-    con = db(); cur = con.cursor(cursor_factory=RealDictCursor)
-
-    # Carga negocio
-    cur.execute("SELECT * FROM negocios WHERE id = %s", (rifa["id_negocio"],))
-    negocio = cur.fetchone()
-
-    # 3) Validar disponibilidad
-    qmarks = ",".join(["%s"] * len(numeros_req))
-    cur.execute(f"""
-        SELECT id, numero, estado FROM numeros
-        WHERE id_rifa = %s AND numero IN ({qmarks})
-    """, (rifa_id, *numeros_req))
-    filas = cur.fetchall()
-
-    if len(filas) != len(numeros_req) or any(row["estado"] != "disponible" for row in filas):
-        con.close()
-        return jsonify({"ok": False, "error": "Alguno de los números ya no está disponible"}), 409
-
-    # 3b) Reservar con expiración
-    limite = datetime.now() + timedelta(minutes=RESERVA_MINUTOS)
-    ids_numeros = [row["id"] for row in filas]
-    cur.executemany(
-        "UPDATE numeros SET estado='reservado', reservado_hasta=%s WHERE id = %s",
-        [(limite, i) for i in ids_numeros]
-    )
-
-    # 4) Crear/actualizar comprador
-    cur.execute("SELECT id FROM compradores WHERE cedula = %s", (cedula,))
-    cmp = cur.fetchone()
-    if cmp:
-        comprador_id = cmp["id"] if isinstance(cmp, dict) else cmp[0]
-        cur.execute(
-            "UPDATE compradores SET nombre=%s, correo=%s, telefono=%s WHERE id=%s",
-            (nombre, correo, telefono, comprador_id)
-        )
-    else:
-        cur.execute(
-            "INSERT INTO compradores (nombre, cedula, correo, telefono) VALUES (%s, %s, %s, %s) RETURNING id",
-            (nombre, cedula, correo, telefono)
-        )
-        comprador_id = cur.fetchone()["id"]
-
-    # 4b) Crear compra pendiente (total BASE sin recargo; NO tocamos tu contabilidad)
-    total = int(rifa["valor_numero"]) * len(numeros_req)
-    numeros_str = ",".join(numeros_req)
-    cur.execute("""
-        INSERT INTO compras (id_comprador, id_rifa, numeros, total, fecha, estado)
-        VALUES (%s, %s, %s, %s, %s, 'pendiente')
-        RETURNING id
-    """, (comprador_id, rifa_id, numeros_str, total, datetime.now()))
-    compra_id = cur.fetchone()["id"]
-    con.commit()
-
-    # 5) Link de pago (ACEPTA PRODUCCIÓN o PRUEBA)
+    # Link de pago (ACEPTA PRODUCCIÓN o PRUEBA): se valida ANTES de reservar
     def _clean(s): return (s or "").strip()
-    pub = _clean(negocio.get("public_key_wompi", ""))
-    prv = _clean(negocio.get("private_key_wompi", ""))
-    itg = _clean(negocio.get("integrity_secret_wompi", ""))
-    chk = _clean(negocio.get("checkout_url_wompi", ""))
+    pub = _clean(rifa.get("public_key_wompi", ""))
+    prv = _clean(rifa.get("private_key_wompi", ""))
+    itg = _clean(rifa.get("integrity_secret_wompi", ""))
+    chk = _clean(rifa.get("checkout_url_wompi", ""))
 
     is_prod = pub.startswith("pub_prod_") and prv.startswith("prv_prod_") and itg.startswith("prod_integrity_")
     is_test = pub.startswith("pub_test_") and prv.startswith("prv_test_") and itg.startswith("test_integrity_")
@@ -766,13 +1331,44 @@ def generar_pago():
     elif is_test:
         wompi_env = "sandbox"   # ambiente de pruebas
     else:
-        # liberar reservas y eliminar compra si las llaves no matchean ningún esquema
-        qin = ",".join(["%s"] * len(ids_numeros))
-        cur.execute(f"UPDATE numeros SET estado='disponible', reservado_hasta=NULL WHERE id IN ({qin})", ids_numeros)
-        cur.execute("DELETE FROM compras WHERE id = %s", (compra_id,))
-        con.commit(); con.close()
+        con.close()
         return jsonify({"ok": False, "error": "Llaves Wompi inválidas. Usa pub_prod_/prv_prod_/prod_integrity_ o pub_test_/prv_test_/test_integrity_."}), 400
 
+    # 3) Reserva atómica + comprador + compra pendiente (total BASE sin recargo)
+    if azar:
+        total = int(rifa["valor_numero"]) * azar
+        res = None
+        for _ in range(AZAR_REINTENTOS):
+            snap = obtener_snapshot(con.cursor(), rifa_id, int(rifa["cifras"]))
+            candidatos = candidatos_al_azar(snap, azar)
+            if candidatos is None:
+                break  # no quedan suficientes disponibles
+            res = reservar_y_crear_compra(
+                cur, rifa_id, candidatos, total,
+                nombre=nombre, cedula=cedula, correo=correo, telefono=telefono,
+                cantidad=azar,
+            )
+            if res:
+                break
+            # la foto estaba atrasada: deshacer lo reservado y muestrear de nuevo
+            con.rollback()
+            invalidar_snapshot(rifa_id)
+        if not res:
+            con.close()
+            return jsonify({"ok": False, "error": f"No quedan {azar} números disponibles"}), 409
+        numeros_req = res["numeros"]
+    else:
+        total = int(rifa["valor_numero"]) * len(numeros_req)
+        res = reservar_y_crear_compra(
+            cur, rifa_id, numeros_req, total,
+            nombre=nombre, cedula=cedula, correo=correo, telefono=telefono,
+        )
+        if not res:
+            con.close()  # rollback: no queda nada reservado
+            return jsonify({"ok": False, "error": "Alguno de los números ya no está disponible"}), 409
+    numeros_str = ",".join(numeros_req)
+    compra_id = res["compra_id"]
+
     # ====== AJUSTE 50/50 COMISIÓN WOMPI (solo para lo que paga el comprador) ======
     # Estimación configurable por entorno (por defecto 2.99% + 900 COP)
     try:
@@ -808,37 +1404,119 @@ def generar_pago():
             wompi_integrity_secret=itg,
             wompi_checkout_base=chk or "https://checkout.wompi.co/p/"
         )
-        con.close()
-        return jsonify({"ok": True, "checkout_url": checkout_url})
     except Exception as e:
-        # liberar reservas y borrar compra si algo falla
-        qin = ",".join(["%s"] * len(ids_numeros))
-        cur.execute(f"UPDATE numeros SET estado='disponible', reservado_hasta=NULL WHERE id IN ({qin})", ids_numeros)
-        cur.execute("DELETE FROM compras WHERE id = %s", (compra_id,))
-        con.commit(); con.close()
+        # rollback: se deshacen reserva, comprador y compra en un solo paso
+        con.close()
         return jsonify({"ok": False, "error": f"No se pudo generar el link de pago: {e}"}), 500
-        
+
+    con.commit(); con.close()
+    invalidar_snapshot(rifa_id)
+    return jsonify({"ok": True, "checkout_url": checkout_url, "numeros": numeros_req})
+
+# ================== CACHE HTTP ==================
+# - /static/...?v=<huella>: la huella es un hash del contenido, así que la URL
+#   cambia cuando cambia el archivo -> cache de un año e 'immutable'.
+# - /static sin huella (o con una vieja): se revalida con ETag/Last-Modified.
+# - /uploads/<archivo>: nombres únicos (hash del contenido) -> cache larga; ETag, Last-Modified
+#   y 304 con If-None-Match / If-Modified-Since.
+# - Todo lo demás (páginas dinámicas y de sesión): no-store.
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+_huellas_static = {}  # ruta absoluta -> (mtime_ns, tamaño, huella)
+
+def huella_archivo(ruta: str) -> str | None:
+    """Hash corto del contenido; se recalcula solo si cambia mtime o tamaño."""
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    previa = _huellas_static.get(ruta)
+    if previa and previa[0] == st.st_mtime_ns and previa[1] == st.st_size:
+        return previa[2]
+    h = hashlib.md5(usedforsecurity=False)
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(64 * 1024), b""):
+            h.update(bloque)
+    huella = h.hexdigest()[:12]
+    _huellas_static[ruta] = (st.st_mtime_ns, st.st_size, huella)
+    return huella
+
+def _ruta_static(filename: str) -> str | None:
+    return safe_join(app.static_folder, filename) if filename else None
+
+@app.url_defaults
+def _huella_url_static(endpoint, values):
+    """url_for('static', filename=...) agrega ?v=<huella> automáticamente."""
+    if endpoint == "static" and "v" not in values:
+        ruta = _ruta_static(values.get("filename"))
+        huella = huella_archivo(ruta) if ruta else None
+        if huella:
+            values["v"] = huella
+
 @app.after_request
-def no_cache(resp):
+def cabeceras_cache(resp):
+    if request.endpoint == "static":
+        ruta = _ruta_static(request.view_args.get("filename"))
+        v = request.args.get("v")
+        if v and ruta and v == huella_archivo(ruta):
+            resp.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        else:
+            resp.headers["Cache-Control"] = "public, no-cache"
+        return resp
+    if request.endpoint == "uploaded_file":
+        resp.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        return resp
     resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp.headers["Pragma"] = "no-cache"
     resp.headers["Expires"] = "0"
     return resp
 
-@app.before_request
-def _auto_archivar_hook():
-    # Corre en cada request (consulta rápida). Si quieres,
-    # podrías cachear por minuto con session o app.config.
-    archivar_rifas_vencidas()
+# ================== TAREAS EN SEGUNDO PLANO ==================
+# El archivado de rifas vencidas ya NO corre en cada request: un hilo por
+# worker lo ejecuta cada ARCHIVAR_INTERVALO_SEGUNDOS (o justo en la próxima
+# fecha_fin) y un advisory lock de Postgres evita que dos workers lo hagan a la vez.
+ARCHIVAR_INTERVALO_SEGUNDOS = float(os.getenv("ARCHIVAR_INTERVALO_SEGUNDOS", "60"))
+
+# Igual para las reservas vencidas: un liberador de fondo las devuelve a
+# 'disponible' en lotes; las lecturas ya las tratan como disponibles.
+LIBERAR_INTERVALO_SEGUNDOS = float(os.getenv("LIBERAR_INTERVALO_SEGUNDOS", "30"))
+
+planificador.registrar(planificador.TareaPeriodica(
+    "archivar_rifas", ARCHIVAR_INTERVALO_SEGUNDOS,
+    archivar_rifas_vencidas, planificador.LOCK_ARCHIVAR_RIFAS,
+))
+planificador.registrar(planificador.TareaPeriodica(
+    "liberar_reservas", LIBERAR_INTERVALO_SEGUNDOS,
+    liberar_reservas_vencidas, planificador.LOCK_LIBERAR_RESERVAS,
+))
+planificador.iniciar_tareas()
 
 # ---------------- WEBHOOK PAGO ----------------------
+# Estado de la compra según el estado de la transacción de Wompi, y orden en
+# que puede avanzar (nunca retrocede).
+ESTADO_COMPRA_POR_TX = {
+    "APPROVED": "pagado",
+    "DECLINED": "rechazado",
+    "VOIDED":   "rechazado",
+    "ERROR":    "rechazado",
+}
+# 'conflicto': pagada, pero algún número ya era de otra compra (revisar/reembolsar)
+RANGO_ESTADO_COMPRA = {"pendiente": 0, "rechazado": 1, "pagado": 2, "conflicto": 2}
+
 @app.route("/webhook-pago", methods=["POST"])
 def webhook_pago():
     """
-    Wompi envía un evento -> verificamos y cerramos compra:
-    - Si 'APPROVED' -> compra=pagado, números=pagado, reservado_hasta=NULL
-    - Si 'DECLINED' / 'VOIDED' / 'ERROR' -> números=disponible, id_comprador=NULL, reservado_hasta=NULL
-    Además: envía WhatsApp y correos HTML (cliente y admin) con logo y datos dinámicos.
+    Wompi envía un evento -> verificamos y cerramos compra (idempotente):
+    - Cada (transacción, estado) se anota en wompi_eventos; un reintento choca
+      con la UNIQUE y responde de inmediato, sin tocar numeros ni notificar.
+    - compras.estado solo avanza (pendiente -> rechazado -> pagado): un
+      DECLINED tardío no libera números de una compra ya pagada.
+    - Si 'APPROVED' -> compra=pagado, números=pagado, reservado_hasta=NULL.
+      Un APPROVED tardío no le quita a otra compra un número ya pagado ni uno
+      con reserva vigente; si faltan números la compra queda 'conflicto' y el
+      detalle se anota en wompi_eventos.
+    - Si 'DECLINED' / 'VOIDED' / 'ERROR' -> compra=rechazado y se liberan los
+      números que sigan con ESTA reserva
+    Además: encola (outbox) WhatsApp y correos HTML (cliente y admin) con logo y datos dinámicos.
     """
     evento = request.get_json(silent=True) or {}
     result = verificar_evento_webhook(evento)
@@ -848,112 +1526,208 @@ def webhook_pago():
     reference = result["reference"]  # compra_x
     estado_tx = result["status"]     # APPROVED / DECLINED / VOIDED / ERROR
 
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-
     # Solo procesamos referencias del tipo compra_#
     if not reference.startswith("compra_"):
-        con.close()
         return jsonify({"ok": True}), 200
 
     try:
         compra_id = int(reference.split("_")[1])
     except Exception:
-        con.close()
         return jsonify({"ok": True}), 200
 
-    # Traemos también link_publico para el correo del cliente
+    nuevo_estado = ESTADO_COMPRA_POR_TX.get(estado_tx)
+    if nuevo_estado is None:
+        return jsonify({"ok": True}), 200  # PENDING u otros: nada que cerrar
+
+    con = db()
+    cur = con.cursor(cursor_factory=RealDictCursor)
+
+    # 0) Ledger: si este (transacción, estado) ya se procesó, no hay nada que hacer.
+    #    Un reintento concurrente espera aquí al primero y luego cae en el conflicto.
+    cur.execute("""
+        INSERT INTO wompi_eventos (id_transaccion, estado, referencia)
+        VALUES (%s, %s, %s)
+        ON CONFLICT ON CONSTRAINT wompi_eventos_unq DO NOTHING
+        RETURNING id
+    """, (result.get("transaction_id") or reference, estado_tx, reference))
+    evento_row = cur.fetchone()
+    if not evento_row:
+        con.close()
+        return jsonify({"ok": True, "duplicado": True}), 200
+    evento_id = evento_row["id"]
+
+    # Traemos también link_publico para el correo del cliente.
+    # FOR UPDATE: dos eventos distintos de la misma compra se aplican de a uno.
     cur.execute("""
         SELECT c.*, r.id_negocio, r.nombre, r.valor_numero, r.id AS rifa_id, r.link_publico
           FROM compras c
           JOIN rifas r ON r.id = c.id_rifa
          WHERE c.id = %s
+           FOR UPDATE OF c
     """, (compra_id,))
     compra = cur.fetchone()
     if not compra:
-        con.close()
+        _cerrar_evento_wompi(cur, evento_id, None, None, None, "ignorado")
+        con.commit(); con.close()
         return jsonify({"ok": True}), 200
 
+    estado_antes = compra["estado"] or "pendiente"
+    if RANGO_ESTADO_COMPRA[nuevo_estado] <= RANGO_ESTADO_COMPRA.get(estado_antes, 0):
+        # retroceso (p. ej. DECLINED después de APPROVED) o repetido con otro id de transacción
+        _cerrar_evento_wompi(cur, evento_id, compra_id, estado_antes, estado_antes, "ignorado")
+        con.commit(); con.close()
+        return jsonify({"ok": True, "ignorado": True}), 200
+
     # Cargar negocio y comprador (para notificaciones)
     cur.execute("SELECT * FROM negocios WHERE id = %s", (compra["id_negocio"],))
     negocio = cur.fetchone()
     cur.execute("SELECT * FROM compradores WHERE id = %s", (compra["id_comprador"],))
     comprador = cur.fetchone()
 
-    numeros_lista = [x.strip() for x in (compra["numeros"] or "").split(",") if x.strip()]
-
-    if estado_tx == "APPROVED":
-        # 1) marcar compra como pagada
-        cur.execute("UPDATE compras SET estado='pagado' WHERE id = %s", (compra_id,))
-        # 2) bloquear números
-        if numeros_lista:
-            qmarks = ",".join(["%s"] * len(numeros_lista))
-            cur.execute(f"""
-                UPDATE numeros
-                   SET estado='pagado', id_comprador=%s, reservado_hasta=NULL
-                 WHERE id_rifa=%s AND numero IN ({qmarks})
-            """, (compra["id_comprador"], compra["rifa_id"], *numeros_lista))
-
-        # 3) notificar (WhatsApp + correos HTML con logo/plantillas)
-        try:
-            # --- WhatsApp (simple, como ya lo tenías) ---
-            msg_cli = (f"🎉 ¡Pago aprobado!\nRifa: {compra['nombre']}\n"
-                       f"Números: {compra['numeros']}\nTotal: ${compra['total']}\n¡Suerte!")
-            if comprador and comprador.get("telefono"):
-                enviar_whatsapp(comprador["telefono"], msg_cli)
-
-            msg_admin = (f"✅ Pago recibido\nCliente: {comprador.get('nombre', '—')}\n"
-                         f"Números: {compra['numeros']}\nTotal: ${compra['total']}")
-            if negocio and negocio.get("celular"):
-                enviar_whatsapp(negocio["celular"], msg_admin)
-
-            # --- Correos bonitos (HTML) con plantillas ---
-            # Base absoluta para recursos en correo
-            base_url = (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
-            logo_url = f"{base_url}/static/img/geica-logo.png"
-            link_publico = f"{base_url}/r/{compra['link_publico']}"
-            link_admin = f"{base_url}/panel"
-
-            # Contexto para las plantillas
-            ctx = {
-                "logo_url": logo_url,
-                "rifa": {"nombre": compra["nombre"]},
-                "compra": compra,
-                "negocio": negocio,
-                "comprador": comprador,
-                "numeros_lista": numeros_lista,
-                "link_publico": link_publico,
-                "link_admin": link_admin,
-            }
-
-            # Cliente (si tiene correo)
-            if comprador and comprador.get("correo"):
-                html_cliente = render_template("email_compra.html", **ctx)
-                enviar_correo(comprador["correo"], "🎉 Compra confirmada", html_cliente)
-
-            # Admin del negocio (si tiene correo)
-            if negocio and negocio.get("correo"):
-                html_admin = render_template("email_admin.html", **ctx)
-                enviar_correo(negocio["correo"], "✅ Nueva compra confirmada", html_admin)
-
-        except Exception as e:
-            print("Error enviando notificaciones:", e)
+    resultado, estado_final, detalle = "aplicado", nuevo_estado, None
 
-    else:
-        # Rechazado/anulado -> liberar números y dejar compra como pendiente
-        if numeros_lista:
-            qmarks = ",".join(["%s"] * len(numeros_lista))
-            cur.execute(f"""
-                UPDATE numeros
-                   SET estado='disponible', id_comprador=NULL, reservado_hasta=NULL
-                 WHERE id_rifa=%s AND numero IN ({qmarks})
-            """, (compra["rifa_id"], *numeros_lista))
-        cur.execute("UPDATE compras SET estado='pendiente' WHERE id = %s", (compra_id,))
+    if nuevo_estado == "pagado":
+        # 1) bloquear números (por id, vía compra_numeros). Nunca se pisa un
+        #    número ya pagado por otro comprador ni uno que una compra más nueva
+        #    tiene reservado y vigente (esta reserva venció y alguien lo tomó).
+        cur.execute("""
+            WITH enlace AS (
+                SELECT n.id, n.numero
+                  FROM compra_numeros cn
+                  JOIN numeros n ON n.id = cn.id_numero
+                 WHERE cn.id_compra = %(compra)s
+            ),
+            pagados AS (
+                UPDATE numeros n
+                   SET estado='pagado', id_comprador=%(comprador)s, reservado_hasta=NULL
+                  FROM enlace e
+                 WHERE n.id = e.id
+                   AND (n.estado <> 'pagado' OR n.id_comprador = %(comprador)s)
+                   AND NOT (n.estado = 'reservado' AND n.reservado_hasta >= NOW()
+                            AND EXISTS (SELECT 1 FROM compra_numeros otra
+                                         WHERE otra.id_numero = n.id
+                                           AND otra.id_compra > %(compra)s))
+             RETURNING n.numero
+            )
+            SELECT (SELECT array_agg(numero ORDER BY numero) FROM enlace)  AS numeros,
+                   (SELECT array_agg(numero ORDER BY numero) FROM pagados) AS pagados
+        """, {"compra": compra_id, "comprador": compra["id_comprador"]})
+        fila = cur.fetchone()
+        numeros_lista = list(fila["numeros"] or [])
+        obtenidos = set(fila["pagados"] or [])
+        faltantes = [n for n in numeros_lista if n not in obtenidos]
+        if faltantes:
+            resultado, estado_final = "conflicto", "conflicto"
+            detalle = (f"pagada sin los números {','.join(faltantes)}: ya eran de otra "
+                       f"compra, revisar/reembolsar")
+
+        # 2) marcar la compra (el dinero ya entró, con o sin todos sus números)
+        cur.execute("UPDATE compras SET estado=%s, id_pago=%s WHERE id = %s",
+                    (estado_final, result.get("transaction_id") or None, compra_id))
+
+        # 3) notificar (WhatsApp + correos HTML con logo/plantillas) vía OUTBOX:
+        #    se encola en ESTA misma transacción y lo envía el despachador
+        #    (python -m notificaciones.despachador), así el webhook responde ya.
+        #    Cada notificación va en su SAVEPOINT: si una falla, se deshace solo
+        #    esa y queda anotada en wompi_eventos.detalle; el pago se confirma igual.
+        fallos = []
+        clave = f"compra_{compra_id}"
+
+        # --- WhatsApp (simple, como ya lo tenías) ---
+        msg_cli = (f"🎉 ¡Pago aprobado!\nRifa: {compra['nombre']}\n"
+                   f"Números: {compra['numeros']}\nTotal: ${compra['total']}\n¡Suerte!")
+        if comprador and comprador.get("telefono"):
+            _encolar_en_savepoint(cur, fallos, f"{clave}:wa_cliente", lambda k: encolar_notificacion(
+                cur, "whatsapp", comprador["telefono"], msg_cli, clave=k))
+
+        msg_admin = (f"✅ Pago recibido\nCliente: {(comprador or {}).get('nombre', '—')}\n"
+                     f"Números: {compra['numeros']}\nTotal: ${compra['total']}")
+        if detalle:
+            msg_admin += f"\n⚠️ Compra {compra_id} {detalle}"
+        if negocio and negocio.get("celular"):
+            _encolar_en_savepoint(cur, fallos, f"{clave}:wa_admin", lambda k: encolar_notificacion(
+                cur, "whatsapp", negocio["celular"], msg_admin, clave=k))
+
+        # --- Correos bonitos (HTML) con plantillas ---
+        # Base absoluta para recursos en correo
+        base_url = (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
+        logo_url = f"{base_url}/static/img/geica-logo.png"
+        link_publico = f"{base_url}/r/{compra['link_publico']}"
+        link_admin = f"{base_url}/panel"
+
+        # Contexto para las plantillas
+        ctx = {
+            "logo_url": logo_url,
+            "rifa": {"nombre": compra["nombre"]},
+            "compra": compra,
+            "negocio": negocio,
+            "comprador": comprador,
+            "numeros_lista": numeros_lista,
+            "link_publico": link_publico,
+            "link_admin": link_admin,
+        }
+
+        # Cliente (si tiene correo)
+        if comprador and comprador.get("correo"):
+            _encolar_en_savepoint(cur, fallos, f"{clave}:correo_cliente", lambda k: encolar_notificacion(
+                cur, "correo", comprador["correo"], render_template("email_compra.html", **ctx),
+                asunto="🎉 Compra confirmada", clave=k))
+
+        # Admin del negocio (si tiene correo)
+        if negocio and negocio.get("correo"):
+            _encolar_en_savepoint(cur, fallos, f"{clave}:correo_admin", lambda k: encolar_notificacion(
+                cur, "correo", negocio["correo"], render_template("email_admin.html", **ctx),
+                asunto="✅ Nueva compra confirmada", clave=k))
+
+        if fallos:
+            detalle = "; ".join(([detalle] if detalle else []) +
+                                [f"notificación sin encolar: {f}" for f in fallos])
 
+    else:
+        # Rechazado/anulado -> liberar solo los números cuya reserva sigue siendo
+        # de ESTA compra: si una compra posterior los volvió a reservar (tras
+        # vencer esta), la relación compra_numeros más nueva es la que manda.
+        cur.execute("""
+            UPDATE numeros n
+               SET estado='disponible', id_comprador=NULL, reservado_hasta=NULL
+              FROM compra_numeros cn
+             WHERE cn.id_compra = %s
+               AND n.id = cn.id_numero
+               AND n.estado = 'reservado'
+               AND NOT EXISTS (SELECT 1 FROM compra_numeros otra
+                                WHERE otra.id_numero = n.id AND otra.id_compra > cn.id_compra)
+        """, (compra_id,))
+        cur.execute("UPDATE compras SET estado='rechazado' WHERE id = %s", (compra_id,))
+
+    _cerrar_evento_wompi(cur, evento_id, compra_id, estado_antes, estado_final, resultado, detalle)
     con.commit()
     con.close()
+    invalidar_snapshot(compra["rifa_id"])
     return jsonify({"ok": True}), 200
 
+def _encolar_en_savepoint(cur, fallos, clave, encolar):
+    """
+    Corre encolar(clave) dentro de un SAVEPOINT de la transacción del webhook.
+    Si falla (error de la base, de la plantilla...), se deshace solo ese paso,
+    la transacción sigue usable y el error queda en 'fallos' para el detalle.
+    """
+    cur.execute("SAVEPOINT notificacion")
+    try:
+        encolar(clave)
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT notificacion")
+        fallos.append(f"{clave}: {e}"[:300])
+        app.logger.exception("No se pudo encolar la notificación %s", clave)
+    else:
+        cur.execute("RELEASE SAVEPOINT notificacion")
+
+def _cerrar_evento_wompi(cur, evento_id, compra_id, antes, despues, resultado, detalle=None):
+    cur.execute("""
+        UPDATE wompi_eventos
+           SET id_compra=%s, compra_antes=%s, compra_despues=%s, resultado=%s, detalle=%s
+         WHERE id=%s
+    """, (compra_id, antes, despues, resultado, detalle, evento_id))
+
 # --------------- NOTIFICAR GANADOR ------------------
 @app.route("/notificar-ganador", methods=["GET", "POST"])
 def notificar_ganador():
@@ -999,17 +1773,20 @@ def notificar_ganador():
             flash("El número no corresponde a un comprador pagado.", "danger")
             return redirect(url_for("notificar_ganador"))
 
-        # 4) Notificar ganador
+        # 4) Notificar ganador (outbox: lo envía el despachador con reintentos)
         msg_txt = (f"🎉 ¡Felicidades! Eres el ganador de la rifa '{nombre_rifa}' "
                    f"con el número {numero_norm}. Pronto te contactarán.")
         try:
+            con = db(); cur = con.cursor()
             if fila.get("comprador_tel"):
-                enviar_whatsapp(fila["comprador_tel"], msg_txt)
+                encolar_notificacion(cur, "whatsapp", fila["comprador_tel"], msg_txt)
             if fila.get("comprador_correo"):
-                enviar_correo(fila["comprador_correo"], "¡Eres el ganador!", msg_txt)
+                encolar_notificacion(cur, "correo", fila["comprador_correo"], msg_txt,
+                                     asunto="¡Eres el ganador!")
+            con.commit(); con.close()
             flash("Ganador notificado con éxito.", "success")
-        except Exception as e:
-            print("Error notificando ganador:", e)
+        except Exception:
+            app.logger.exception("Error notificando ganador de la rifa %r", nombre_rifa)
             flash("No se pudo notificar al ganador.", "danger")
 
         return redirect(url_for("panel"))
@@ -1023,7 +1800,9 @@ def notificar_ganador():
 # --------------- ARCHIVOS SUBIDOS -------------------
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_DIR, filename)
+    # conditional: ETag + Last-Modified y 304 si el navegador ya lo tiene
+    return send_from_directory(UPLOAD_DIR, filename, conditional=True, etag=True,
+                               max_age=STATIC_MAX_AGE)
 
 # ================== MANEJO DE ERRORES ===============
 @app.errorhandler(404)
@@ -1067,21 +1846,18 @@ def soporte():
     return redirect(SOPORTE_URL)
 
 def rifas_resumen_por_negocio(negocio_id: int):
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT
-            r.id, r.nombre, r.descripcion, r.valor_numero, r.cifras, r.cantidad_numeros,
-            r.estado, r.link_publico,
-            (SELECT COUNT(*) FROM numeros n WHERE n.id_rifa = r.id) AS total,
-            (SELECT COUNT(*) FROM numeros n WHERE n.id_rifa = r.id AND n.estado='pagado') AS vendidos
-          FROM rifas r
-         WHERE r.id_negocio = %s
-         ORDER BY r.id DESC
-    """, (negocio_id,))
-    rows = cur.fetchall()
-    con.close()
-    return rows
+    with db().cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT
+                r.id, r.nombre, r.descripcion, r.valor_numero, r.cifras, r.cantidad_numeros,
+                r.estado, r.link_publico,
+                s.total, s.pagados AS vendidos
+              FROM rifas r
+              {SQL_JOIN_STATS}
+             WHERE r.id_negocio = %s
+             ORDER BY r.id DESC
+        """, (negocio_id,))
+        return cur.fetchall()
 
 @app.route("/panel")
 def panel():
@@ -1104,6 +1880,11 @@ def gracias():
     </div>
     """
 # ---------------- WHATSAPP BOT (Twilio Webhook) ----------------------
+# Los tres webhooks comparten la resolución del negocio y el motor de
+# intenciones (responder_bot); solo cambia cómo sale la respuesta.
+BOT_SIN_NEGOCIO = ("Hola 👋\nNo pude identificar el negocio. Por favor escribe *@NOMBRE* "
+                   "del negocio o pega el *link público* de la rifa.")
+
 def _clean_wa(s: str) -> str:
     if not s: 
         return ""
@@ -1113,357 +1894,50 @@ def _clean_wa(s: str) -> str:
 def _base_url() -> str:
     return (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
 
-def _render_template_text(tpl: str, negocio: dict, rifa: dict | None = None) -> str:
-    # Mini render de placeholders sencillos
-    out = tpl or ""
-    pairs = {
-        "{{negocio.nombre_negocio}}": (negocio or {}).get("nombre_negocio", ""),
-        "{{negocio.celular}}":       (negocio or {}).get("celular", ""),
-        "{{negocio.correo}}":        (negocio or {}).get("correo", ""),
-        "{{app.base_url}}":          _base_url(),
-    }
-    if rifa:
-        pairs.update({
-            "{{rifa.nombre}}":        rifa.get("nombre", ""),
-            "{{rifa.valor_numero}}":  str(rifa.get("valor_numero", "")),
-        })
-    for k, v in pairs.items():
-        out = out.replace(k, str(v))
-    return out
-
-@app.post("/bot/whatsapp")
-def bot_whatsapp():
+def negocio_para_bot(wa_to: str, body: str):
     """
-    Webhook Twilio (WhatsApp). Se adapta por negocio:
-    - Primero intenta identificar por 'To' (un número de Twilio por negocio) -> Modo A.
-    - Si no se puede, intenta deducir por el cuerpo del mensaje (@alias, /r/<link>, nombre) -> Modo B.
-    Responde con intents básicos: menu, comprar, estado <num>, rifas, ayuda.
+    Negocio ACTIVO que atiende el mensaje:
+    - Modo A: por el número receptor 'To' (un número de Twilio por negocio).
+    - Modo B: número compartido -> se deduce del texto (@alias, /r/<link>, nombre).
     """
-    # Twilio manda datos en form-encoded
-    body = (request.form.get("Body") or "").strip()
-    wa_to = (request.form.get("To") or "").strip()       # whatsapp:+1415...
-    wa_from = (request.form.get("From") or "").strip()   # whatsapp:+57...
-
-    # 1) Identificar negocio
     negocio = find_negocio_by_twilio_to(wa_to) or find_negocio_by_hint(body)
-    if not negocio:
-        # Menú genérico si no logramos mapear
-        resp = MessagingResponse()
-        resp.message("Hola 👋\nNo pude identificar el negocio. Por favor escribe *@NOMBRE* del negocio o pega el *link público* de la rifa.")
-        return str(resp)
-
-    base_url = (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
-
-    txt = body.lower()
-
-    # Intents directos
-    if txt in ("menu", "hola", "hi", "buenas", "start", "inicio", "ayuda"):
-        reply = bot_menu_text(negocio)
-
-    elif txt.startswith("comprar") or txt in ("1", "compra"):
-        # devolver rifas + CTA
-        reply = bot_rifas_activas_text(negocio["id"], base_url)
-
-    elif txt.startswith("rifas") or txt == "3":
-        reply = bot_rifas_activas_text(negocio["id"], base_url)
-
-    elif txt.startswith("estado") or txt == "2":
-        # estado 05  / estado 1234
-        m = re.search(r'(?:estado\s+)?([0-9]{1,6})', txt)
-        if m:
-            numero = m.group(1)
-            reply = bot_estado_numero_text(negocio["id"], numero)
-        else:
-            reply = "Escribe: *estado 05* (o el número que quieras consultar)."
-
-    elif re.fullmatch(r'[0-9]{1,6}', txt):
-        # Si solo envían un número, asumimos consulta de estado:
-        reply = bot_estado_numero_text(negocio["id"], txt)
+    if not negocio or negocio.get("estado") != "activo":
+        return None
+    return negocio
 
-    else:
-        # Fallback configurable por negocio (bot_config) o menú
-        fallback = None
-        try:
-            # Si guardaste JSON en negocio.bot_config, puedes leer una respuesta por defecto:
-            # { "fallback": "Mensaje de ayuda..." }
-            bc = negocio.get("bot_config")
-            if isinstance(bc, dict):
-                fallback = bc.get("fallback")
-        except Exception:
-            pass
-        reply = fallback or bot_menu_text(negocio)
+def _mensaje_twilio():
+    """(texto, from, to) del form-encoded de Twilio."""
+    return ((request.form.get("Body") or "").strip(),
+            _clean_wa(request.form.get("From") or ""),    # 'whatsapp:+57...' → '+57...'
+            _clean_wa(request.form.get("To") or ""))      # número receptor (por negocio)
 
+@app.post("/bot/whatsapp")
+def bot_whatsapp():
+    """Webhook Twilio (WhatsApp) que responde en la misma petición (TwiML)."""
+    body, _wa_from, wa_to = _mensaje_twilio()
+    negocio = negocio_para_bot(wa_to, body)
     resp = MessagingResponse()
-    resp.message(reply)
+    for mensaje in (responder_bot(negocio, body) if negocio else [BOT_SIN_NEGOCIO]):
+        resp.message(mensaje)
     return str(resp)
 
-@app.post("/wa/webhook")
-def wa_webhook():
-    """
-    Webhook de Twilio (WhatsApp). Multi-negocio:
-    - Detecta negocio por el 'To' (tu número en Twilio).
-    - Responde intents básicos: 1) Ver rifas, 2) Disponibles, 3) Precio, 4) Ayuda
-    - Fallback configurable por negocio (JSON en negocios.bot_config)
-    """
-    # Twilio manda x-www-form-urlencoded
-    body = (request.form.get("Body") or "").strip().lower()
-    wa_from = _clean_wa(request.form.get("From") or "")   # 'whatsapp:+57...' → '+57...'
-    wa_to   = _clean_wa(request.form.get("To") or "")     # TU número Twilio (por negocio)
-
-    # 1) Resolver negocio por 'To'
-    con = db(); cur = con.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT * FROM negocios 
-         WHERE replace(coalesce(wa_numero_receptor, ''), ' ', '') = %s
-            OR replace(coalesce(wa_numero_receptor, ''), ' ', '') = %s
-            OR replace(coalesce(celular, ''), ' ', '') = %s
-         ORDER BY wa_numero_receptor DESC NULLS LAST
-         LIMIT 1
-    """, (wa_to, f"+{wa_to.lstrip('+')}", wa_to))
-    negocio = cur.fetchone()
-
-    if not negocio:
-        con.close()
-        # Sin negocio: respondemos genérico para no romper flujo
-        enviar_whatsapp(wa_from, "👋 Hola, no encuentro un negocio asociado a este número de WhatsApp.")
-        return ("", 204)
-
-    # 2) Cargar config de bot (JSONB) o defaults
-    bot_cfg = negocio.get("bot_config") or {}
-    if isinstance(bot_cfg, str):
-        import json
-        try: bot_cfg = json.loads(bot_cfg)
-        except Exception: bot_cfg = {}
-
-    greeting = bot_cfg.get("greeting") or "👋 ¡Hola! Soy el asistente de {{negocio.nombre_negocio}}.\n1️⃣ Ver rifas · 2️⃣ Disponibles · 3️⃣ Precio · 4️⃣ Ayuda"
-    menu     = bot_cfg.get("menu") or "1️⃣ Ver rifas · 2️⃣ Disponibles · 3️⃣ Precio · 4️⃣ Ayuda"
-    intents  = bot_cfg.get("intents") or {}
-    fallback = bot_cfg.get("fallback") or "No te entendí 🤖. Responde con 1, 2, 3 o 4."
-
-    # 3) Normalizar intención (números o palabras)
-    intent_key = None
-    if body in ("hola", "buenas", "hi", "hello", "menu", "menú", "inicio", "start"):
-        intent_key = "greet"
-    elif body in ("1", "rifas", "ver rifas"):
-        intent_key = "rifas"
-    elif body in ("2", "disponibles", "disponible"):
-        intent_key = "disponibles"
-    elif body in ("3", "precio", "precios", "valor"):
-        intent_key = "precio"
-    elif body in ("4", "ayuda", "soporte"):
-        intent_key = "ayuda"
-    elif "comprar" in body or "pagar" in body:
-        intent_key = "comprar"
-
-    # 4) Ejecutar intención
-    base_url = _base_url()
-
-    # Helper: última rifa activa del negocio
-    def _ultima_rifa():
-        cur.execute("""
-            SELECT * FROM rifas 
-             WHERE id_negocio=%s AND estado='activa'
-             ORDER BY id DESC LIMIT 1
-        """, (negocio["id"],))
-        return cur.fetchone()
-
-    # Helper: link público por rifa
-    def _link_publico(r):
-        if not r: 
-            return ""
-        return f"{base_url}/r/{r['link_publico']}"
-
-    # Intent greet / menú
-    if intent_key in (None, "greet"):
-        msg = _render_template_text(greeting, negocio)
-        enviar_whatsapp(wa_from, msg)
-        enviar_whatsapp(wa_from, menu)
-        con.close()
-        return ("", 204)
-
-    # Intent listar rifas
-    if intent_key == "rifas":
-        cur.execute("""
-            SELECT nombre, link_publico, valor_numero
-              FROM rifas
-             WHERE id_negocio=%s AND estado='activa'
-             ORDER BY id DESC
-             LIMIT 6
-        """, (negocio["id"],))
-        rifas = cur.fetchall()
-        if not rifas:
-            enviar_whatsapp(wa_from, "No hay rifas activas en este momento.")
-        else:
-            lines = ["🎟️ Rifas activas:"]
-            for r in rifas:
-                lines.append(f"• {r['nombre']} — $ {r['valor_numero']} COP\n{base_url}/r/{r['link_publico']}")
-            lines.append("\n" + menu)
-            enviar_whatsapp(wa_from, "\n".join(lines))
-        con.close()
-        return ("", 204)
-
-    # Intent disponibles (usa última rifa si no está configurado algo distinto)
-    if intent_key == "disponibles":
-        r = _ultima_rifa()
-        if not r:
-            enviar_whatsapp(wa_from, "No encuentro rifas activas.")
-            con.close(); return ("", 204)
-        # contar disponibles
-        cur.execute("""
-            SELECT COUNT(*) AS libres
-              FROM numeros
-             WHERE id_rifa=%s AND estado='disponible'
-        """, (r["id"],))
-        libres = cur.fetchone()["libres"]
-        enviar_whatsapp(wa_from, f"🔢 Disponibles en *{r['nombre']}*: {libres}\n{_link_publico(r)}")
-        enviar_whatsapp(wa_from, menu)
-        con.close(); return ("", 204)
-
-    # Intent precio (última rifa)
-    if intent_key == "precio":
-        r = _ultima_rifa()
-        if not r:
-            enviar_whatsapp(wa_from, "No encuentro rifas activas.")
-            con.close(); return ("", 204)
-        tpl = intents.get("precio", {}).get("template") or "Cada número vale ${{rifa.valor_numero}} COP"
-        enviar_whatsapp(wa_from, _render_template_text(tpl, negocio, r))
-        enviar_whatsapp(wa_from, _link_publico(r))
-        con.close(); return ("", 204)
-
-    # Intent comprar: redirige al link público de la última rifa
-    if intent_key == "comprar":
-        r = _ultima_rifa()
-        if not r:
-            enviar_whatsapp(wa_from, "No encuentro rifas activas.")
-            con.close(); return ("", 204)
-        enviar_whatsapp(wa_from, f"💳 Para comprar ingresa aquí:\n{_link_publico(r)}")
-        con.close(); return ("", 204)
-
-    # Intent ayuda
-    if intent_key == "ayuda":
-        tpl = intents.get("ayuda", {}).get("template") or "Escríbenos a {{negocio.celular}} o {{negocio.correo}}"
-        enviar_whatsapp(wa_from, _render_template_text(tpl, negocio))
-        con.close(); return ("", 204)
-
-    # Fallback
-    enviar_whatsapp(wa_from, fallback)
-    enviar_whatsapp(wa_from, menu)
-    con.close()
+def _responder_por_cola():
+    """Responde por la cola de WhatsApp: no esperamos a Twilio dentro del request."""
+    body, wa_from, wa_to = _mensaje_twilio()
+    negocio = negocio_para_bot(wa_to, body)
+    for mensaje in (responder_bot(negocio, body) if negocio else [BOT_SIN_NEGOCIO]):
+        encolar_whatsapp(wa_from, mensaje)
     return ("", 204)
 
-import re
-from urllib.parse import urlparse
+@app.post("/wa/webhook")
+def wa_webhook():
+    """Webhook Twilio (WhatsApp) multi-negocio; respuestas por la cola."""
+    return _responder_por_cola()
 
 @app.post("/bot/webhook")
 def bot_webhook():
-    """
-    Webhook de WhatsApp (Twilio).
-    - Resuelve negocio por 'To' (número receptor).
-    - Detecta rifa por link público en el texto (si viene).
-    - Responde con:
-        * Mensaje de bienvenida configurable (bot_config).
-        * Resumen de la rifa (precio, números vendidos / disponibles, link público).
-    """
-    # Twilio form-encoded payload
-    to_raw   = (request.form.get("To") or "").strip()        # whatsapp:+57...
-    from_raw = (request.form.get("From") or "").strip()      # whatsapp:+57...
-    body     = (request.form.get("Body") or "").strip()
-
-    # 1) Normalizar receptor (To) para buscar negocio
-    to_norm = to_raw.replace("whatsapp:", "")
-    to_norm = to_norm.replace(" ", "")
-
-    con = db()
-    cur = con.cursor(cursor_factory=RealDictCursor)
-
-    # 2) Buscar negocio por su número receptor (wa_numero_receptor)
-    #    Si aún no llenaste esa columna, también puedes usar 'celular'.
-    cur.execute("""
-        SELECT *
-          FROM negocios
-         WHERE REPLACE(COALESCE(wa_numero_receptor, celular), ' ', '') = %s
-           AND estado='activo'
-         LIMIT 1
-    """, (to_norm,))
-    negocio = cur.fetchone()
-
-    # Si no encontramos por 'To', igual intentamos sin bloquear (multi-tenant con 1 número compartido),
-    # en tal caso negocio quedará None y buscaremos por rifa.
-    # 3) Intentar extraer link_publico de un URL en el Body
-    link_publico = None
-    try:
-        # Buscar cualquier URL y si path coincide con /r/<slug>, extraemos el slug
-        urls = re.findall(r'(https?://[^\s]+)', body)
-        for u in urls:
-            p = urlparse(u)
-            # esperamos /r/<link_publico>
-            parts = p.path.rstrip("/").split("/")
-            if len(parts) >= 3 and parts[-2] == "r":  # .../r/<slug>
-                link_publico = parts[-1]
-                break
-    except Exception:
-        pass
-
-    rifa = None
-    if link_publico:
-        cur.execute("SELECT * FROM rifas WHERE link_publico=%s AND estado='activa' LIMIT 1", (link_publico,))
-        rifa = cur.fetchone()
-        # si el negocio no estaba resuelto por To, úsalo desde la rifa:
-        if rifa and not negocio:
-            cur.execute("SELECT * FROM negocios WHERE id=%s AND estado='activo'", (rifa["id_negocio"],))
-            negocio = cur.fetchone()
-
-    # 4) Cargar bot_config (JSON) si existe
-    fallback = "¡Hola! 👋 Gracias por escribir a GEICACONTROLRIFAS."
-    if negocio and negocio.get("bot_config"):
-        # bot_config es TEXT, guardamos JSON; parsearlo:
-        try:
-            import json
-            cfg = json.loads(negocio["bot_config"])
-            fallback = (cfg.get("fallback") or fallback).strip()
-        except Exception:
-            pass
-
-    # 5) Generar respuesta
-    reply_lines = []
-
-    # Bienvenida siempre
-    reply_lines.append(fallback or "¡Hola! 👋")
-
-    # Si detectamos rifa, agregar resumen real-time
-    if rifa:
-        # vender / disponibles
-        cur.execute("""
-            SELECT
-              COUNT(*) FILTER (WHERE estado='pagado')      AS vendidos,
-              COUNT(*) FILTER (WHERE estado='disponible')  AS disponibles,
-              COUNT(*)                                      AS total
-            FROM numeros
-            WHERE id_rifa=%s
-        """, (rifa["id"],))
-        stats = cur.fetchone() or {"vendidos": 0, "disponibles": 0, "total": 0}
-
-        # links
-        base_url = (os.getenv("APP_BASE_URL") or request.host_url or "").rstrip("/")
-        link_rifa = f"{base_url}/r/{rifa['link_publico']}"
-
-        reply_lines.append(
-            f"📌 *Rifa:* {rifa['nombre']}\n"
-            f"💰 *Precio por número:* ${rifa['valor_numero']:,} COP\n"
-            f"🧮 *Vendidos:* {stats['vendidos']}  |  *Disponibles:* {stats['disponibles']}\n"
-            f"🔗 Link: {link_rifa}"
-        )
-        reply_lines.append("¿Te ayudo a separar tus números? Escribe *comprar* para continuar. 🧾")
-    else:
-        # si no hay rifa detectada, ofrecer ayuda genérica
-        reply_lines.append("Envíame el *link* de la rifa o escribe una palabra clave: *precio*, *comprar*, *métodos de pago*.")
-
-    con.close()
-
-    # 6) Responder al cliente
-    respuesta = "\n\n".join(reply_lines)
-    enviar_whatsapp(from_raw, respuesta)
-    return ("", 204)
+    """Webhook Twilio (WhatsApp) multi-negocio; respuestas por la cola."""
+    return _responder_por_cola()
 
 # ================== MAIN ============================
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+# basedatos/cache.py
+"""Cache en proceso con expiración (TTL) y desalojo LRU. Seguro entre hilos."""
+import threading
+import time
+from collections import OrderedDict
+
+# Marca para distinguir "no está en cache" de un None cacheado
+FALTA = object()
+
+
+class CacheTTL:
+    def __init__(self, maximo: int = 1024, ttl: float = 60.0):
+        self.maximo = max(1, maximo)
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (vence, valor)
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def get(self, clave, defecto=FALTA):
+        ahora = time.monotonic()
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None or item[0] < ahora:
+                if item is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return defecto
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return item[1]
+
+    def set(self, clave, valor, ttl: float | None = None):
+        vence = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._datos[clave] = (vence, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def borrar_si(self, condicion):
+        """Borra todas las entradas cuyo (clave, valor) cumpla la condición."""
+        with self._lock:
+            for k in [k for k, (_v, val) in self._datos.items() if condicion(k, val)]:
+                del self._datos[k]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._datos), "maximo": self.maximo, "ttl": self.ttl,
+                    "aciertos": self.aciertos, "fallos": self.fallos}
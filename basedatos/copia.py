@@ -0,0 +1,77 @@
+# basedatos/copia.py
+"""
+Carga masiva con COPY ... FROM STDIN (un solo round trip para miles de filas).
+Las filas se generan de forma perezosa: nunca se arma el archivo completo en memoria.
+
+En modo cooperativo (basedatos/verde.py) psycopg2 no permite COPY: se cae a
+INSERT ... VALUES por lotes con execute_values (COPIA_LOTE filas por sentencia).
+"""
+import os
+from itertools import islice
+
+from psycopg2.extras import execute_values
+
+from basedatos import verde
+
+COPIA_LOTE = int(os.getenv("COPIA_LOTE", "1000"))
+
+
+def _escapar(valor) -> str:
+    """Formato 'text' de COPY: NULL -> \\N y se escapan \\, tab y saltos de línea."""
+    if valor is None:
+        return "\\N"
+    return (str(valor)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+class _FilasComoArchivo:
+    """Adaptador iterador -> objeto con read(), que es lo que pide copy_expert."""
+
+    def __init__(self, filas):
+        self._lineas = ("\t".join(_escapar(v) for v in fila) + "\n" for fila in filas)
+        self._buffer = ""
+        self.filas = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lineas)
+                self.filas += 1
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        out, self._buffer = self._buffer[:size], self._buffer[size:]
+        return out
+
+
+def _insertar_por_lotes(cur, tabla: str, columnas: list, filas) -> int:
+    sql = f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES %s"
+    filas = iter(filas)
+    total = 0
+    while True:
+        lote = list(islice(filas, COPIA_LOTE))
+        if not lote:
+            return total
+        execute_values(cur, sql, lote, page_size=len(lote))
+        total += len(lote)
+
+
+def copiar_filas(cur, tabla: str, columnas: list, filas) -> int:
+    """
+    Inserta 'filas' (iterable de tuplas) en 'tabla' con COPY, o por lotes si
+    el wait callback de gevent está activo. No hace commit.
+    Retorna cuántas filas se enviaron.
+    """
+    if verde.activo():
+        return _insertar_por_lotes(cur, tabla, columnas, filas)
+    origen = _FilasComoArchivo(filas)
+    cur.copy_expert(
+        f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN",
+        origen,
+        size=64 * 1024,
+    )
+    return origen.filas
@@ -0,0 +1,249 @@
+# basedatos/instrumentacion.py
+"""
+Instrumentación de la DB por request.
+
+- ConexionInstrumentada: connection_factory de psycopg2 que cronometra cada
+  sentencia (execute/executemany/callproc/COPY) y cada commit/rollback.
+  Se instala en el pool con configurar_conexiones(connection_factory=...).
+- Medicion: lo que pasó en la DB durante UN request (o tarea): préstamos de
+  conexión y su espera, conexiones nuevas, sentencias, tiempo total y la más
+  lenta, filas devueltas y round trips. Vive en un thread-local: se abre con
+  iniciar() y se cierra con terminar(); fuera de eso no se mide nada.
+- HistogramaRutas: agregados por ruta con buckets fijos en ms.
+"""
+import bisect
+import threading
+import time
+
+from psycopg2.extensions import connection, cursor, TRANSACTION_STATUS_IDLE
+
+_local = threading.local()
+
+
+class Medicion:
+    __slots__ = ("t0", "conexiones", "conexiones_nuevas", "conexion_ms", "sentencias",
+                 "sql_ms", "max_ms", "max_sql", "filas", "round_trips")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.conexiones = 0         # préstamos del pool
+        self.conexiones_nuevas = 0  # TCP+TLS abiertos de verdad
+        self.conexion_ms = 0.0      # espera por cupo + health check + connect
+        self.sentencias = 0
+        self.sql_ms = 0.0
+        self.max_ms = 0.0
+        self.max_sql = ""
+        self.filas = 0
+        self.round_trips = 0        # sentencias + commit/rollback enviados
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+    def como_dict(self) -> dict:
+        return {
+            "conexiones": self.conexiones,
+            "conexiones_nuevas": self.conexiones_nuevas,
+            "conexion_ms": round(self.conexion_ms, 2),
+            "sentencias": self.sentencias,
+            "sql_ms": round(self.sql_ms, 2),
+            "max_ms": round(self.max_ms, 2),
+            "max_sql": self.max_sql,
+            "filas": self.filas,
+            "round_trips": self.round_trips,
+        }
+
+
+def iniciar() -> Medicion:
+    _local.actual = Medicion()
+    return _local.actual
+
+
+def actual():
+    """Medición en curso en este hilo (o None)."""
+    return getattr(_local, "actual", None)
+
+
+def terminar():
+    """Cierra la medición en curso; queda disponible en ultima()."""
+    m = getattr(_local, "actual", None)
+    _local.actual = None
+    _local.ultima = m
+    return m
+
+
+def ultima():
+    """Última medición terminada en este hilo (útil para el benchmark)."""
+    return getattr(_local, "ultima", None)
+
+
+def registrar_prestamo(ms: float, nueva: bool):
+    m = actual()
+    if m is not None:
+        m.conexiones += 1
+        m.conexiones_nuevas += int(nueva)
+        m.conexion_ms += ms
+
+
+def _registrar_sentencia(ms: float, sql, filas: int, viajes: int = 1):
+    m = actual()
+    if m is None:
+        return
+    m.sentencias += viajes
+    m.round_trips += viajes
+    m.sql_ms += ms
+    m.filas += filas
+    if ms > m.max_ms:
+        m.max_ms = ms
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        m.max_sql = " ".join(str(sql or "").split())[:200]
+
+
+def _registrar_fin_transaccion():
+    m = actual()
+    if m is not None:
+        m.round_trips += 1
+
+
+# ================== CONEXIÓN / CURSOR ==================
+_cursores = {}
+_cursores_lock = threading.Lock()
+
+
+def _filas(cur) -> int:
+    # rowcount de un UPDATE sin RETURNING son filas afectadas, no devueltas
+    return max(cur.rowcount, 0) if cur.description is not None else 0
+
+
+def _cursor_instrumentado(base):
+    """Subclase (cacheada) del cursor 'base' que cronometra cada sentencia."""
+    with _cursores_lock:
+        cls = _cursores.get(base)
+        if cls is not None:
+            return cls
+
+        class CursorInstrumentado(base):
+            def execute(self, query, vars=None):
+                t0 = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _registrar_sentencia((time.perf_counter() - t0) * 1000, query, _filas(self))
+
+            def executemany(self, query, vars_list):
+                vars_list = list(vars_list)
+                t0 = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _registrar_sentencia((time.perf_counter() - t0) * 1000, query, 0,
+                                         viajes=len(vars_list))
+
+            def callproc(self, procname, parameters=None):
+                t0 = time.perf_counter()
+                try:
+                    return super().callproc(procname, parameters)
+                finally:
+                    _registrar_sentencia((time.perf_counter() - t0) * 1000, procname, _filas(self))
+
+            def copy_expert(self, sql, file, size=8192):
+                t0 = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, size)
+                finally:
+                    _registrar_sentencia((time.perf_counter() - t0) * 1000, sql, 0)
+
+        _cursores[base] = CursorInstrumentado
+        return CursorInstrumentado
+
+
+class ConexionInstrumentada(connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop("cursor_factory", None) or self.cursor_factory or cursor
+        return super().cursor(*args, cursor_factory=_cursor_instrumentado(base), **kwargs)
+
+    # commit/rollback sin transacción abierta no van al servidor: no cuentan
+    def commit(self):
+        if self.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            _registrar_fin_transaccion()
+        return super().commit()
+
+    def rollback(self):
+        if not self.closed and self.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            _registrar_fin_transaccion()
+        return super().rollback()
+
+
+# ================== HISTOGRAMAS POR RUTA ==================
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class _Histograma:
+    __slots__ = ("cuentas", "suma", "maximo")
+
+    def __init__(self):
+        self.cuentas = [0] * (len(BUCKETS_MS) + 1)  # el último es "+Inf"
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def agregar(self, valor: float):
+        self.cuentas[bisect.bisect_left(BUCKETS_MS, valor)] += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def como_dict(self) -> dict:
+        etiquetas = [f"<={b}" for b in BUCKETS_MS] + ["+Inf"]
+        return {
+            "buckets": dict(zip(etiquetas, self.cuentas)),
+            "suma": round(self.suma, 2),
+            "max": round(self.maximo, 2),
+        }
+
+
+class HistogramaRutas:
+    """Tiempo total, tiempo de SQL y espera de conexión por ruta (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas = {}
+
+    def registrar(self, ruta: str, m: Medicion, total_ms: float):
+        with self._lock:
+            r = self._rutas.get(ruta)
+            if r is None:
+                r = self._rutas[ruta] = {
+                    "requests": 0, "sentencias": 0, "max_sentencias": 0,
+                    "conexiones": 0, "filas": 0,
+                    "total_ms": _Histograma(), "sql_ms": _Histograma(),
+                    "conexion_ms": _Histograma(),
+                }
+            r["requests"] += 1
+            r["sentencias"] += m.sentencias
+            r["max_sentencias"] = max(r["max_sentencias"], m.sentencias)
+            r["conexiones"] += m.conexiones
+            r["filas"] += m.filas
+            r["total_ms"].agregar(total_ms)
+            r["sql_ms"].agregar(m.sql_ms)
+            r["conexion_ms"].agregar(m.conexion_ms)
+
+    def resumen(self) -> dict:
+        with self._lock:
+            out = {}
+            for ruta, r in sorted(self._rutas.items()):
+                n = r["requests"]
+                out[ruta] = {
+                    "requests": n,
+                    "sentencias_promedio": round(r["sentencias"] / n, 2),
+                    "max_sentencias": r["max_sentencias"],
+                    "conexiones_promedio": round(r["conexiones"] / n, 2),
+                    "filas_promedio": round(r["filas"] / n, 1),
+                    "total_ms": r["total_ms"].como_dict(),
+                    "sql_ms": r["sql_ms"].como_dict(),
+                    "conexion_ms": r["conexion_ms"].como_dict(),
+                }
+            return out
+
+    def limpiar(self):
+        with self._lock:
+            self._rutas.clear()
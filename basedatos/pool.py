@@ -0,0 +1,259 @@
+# basedatos/pool.py
+"""
+Pool de conexiones PostgreSQL compartido por cada worker de gunicorn.
+
+- El pool se crea perezosamente en el primer uso y se recrea si el PID cambia
+  (gunicorn --preload hace fork después de importar app.py).
+- Tamaño configurable: DB_POOL_MIN / DB_POOL_MAX.
+- Si el pool está lleno se espera hasta DB_POOL_TIMEOUT segundos.
+- Health check: una conexión que lleva más de DB_POOL_CHECK_SEGUNDOS ociosa
+  se valida con 'SELECT 1' antes de entregarla; si falla se descarta.
+"""
+import os
+import threading
+import time
+
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+from basedatos import instrumentacion, verde
+
+DB_POOL_MIN             = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX             = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_TIMEOUT         = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_CHECK_SEGUNDOS  = float(os.getenv("DB_POOL_CHECK_SEGUNDOS", "30"))
+
+
+def get_db_url() -> str:
+    """
+    Lee DATABASE_URL y agrega sslmode=require si no viene.
+    """
+    db_url = os.getenv("DATABASE_URL", "").strip()
+    if not db_url:
+        raise RuntimeError("DATABASE_URL no está configurada. Defínela en Render.")
+    if "sslmode=" not in db_url:
+        sep = "&" if "?" in db_url else "?"
+        db_url = db_url + f"{sep}sslmode=require"
+    return db_url
+
+
+class ConexionPrestada:
+    """
+    Envoltorio de una conexión del pool.
+    Se comporta como la conexión psycopg2 original, pero close() no la cierra:
+    - hace rollback de lo que no se haya confirmado (igual que un close real)
+    - si 'devolver' es True, la regresa al pool; si no, la deja prestada
+      (caso de la conexión por request, que se devuelve en el teardown).
+    """
+
+    def __init__(self, pool: "PoolDB", raw, devolver: bool):
+        self._pool = pool
+        self._raw = raw
+        self._devolver = devolver
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        if self._raw is None:
+            return
+        if self._devolver:
+            self.liberar()
+        else:
+            _rollback_silencioso(self._raw)
+
+    def liberar(self):
+        """Devuelve la conexión al pool (haya sido prestada con devolver o no)."""
+        if self._raw is not None:
+            self._pool.devolver(self._raw)
+            self._raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._raw is not None:
+            if exc_type is None:
+                self._raw.commit()
+            self.close()
+        return False
+
+
+def _rollback_silencioso(raw):
+    try:
+        if not raw.closed:
+            raw.rollback()
+    except Exception:
+        pass
+
+
+class PoolDB:
+    """ThreadedConnectionPool + espera acotada + health check + estadísticas."""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, **kwargs_conexion):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        # kwargs_conexion van tal cual a psycopg2.connect (p. ej. connection_factory)
+        self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, dsn, **kwargs_conexion)
+        self._cupos = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        self._ultimo_uso = {}  # id(conn) -> time.monotonic() al devolverla
+        self.stats = {
+            "prestamos": 0,          # total de getconn entregados
+            "conexiones_nuevas": 0,  # conexiones abiertas (TCP+TLS)
+            "descartadas": 0,        # cerradas por health check o error
+            "health_checks": 0,
+            "esperas": 0,            # préstamos que tuvieron que esperar cupo
+            "timeouts": 0,
+            "espera_total_ms": 0.0,
+        }
+
+    # ---------- préstamo / devolución ----------
+    def prestar(self):
+        t0 = time.monotonic()
+        if not self._cupos.acquire(blocking=False):
+            with self._lock:
+                self.stats["esperas"] += 1
+            if not self._cupos.acquire(timeout=DB_POOL_TIMEOUT):
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                raise PoolError(f"Pool de DB agotado ({self.maxconn} conexiones en uso)")
+        try:
+            raw, nueva = self._obtener_sana()
+        except Exception:
+            self._cupos.release()
+            raise
+        ms = (time.monotonic() - t0) * 1000
+        with self._lock:
+            self.stats["prestamos"] += 1
+            self.stats["espera_total_ms"] += ms
+        instrumentacion.registrar_prestamo(ms, nueva)
+        return raw
+
+    def devolver(self, raw, cerrar: bool = False):
+        _rollback_silencioso(raw)
+        cerrar = cerrar or bool(raw.closed)
+        with self._lock:
+            if cerrar:
+                self._ultimo_uso.pop(id(raw), None)
+                self.stats["descartadas"] += 1
+            else:
+                self._ultimo_uso[id(raw)] = time.monotonic()
+        try:
+            self._pool.putconn(raw, close=cerrar)
+        finally:
+            self._cupos.release()
+
+    def _obtener_sana(self):
+        """
+        Saca una conexión del pool validándola si estuvo mucho tiempo ociosa.
+        Retorna (conexión, es_nueva).
+        """
+        for _ in range(self.maxconn + 1):
+            raw = self._pool.getconn()
+            with self._lock:
+                ultimo = self._ultimo_uso.pop(id(raw), None)
+                if ultimo is None:
+                    self.stats["conexiones_nuevas"] += 1
+            if raw.closed:
+                self._descartar(raw)
+                continue
+            if ultimo is not None and time.monotonic() - ultimo >= DB_POOL_CHECK_SEGUNDOS:
+                with self._lock:
+                    self.stats["health_checks"] += 1
+                try:
+                    with raw.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    raw.rollback()
+                except Exception:
+                    self._descartar(raw)
+                    continue
+            return raw, ultimo is None
+        raise PoolError("No se pudo obtener una conexión sana del pool")
+
+    def _descartar(self, raw):
+        with self._lock:
+            self.stats["descartadas"] += 1
+        try:
+            self._pool.putconn(raw, close=True)
+        except Exception:
+            pass
+
+    # ---------- info ----------
+    def resumen(self) -> dict:
+        with self._lock:
+            data = dict(self.stats)
+            en_uso = len(self._pool._used)
+            libres = len(self._pool._pool)
+        data.update({
+            "pid": os.getpid(),
+            "min": self.minconn,
+            "max": self.maxconn,
+            "en_uso": en_uso,
+            "libres": libres,
+        })
+        return data
+
+    def cerrar_todo(self):
+        try:
+            self._pool.closeall()
+        except Exception:
+            pass
+
+
+# ================== POOL DEL PROCESO ==================
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_kwargs_conexion = {}
+
+
+def configurar_conexiones(**kwargs):
+    """
+    Parámetros extra para psycopg2.connect de los pools que se creen desde
+    ahora (p. ej. connection_factory para instrumentar). Si ya hay un pool en
+    este proceso se cierra y se vuelve a crear en el próximo uso.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        _kwargs_conexion.clear()
+        _kwargs_conexion.update(kwargs)
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.cerrar_todo()
+        _pool, _pool_pid = None, None
+
+
+def get_pool() -> PoolDB:
+    """Pool del worker actual (se crea en el primer uso, uno por PID)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # Tras un fork no cerramos las conexiones heredadas: son del padre.
+            _pool = PoolDB(get_db_url(), DB_POOL_MIN, DB_POOL_MAX, **_kwargs_conexion)
+            _pool_pid = pid
+    return _pool
+
+
+def conexion(devolver: bool = True) -> ConexionPrestada:
+    """
+    Presta una conexión del pool.
+    Con devolver=True, close() (o salir del 'with') la regresa al pool.
+    """
+    pool = get_pool()
+    return ConexionPrestada(pool, pool.prestar(), devolver=devolver)
+
+
+def pool_stats() -> dict:
+    if _pool is None or _pool_pid != os.getpid():
+        return {"pid": os.getpid(), "creado": False, "cooperativo": verde.activo()}
+    data = _pool.resumen()
+    data["creado"] = True
+    data["cooperativo"] = verde.activo()
+    return data
@@ -0,0 +1,48 @@
+# basedatos/verde.py
+"""
+Modo cooperativo (gunicorn -k gevent) para psycopg2.
+
+psycopg2 es una extensión en C: gevent no puede parchear sus sockets, así que
+una consulta lenta bloquearía TODO el worker. Con un "wait callback" psycopg2
+usa su API asíncrona y, mientras espera al servidor, cede el control al hub
+de gevent (wait_read / wait_write), igual que requests (Twilio) y smtplib ya
+lo hacen con los sockets parcheados.
+
+Se activa desde gunicorn.conf.py (post_fork) cuando la clase de worker es gevent.
+
+Limitación: con un wait callback psycopg2 no soporta COPY (copy_expert lanza
+ProgrammingError). basedatos/copia.py consulta activo() y en ese caso inserta
+por lotes con execute_values.
+"""
+import psycopg2
+from psycopg2 import extensions
+
+_activo = False
+
+
+def esperar_gevent(conn, timeout=None):
+    """Wait callback: reintenta conn.poll() cediendo a gevent mientras no esté listo."""
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        estado = conn.poll()
+        if estado == extensions.POLL_OK:
+            return
+        if estado == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif estado == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Resultado inesperado de poll: {estado!r}")
+
+
+def activar():
+    """Instala el wait callback (idempotente). Afecta a todas las conexiones del proceso."""
+    global _activo
+    if not _activo:
+        extensions.set_wait_callback(esperar_gevent)
+        _activo = True
+
+
+def activo() -> bool:
+    return _activo
@@ -0,0 +1,6 @@
+# python -m bench  -> benchmark de venta relámpago (ver bench/flash_sale.py)
+import sys
+
+from bench.flash_sale import main
+
+sys.exit(main())
@@ -0,0 +1,278 @@
+# bench/flash_sale.py
+"""
+Benchmark de "venta relámpago" contra un Postgres local.
+
+Fases (cada una con N hilos, cada hilo con su propio test_client de Flask):
+  1) rifa_publica  : GET /r/<link> (grilla pública)
+  2) generar_pago  : compradores que compiten por números solapados
+                     (un "bloque caliente" compartido + números al azar)
+  3) webhook_pago  : reenvío de aprobaciones/rechazos de Wompi, con reintentos
+                     duplicados y eventos fuera de orden
+
+Al final verifica dobles ventas y reporta throughput, p50/p95/p99 y round trips
+a la DB por request. Con --json guarda el resultado y con --comparar muestra la
+diferencia contra una corrida anterior.
+
+Uso:
+  DATABASE_URL=postgresql://localhost/rifas_bench?sslmode=disable \\
+      python -m bench --esquema --hilos 16 --compradores 400
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+# Antes de importar app: sin tareas de fondo (el liberador alteraría la medición)
+# y con la instrumentación de DB encendida (de ahí salen los round trips)
+os.environ.setdefault("TAREAS_EN_WEB", "0")
+os.environ["DB_INSTRUMENTAR"] = "1"
+
+from basedatos import pool as pool_db
+from bench.medicion import Fase
+from bench import sembrado
+
+
+def _en_hilos(hilos: int, trabajos: list, funcion):
+    """Reparte 'trabajos' entre 'hilos' hilos; cada uno recibe (client, trabajo)."""
+    from app import app
+
+    pendientes = list(trabajos)
+    lock = threading.Lock()
+    barrera = threading.Barrier(hilos)
+
+    def correr():
+        client = app.test_client()
+        barrera.wait()  # todos arrancan a la vez: pico de concurrencia real
+        while True:
+            with lock:
+                if not pendientes:
+                    return
+                trabajo = pendientes.pop()
+            funcion(client, trabajo)
+
+    ts = [threading.Thread(target=correr, daemon=True) for _ in range(hilos)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+
+def fase_rifa_publica(rifas, hilos: int, visitas: int) -> Fase:
+    fase = Fase("rifa_publica")
+    trabajos = [random.choice(rifas)["link_publico"] for _ in range(visitas)]
+    with fase:
+        _en_hilos(hilos, trabajos, lambda c, link: fase.medir(lambda: c.get(f"/r/{link}")))
+    return fase
+
+
+def fase_generar_pago(rifas, hilos: int, compradores: int, por_compra: int,
+                      caliente: int, prob_caliente: float):
+    """Retorna (fase, compras) con compras = [{"compra_id", "rifa_id", "numeros"}]."""
+    fase = Fase("generar_pago")
+    compras = []
+    lock = threading.Lock()
+    corrida = datetime.now().strftime("%H%M%S")
+
+    trabajos = []
+    for k in range(compradores):
+        rifa = random.choice(rifas)
+        bloque = rifa["numeros"][:caliente] if random.random() < prob_caliente else rifa["numeros"]
+        numeros = random.sample(bloque, min(por_compra, len(bloque)))
+        trabajos.append((k, rifa["id"], numeros))
+
+    def comprar(client, trabajo):
+        k, rifa_id, numeros = trabajo
+        resp = fase.medir(lambda: client.post("/generar-pago", data={
+            "rifa_id": rifa_id,
+            "numeros": ",".join(numeros),
+            "nombre": f"Comprador {k}",
+            "cedula": f"{sembrado.CEDULA_PREFIJO}{corrida}-{k}",
+            "correo": f"comprador{k}@bench.invalid",
+            "telefono": f"3{k:09d}",
+        }))
+        data = resp.get_json(silent=True) or {}
+        if resp.status_code == 200 and data.get("ok"):
+            # la referencia compra_<id> viaja en el link de checkout de Wompi
+            ref = parse_qs(urlparse(data.get("checkout_url", "")).query).get("reference", [""])[0]
+            with lock:
+                compras.append({"compra_id": int(ref.split("_")[1]) if ref.startswith("compra_") else None,
+                                "rifa_id": rifa_id, "numeros": numeros})
+
+    with fase:
+        _en_hilos(hilos, trabajos, comprar)
+    return fase, compras
+
+
+def fase_webhook_pago(compras, hilos: int, prob_aprobado: float, reintentos: int,
+                      prob_desorden: float) -> Fase:
+    """
+    Cada compra recibe su evento final (APPROVED o DECLINED) y además:
+    - 'reintentos' copias del mismo evento (Wompi reintenta si no respondimos a tiempo)
+    - con prob_desorden, un evento contrario que llega después (orden no garantizado)
+    """
+    fase = Fase("webhook_pago")
+    trabajos = []
+    for c in compras:
+        if not c.get("compra_id"):
+            continue
+        final = "APPROVED" if random.random() < prob_aprobado else "DECLINED"
+        c["estado_final"] = final
+        eventos = [final] * (1 + reintentos)
+        if random.random() < prob_desorden:
+            eventos.append("DECLINED" if final == "APPROVED" else "APPROVED")
+        trabajos.extend((c["compra_id"], e) for e in eventos)
+    random.shuffle(trabajos)
+
+    def notificar(client, trabajo):
+        compra_id, estado = trabajo
+        fase.medir(lambda: client.post("/webhook-pago", json={
+            "event": "transaction.updated",
+            "data": {"transaction": {"reference": f"compra_{compra_id}", "status": estado}},
+        }))
+
+    with fase:
+        _en_hilos(hilos, trabajos, notificar)
+    return fase
+
+
+def verificar(cur, rifa_ids) -> dict:
+    """Cuenta violaciones de consistencia sobre las rifas del benchmark."""
+    # a) un mismo número en más de una compra pagada
+    cur.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT cn.id_numero
+              FROM compra_numeros cn
+              JOIN compras co ON co.id = cn.id_compra
+             WHERE co.id_rifa = ANY(%s) AND co.estado = 'pagado'
+             GROUP BY cn.id_numero
+            HAVING COUNT(*) > 1
+        ) t
+    """, (rifa_ids,))
+    doble_venta = cur.fetchone()[0]
+    # b) compra pagada cuyos números no quedaron pagados a su comprador
+    cur.execute("""
+        SELECT COUNT(*)
+          FROM compras co
+          JOIN compra_numeros cn ON cn.id_compra = co.id
+          JOIN numeros n ON n.id = cn.id_numero
+         WHERE co.id_rifa = ANY(%s) AND co.estado = 'pagado'
+           AND (n.estado <> 'pagado' OR n.id_comprador IS DISTINCT FROM co.id_comprador)
+    """, (rifa_ids,))
+    pagada_sin_numero = cur.fetchone()[0]
+    # c) número pagado sin una compra pagada que lo respalde
+    cur.execute("""
+        SELECT COUNT(*)
+          FROM numeros n
+         WHERE n.id_rifa = ANY(%s) AND n.estado = 'pagado'
+           AND NOT EXISTS (
+                 SELECT 1 FROM compra_numeros cn
+                   JOIN compras co ON co.id = cn.id_compra
+                  WHERE cn.id_numero = n.id AND co.estado = 'pagado'
+                    AND co.id_comprador = n.id_comprador)
+    """, (rifa_ids,))
+    pagado_huerfano = cur.fetchone()[0]
+    return {
+        "doble_venta": doble_venta,
+        "compra_pagada_sin_numero": pagada_sin_numero,
+        "numero_pagado_sin_compra": pagado_huerfano,
+    }
+
+
+def _imprimir(resultado: dict, base: dict | None):
+    print()
+    print(f"{'fase':<14}{'req':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'RT/req':>8}  http")
+    anteriores = {f["fase"]: f for f in (base or {}).get("fases", [])}
+    for f in resultado["fases"]:
+        print(f"{f['fase']:<14}{f['requests']:>7}{f['req_por_segundo']:>9}"
+              f"{f['p50_ms']:>9}{f['p95_ms']:>9}{f['p99_ms']:>9}{f['round_trips_promedio']:>8}"
+              f"  {f['estados_http']}")
+        prev = anteriores.get(f["fase"])
+        if prev:
+            def delta(k):
+                return f"{(f[k] - prev[k]) / prev[k] * 100:+.0f}%" if prev[k] else "n/a"
+            print(f"{'  vs base':<14}{'':>7}{delta('req_por_segundo'):>9}{delta('p50_ms'):>9}"
+                  f"{delta('p95_ms'):>9}{delta('p99_ms'):>9}{delta('round_trips_promedio'):>8}")
+    print()
+    v = resultado["violaciones"]
+    marca = "✅" if not any(v.values()) else "❌"
+    print(f"{marca} Violaciones: {v}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--negocios", type=int, default=2)
+    ap.add_argument("--rifas", type=int, default=2, help="rifas por negocio")
+    ap.add_argument("--cifras", type=int, default=3, choices=(2, 3, 4))
+    ap.add_argument("--numeros", type=int, default=1000, help="números por rifa (3/4 cifras)")
+    ap.add_argument("--hilos", type=int, default=16)
+    ap.add_argument("--visitas", type=int, default=500, help="GETs a la rifa pública")
+    ap.add_argument("--compradores", type=int, default=400)
+    ap.add_argument("--por-compra", type=int, default=3, help="números por compra")
+    ap.add_argument("--caliente", type=int, default=20, help="tamaño del bloque de números disputados")
+    ap.add_argument("--prob-caliente", type=float, default=0.7)
+    ap.add_argument("--aprobados", type=float, default=0.8, help="fracción de pagos aprobados")
+    ap.add_argument("--reintentos", type=int, default=1, help="webhooks duplicados por compra")
+    ap.add_argument("--desorden", type=float, default=0.05, help="fracción con evento contrario tardío")
+    ap.add_argument("--semilla", type=int, default=None)
+    ap.add_argument("--esquema", action="store_true", help="crear/actualizar el esquema antes")
+    ap.add_argument("--conservar", action="store_true", help="no borrar los datos sembrados")
+    ap.add_argument("--json", help="guardar el resultado en este archivo")
+    ap.add_argument("--comparar", help="resultado JSON de una corrida anterior")
+    args = ap.parse_args(argv)
+
+    if args.semilla is not None:
+        random.seed(args.semilla)
+    # un cupo de pool por hilo (más holgura) para medir la app y no la espera de cupo
+    pool_db.DB_POOL_MAX = max(pool_db.DB_POOL_MAX, args.hilos + 2)
+
+    # app instala la instrumentación del pool al importarse: antes de prestar nada
+    import app  # noqa: F401
+
+    with pool_db.conexion() as con:
+        cur = con.cursor()
+        if args.esquema:
+            sembrado.preparar_esquema(cur)
+        t0 = time.perf_counter()
+        rifas = sembrado.sembrar(cur, args.negocios, args.rifas, args.cifras, args.numeros)
+        print(f"🌱 Sembradas {len(rifas)} rifas en {time.perf_counter() - t0:.2f}s")
+
+    rifa_ids = [r["id"] for r in rifas]
+    try:
+        f_publica = fase_rifa_publica(rifas, args.hilos, args.visitas)
+        f_pago, compras = fase_generar_pago(rifas, args.hilos, args.compradores, args.por_compra,
+                                            args.caliente, args.prob_caliente)
+        f_webhook = fase_webhook_pago(compras, args.hilos, args.aprobados, args.reintentos,
+                                      args.desorden)
+        with pool_db.conexion() as con:
+            violaciones = verificar(con.cursor(), rifa_ids)
+    finally:
+        if not args.conservar:
+            with pool_db.conexion() as con:
+                sembrado.limpiar(con.cursor())
+
+    resultado = {
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parametros": vars(args),
+        "compras_creadas": len(compras),
+        "fases": [f.resumen() for f in (f_publica, f_pago, f_webhook)],
+        "violaciones": violaciones,
+    }
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as fh:
+            base = json.load(fh)
+    _imprimir(resultado, base)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(resultado, fh, ensure_ascii=False, indent=2)
+        print(f"💾 Resultado guardado en {args.json}")
+    return 1 if any(violaciones.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# bench/latencia_app.py
+"""
+App WSGI para el benchmark de workers (bench/workers.py): envuelve app.app y,
+en las rutas de webhooks y bot, hace antes una llamada HTTP bloqueante a un
+"proveedor" lento (PROVEEDOR_URL), como una llamada real a Twilio, Wompi o
+SMTP. Con -k gevent esa espera cede el worker; con -k sync lo bloquea.
+
+    PROVEEDOR_URL=http://127.0.0.1:8799/ gunicorn -k gevent bench.latencia_app:app
+"""
+import os
+import urllib.request
+
+from app import app as app_real
+
+PROVEEDOR_URL = os.getenv("PROVEEDOR_URL", "")
+RUTAS_LENTAS = ("/webhook-pago", "/bot/", "/wa/")
+
+
+def app(environ, start_response):
+    if PROVEEDOR_URL and environ.get("PATH_INFO", "").startswith(RUTAS_LENTAS):
+        with urllib.request.urlopen(PROVEEDOR_URL, timeout=30) as resp:
+            resp.read()
+    return app_real(environ, start_response)
@@ -0,0 +1,72 @@
+# bench/medicion.py
+"""
+Medición para el benchmark: latencias, códigos HTTP y round trips a la DB de
+cada fase. Los round trips salen de la instrumentación por request de la app
+(basedatos/instrumentacion.py): la última medición terminada en el hilo.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+from basedatos import instrumentacion
+
+
+def percentil(valores_ordenados, p: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not valores_ordenados:
+        return 0.0
+    k = max(0, min(len(valores_ordenados) - 1, math.ceil(p / 100.0 * len(valores_ordenados)) - 1))
+    return valores_ordenados[k]
+
+
+class Fase:
+    """Acumula los resultados de una fase (thread-safe)."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._lock = threading.Lock()
+        self.latencias_ms = []
+        self.estados = Counter()
+        self.round_trips = []
+        self.t_inicio = None
+        self.t_fin = None
+
+    def __enter__(self):
+        self.t_inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.t_fin = time.perf_counter()
+        return False
+
+    def medir(self, funcion):
+        """Ejecuta funcion() -> respuesta Flask y registra latencia, código y round trips."""
+        t0 = time.perf_counter()
+        resp = funcion()
+        ms = (time.perf_counter() - t0) * 1000
+        m = instrumentacion.ultima()
+        rts = m.round_trips if m is not None else 0
+        with self._lock:
+            self.latencias_ms.append(ms)
+            self.estados[resp.status_code] += 1
+            self.round_trips.append(rts)
+        return resp
+
+    def resumen(self) -> dict:
+        lat = sorted(self.latencias_ms)
+        n = len(lat)
+        dur = (self.t_fin or time.perf_counter()) - (self.t_inicio or time.perf_counter())
+        return {
+            "fase": self.nombre,
+            "requests": n,
+            "segundos": round(dur, 3),
+            "req_por_segundo": round(n / dur, 1) if dur > 0 else 0.0,
+            "p50_ms": round(percentil(lat, 50), 2),
+            "p95_ms": round(percentil(lat, 95), 2),
+            "p99_ms": round(percentil(lat, 99), 2),
+            "max_ms": round(lat[-1], 2) if lat else 0.0,
+            "round_trips_promedio": round(sum(self.round_trips) / n, 2) if n else 0.0,
+            "round_trips_max": max(self.round_trips) if n else 0,
+            "estados_http": {str(k): v for k, v in sorted(self.estados.items())},
+        }
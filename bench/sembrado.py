@@ -0,0 +1,70 @@
+# bench/sembrado.py
+"""
+Datos del benchmark: negocios con llaves Wompi de prueba y rifas con su
+talonario completo (cargado con COPY). Todo lo sembrado lleva el prefijo
+PREFIJO en el nombre del negocio (y los compradores simulados CEDULA_PREFIJO
+en la cédula) para poder borrarlo después.
+"""
+import uuid
+
+from basedatos.copia import copiar_filas
+
+PREFIJO = "bench-flash-"
+CEDULA_PREFIJO = "BENCH-"
+
+
+def preparar_esquema(cur):
+    """Crea/actualiza el esquema con el mismo SQL de crear_db_postgres.py."""
+    from crear_db_postgres import SCHEMA_SQL
+    cur.execute(SCHEMA_SQL)
+
+
+def sembrar(cur, negocios: int, rifas_por_negocio: int, cifras: int, cantidad: int,
+            valor_numero: int = 5000) -> list:
+    """
+    Inserta los negocios y rifas del benchmark. No hace commit.
+    Retorna [{"id", "link_publico", "numeros": [...]}] de cada rifa.
+    """
+    from app import generar_numeros
+
+    corrida = uuid.uuid4().hex[:8]
+    rifas = []
+    for i in range(negocios):
+        cur.execute("""
+            INSERT INTO negocios (nombre_negocio, nombre_propietario, celular, correo, contrasena,
+                                  public_key_wompi, private_key_wompi, integrity_secret_wompi, estado)
+            VALUES (%s, 'Benchmark', %s, %s, 'bench',
+                    'pub_test_bench', 'prv_test_bench', 'test_integrity_bench', 'activo')
+            RETURNING id
+        """, (f"{PREFIJO}{corrida}-{i}", f"3{i:09d}", f"bench{i}@{corrida}.invalid"))
+        negocio_id = cur.fetchone()[0]
+        for j in range(rifas_por_negocio):
+            link = f"bench{corrida}{i}x{j}"
+            cur.execute("""
+                INSERT INTO rifas (id_negocio, nombre, cifras, cantidad_numeros, valor_numero,
+                                   link_publico, estado, fecha_inicio)
+                VALUES (%s, %s, %s, %s, %s, %s, 'activa', NOW())
+                RETURNING id
+            """, (negocio_id, f"Rifa bench {i}-{j}", cifras, cantidad, valor_numero, link))
+            rifa_id = cur.fetchone()[0]
+            numeros = list(generar_numeros(cifras, cantidad))
+            copiar_filas(cur, "numeros", ["id_rifa", "numero", "estado"],
+                         ((rifa_id, n, "disponible") for n in numeros))
+            rifas.append({"id": rifa_id, "link_publico": link, "numeros": numeros})
+    return rifas
+
+
+def limpiar(cur) -> int:
+    """Borra todo lo sembrado por el benchmark (rifas, números y compras caen en cascada)."""
+    cur.execute("""
+        DELETE FROM notificaciones_outbox
+         WHERE substring(clave from '^compra_([0-9]+):')::bigint IN (
+                 SELECT co.id FROM compras co
+                   JOIN rifas r ON r.id = co.id_rifa
+                   JOIN negocios n ON n.id = r.id_negocio
+                  WHERE n.nombre_negocio LIKE %s)
+    """, (PREFIJO + "%",))
+    cur.execute("DELETE FROM negocios WHERE nombre_negocio LIKE %s", (PREFIJO + "%",))
+    negocios = cur.rowcount
+    cur.execute("DELETE FROM compradores WHERE cedula LIKE %s", (CEDULA_PREFIJO + "%",))
+    return negocios
@@ -0,0 +1,176 @@
+# bench/workers.py
+"""
+Requests por worker con proveedores lentos: sync vs gevent.
+
+Levanta un "proveedor" HTTP local que tarda --latencia-ms en responder y, para
+cada clase de worker, un gunicorn de UN worker con bench.latencia_app (la app
+real + esa llamada lenta en webhooks/bot). Luego --clientes hilos le pegan a
+--ruta durante --segundos y se reporta req/s, p50/p95/p99 y errores.
+
+    DATABASE_URL=postgresql://localhost/rifas_bench?sslmode=disable \\
+        python -m bench.workers --latencia-ms 200 --clientes 50
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.medicion import percentil
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def proveedor_lento(puerto: int, latencia_s: float) -> ThreadingHTTPServer:
+    class Lento(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latencia_s)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", puerto), Lento)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def _esperar_puerto(puerto: int, segundos: float) -> bool:
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", puerto), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _peticion(base: str, ruta: str) -> urllib.request.Request:
+    if ruta.startswith("/webhook-pago"):
+        # referencia que no es compra_#: responde sin tocar la DB (solo proveedor)
+        cuerpo = json.dumps({"data": {"transaction": {
+            "id": "bench-latencia", "reference": "bench_latencia", "status": "APPROVED"}}}).encode()
+        return urllib.request.Request(base + ruta, data=cuerpo, headers={"Content-Type": "application/json"})
+    cuerpo = urllib.parse.urlencode({
+        "To": "whatsapp:+10000000000", "From": "whatsapp:+10000000001", "Body": "menu",
+    }).encode()
+    return urllib.request.Request(base + ruta, data=cuerpo,
+                                  headers={"Content-Type": "application/x-www-form-urlencoded"})
+
+
+def carga(puerto: int, ruta: str, clientes: int, segundos: float) -> dict:
+    base = f"http://127.0.0.1:{puerto}"
+    plantilla = _peticion(base, ruta)
+    latencias, estados = [], Counter()
+    lock = threading.Lock()
+    fin = time.monotonic() + segundos
+
+    def cliente():
+        while time.monotonic() < fin:
+            req = urllib.request.Request(plantilla.full_url, data=plantilla.data,
+                                         headers=dict(plantilla.header_items()))
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    resp.read()
+                    codigo = resp.status
+            except urllib.error.HTTPError as e:
+                codigo = e.code
+            except Exception:
+                codigo = "error"
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencias.append(ms)
+                estados[codigo] += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clientes) as ex:
+        for _ in range(clientes):
+            ex.submit(cliente)
+    dur = time.perf_counter() - t0
+    lat = sorted(latencias)
+    return {
+        "requests": len(lat),
+        "req_por_segundo": round(len(lat) / dur, 1) if dur else 0.0,
+        "p50_ms": round(percentil(lat, 50), 1),
+        "p95_ms": round(percentil(lat, 95), 1),
+        "p99_ms": round(percentil(lat, 99), 1),
+        "estados_http": {str(k): v for k, v in estados.items()},
+    }
+
+
+def correr_clase(clase: str, args) -> dict:
+    env = dict(os.environ,
+               PROVEEDOR_URL=f"http://127.0.0.1:{args.puerto_proveedor}/",
+               TAREAS_EN_WEB="0",
+               GUNICORN_WORKER_CLASS=clase,
+               WEB_CONCURRENCY="1",
+               PORT=str(args.puerto))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--bind", f"127.0.0.1:{args.puerto}", "bench.latencia_app:app"],
+        cwd=RAIZ, env=env,
+    )
+    try:
+        if not _esperar_puerto(args.puerto, 30):
+            raise RuntimeError(f"gunicorn ({clase}) no levantó en el puerto {args.puerto}")
+        carga(args.puerto, args.ruta, min(args.clientes, 5), 1.0)  # calentamiento
+        return carga(args.puerto, args.ruta, args.clientes, args.segundos)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.workers", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--clases", default="sync,gevent")
+    ap.add_argument("--latencia-ms", type=float, default=200)
+    ap.add_argument("--clientes", type=int, default=50)
+    ap.add_argument("--segundos", type=float, default=10)
+    ap.add_argument("--ruta", default="/webhook-pago", help="/webhook-pago (sin DB) o /bot/webhook")
+    ap.add_argument("--puerto", type=int, default=8765)
+    ap.add_argument("--puerto-proveedor", type=int, default=8799)
+    ap.add_argument("--json", help="guardar el resultado en este archivo")
+    args = ap.parse_args(argv)
+
+    proveedor = proveedor_lento(args.puerto_proveedor, args.latencia_ms / 1000)
+    resultados = {}
+    try:
+        for clase in [c.strip() for c in args.clases.split(",") if c.strip()]:
+            print(f"⏱️  {clase}: {args.clientes} clientes, proveedor a {args.latencia_ms:g} ms...", flush=True)
+            resultados[clase] = correr_clase(clase, args)
+    finally:
+        proveedor.shutdown()
+
+    print()
+    print(f"{'worker':<10}{'req':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}  http")
+    for clase, r in resultados.items():
+        print(f"{clase:<10}{r['requests']:>8}{r['req_por_segundo']:>9}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}  {r['estados_http']}")
+    techo = 1000 / args.latencia_ms if args.latencia_ms else 0
+    print(f"\n(techo teórico de un worker sync: {techo:.1f} req/s)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"parametros": vars(args), "resultados": resultados}, fh, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
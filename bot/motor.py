@@ -0,0 +1,211 @@
+# bot/motor.py
+"""
+Motor de intenciones del bot de WhatsApp, compartido por /bot/whatsapp,
+/wa/webhook y /bot/webhook.
+
+config_de(negocio) compila el bot_config del negocio (saludo, menú,
+intenciones y plantillas) UNA vez en un ConfigBot y lo cachea por negocio;
+solo se recompila si el bot_config cambia. Por mensaje queda:
+  1) normalizar el texto (minúsculas, sin tildes ni signos)
+  2) buscarlo en el diccionario de frases exactas ("1", "hola", "precio")
+  3) si no, las regex precompiladas: link /r/<link>, búsqueda por patrón,
+     "N al azar", "estado 05", y una sola regex con las palabras clave que
+     basta con que aparezcan ("quiero comprar")
+Las plantillas aceptan {{negocio.campo}}, {{rifa.campo}} y {{app.base_url}}.
+
+bot_config (JSONB, todo opcional):
+{
+  "greeting": "👋 ¡Hola! Soy el asistente de {{negocio.nombre_negocio}}.",
+  "menu":     "1️⃣ Ver rifas · 2️⃣ Disponibles · 3️⃣ Precio · 4️⃣ Ayuda",
+  "fallback": "No te entendí 🤖. Responde con 1, 2, 3 o 4.",
+  "intents": {
+    "precio":  {"template": "Cada número vale ${{rifa.valor_numero}} COP",
+                "palabras": ["cuanto vale"]},
+    "horario": {"template": "Atendemos de 8am a 6pm", "frases": ["horario", "5"]}
+  }
+}
+"frases" se comparan con el mensaje completo y "palabras" basta con que
+aparezcan. Una intención que no es del sistema (como "horario") responde
+solo su plantilla.
+"""
+import json
+import os
+import re
+import unicodedata
+
+from basedatos.cache import CacheTTL, FALTA
+
+BOT_CONFIG_TTL = float(os.getenv("BOT_CONFIG_TTL", "3600"))
+
+# ================== TEXTOS POR DEFECTO ==================
+SALUDO = "👋 ¡Hola! Soy el asistente de {{negocio.nombre_negocio}}."
+MENU = (
+    "1️⃣ Ver rifas · 2️⃣ Disponibles · 3️⃣ Precio · 4️⃣ Ayuda\n"
+    "También puedes escribir: *estado 05*, *termina en 7*, *contiene 13*, *3 al azar*"
+)
+FALLBACK = "No te entendí 🤖. Responde con 1, 2, 3 o 4."
+PLANTILLAS = {
+    "precio": "Cada número vale ${{rifa.valor_numero}} COP",
+    "ayuda":  "Escríbenos a {{negocio.celular}} o {{negocio.correo}}",
+}
+
+# intención -> frases que deben ser el mensaje completo (ya normalizadas)
+FRASES = {
+    "saludo": ("hola", "buenas", "buenos dias", "buenas tardes", "buenas noches",
+               "hi", "hello", "inicio", "start"),
+    "menu": ("menu", "opciones"),
+    "rifas": ("1", "rifas", "ver rifas"),
+    "disponibles": ("2", "disponibles", "disponible"),
+    "precio": ("3", "precio", "precios", "valor"),
+    "ayuda": ("4", "ayuda", "soporte"),
+    "comprar": ("comprar", "compra"),
+    "estado": ("estado",),
+}
+# intención -> palabras que basta con que aparezcan en el mensaje
+PALABRAS = {
+    "comprar": ("comprar", "pagar"),
+}
+
+# ================== REGEX DE INTENCIONES CON DATOS ==================
+RE_LINK_RIFA = re.compile(r"/r/([A-Za-z0-9]{6,})")
+# "termina en 7", "terminan en 07", "empieza por 12", "contiene 13", "buscar 13"
+RE_BUSCAR = re.compile(
+    r"\b(termin\w*|acab\w*|empiez\w*|comienz\w*|inici\w*|contien\w*|buscar)\b\D*?([0-9]{1,6})\b"
+)
+_MODO_BUSCAR = {"termin": "termina", "acab": "termina", "empiez": "empieza",
+                "comienz": "empieza", "inici": "empieza", "contien": "contiene",
+                "buscar": "contiene"}
+# "3 al azar", "quiero 2 numeros al azar", "azar 5" (sin cantidad = 1)
+RE_AZAR = re.compile(r"\bazar\b")
+RE_CANTIDAD = re.compile(r"\b([0-9]{1,2})\b")
+# "estado 05", "estado del numero 123" o solo el número
+RE_ESTADO = re.compile(r"^(?:estado\s+(?:del?\s+)?(?:numero\s+)?)?([0-9]{1,6})$")
+
+_RE_SIGNOS = re.compile(r"[¡!¿?.,;:*]+")
+_RE_ESPACIOS = re.compile(r"\s+")
+_RE_MARCADOR = re.compile(r"\{\{\s*(\w+)\.(\w+)\s*\}\}")
+
+
+def normalizar(texto: str) -> str:
+    """'¡Menú!' -> 'menu'"""
+    t = unicodedata.normalize("NFKD", (texto or "").lower())
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    t = _RE_SIGNOS.sub(" ", t)
+    return _RE_ESPACIOS.sub(" ", t).strip()
+
+
+class Plantilla:
+    """Texto con {{objeto.campo}} partido una sola vez en literales y marcadores."""
+    __slots__ = ("partes",)
+
+    def __init__(self, texto: str):
+        texto = texto or ""
+        partes, pos = [], 0
+        for m in _RE_MARCADOR.finditer(texto):
+            partes.append(texto[pos:m.start()])
+            partes.append((m.group(1), m.group(2), m.group(0)))
+            pos = m.end()
+        partes.append(texto[pos:])
+        self.partes = tuple(p for p in partes if p)
+
+    def render(self, **contexto) -> str:
+        out = []
+        for p in self.partes:
+            if isinstance(p, str):
+                out.append(p)
+                continue
+            objeto = contexto.get(p[0])
+            if objeto is None:
+                out.append(p[2])  # sin ese objeto (p. ej. no hay rifa): queda tal cual
+            else:
+                valor = objeto.get(p[1])
+                out.append("" if valor is None else str(valor))
+        return "".join(out)
+
+
+class ConfigBot:
+    __slots__ = ("saludo", "menu", "fallback", "plantillas", "frases", "palabras", "re_palabras")
+
+    def __init__(self, cfg: dict):
+        self.saludo = Plantilla(cfg.get("greeting") or SALUDO)
+        self.menu = Plantilla(cfg.get("menu") or MENU)
+        self.fallback = Plantilla(cfg.get("fallback") or FALLBACK)
+
+        self.frases = {f: intencion for intencion, fs in FRASES.items() for f in fs}
+        self.palabras = {p: intencion for intencion, ps in PALABRAS.items() for p in ps}
+        plantillas = dict(PLANTILLAS)
+        intents = cfg.get("intents")
+        for intencion, spec in (intents.items() if isinstance(intents, dict) else ()):
+            if isinstance(spec, str):
+                spec = {"template": spec}
+            if not isinstance(spec, dict):
+                continue
+            if spec.get("template"):
+                plantillas[intencion] = spec["template"]
+            for f in spec.get("frases") or ():
+                self.frases[normalizar(str(f))] = intencion
+            for p in spec.get("palabras") or ():
+                self.palabras[normalizar(str(p))] = intencion
+        self.frases.pop("", None)
+        self.palabras.pop("", None)
+        self.plantillas = {k: Plantilla(v) for k, v in plantillas.items()}
+
+        # una sola alternación; las más largas primero para que ganen
+        self.re_palabras = None
+        if self.palabras:
+            alternativas = sorted(self.palabras, key=len, reverse=True)
+            self.re_palabras = re.compile(r"\b(" + "|".join(map(re.escape, alternativas)) + r")\b")
+
+    def clasificar(self, texto: str):
+        """(intención, dato) del mensaje; ('fallback', None) si no se reconoce."""
+        t = normalizar(texto)
+        intencion = self.frases.get(t)
+        if intencion:
+            return intencion, None
+
+        m = RE_LINK_RIFA.search(texto or "")  # el link distingue mayúsculas
+        if m:
+            return "rifa_link", m.group(1)
+        m = RE_BUSCAR.search(t)
+        if m:
+            raiz = next(k for k in _MODO_BUSCAR if m.group(1).startswith(k))
+            return "buscar", (_MODO_BUSCAR[raiz], m.group(2))
+        if RE_AZAR.search(t):
+            m = RE_CANTIDAD.search(t)
+            return "azar", int(m.group(1)) if m else 1
+        m = RE_ESTADO.match(t)
+        if m:
+            return "estado", m.group(1)
+        if self.re_palabras is not None:
+            m = self.re_palabras.search(t)
+            if m:
+                return self.palabras[m.group(1)], None
+        return "fallback", None
+
+
+def _parsear(crudo) -> dict:
+    """bot_config llega como dict (JSONB) o como texto JSON (columna TEXT antigua)."""
+    if isinstance(crudo, dict):
+        return crudo
+    if isinstance(crudo, str) and crudo.strip():
+        try:
+            cfg = json.loads(crudo)
+        except ValueError:
+            return {"fallback": crudo.strip()}
+        return cfg if isinstance(cfg, dict) else {"fallback": str(cfg)}
+    return {}
+
+
+_compilados = CacheTTL(maximo=int(os.getenv("BOT_CONFIG_CACHE_MAX", "512")), ttl=BOT_CONFIG_TTL)
+
+
+def config_de(negocio: dict) -> ConfigBot:
+    """ConfigBot del negocio, compilado una vez por cada versión de su bot_config."""
+    crudo = negocio.get("bot_config")
+    clave = negocio.get("id")
+    item = _compilados.get(clave)
+    if item is not FALTA and item[0] == crudo:
+        return item[1]
+    compilado = ConfigBot(_parsear(crudo))
+    _compilados.set(clave, (crudo, compilado))
+    return compilado
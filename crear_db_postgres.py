@@ -8,6 +8,10 @@ load_dotenv()  # lee .env local si existe
 SCHEMA_SQL = """
 BEGIN;
 
+-- extensiones: trigramas (búsqueda "contiene") con id_rifa en el mismo GIN
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
 -- 1) superadmin
 CREATE TABLE IF NOT EXISTS superadmin (
   id            BIGSERIAL PRIMARY KEY,
@@ -32,7 +36,9 @@ CREATE TABLE IF NOT EXISTS negocios (
   -- NUEVO: número de WhatsApp del negocio para el bot
   wa_numero_receptor       TEXT,
   -- NUEVO: configuración del bot (por negocio)
-  bot_config               JSONB
+  bot_config               JSONB,
+  -- MSISDN normalizado (solo dígitos) de wa_numero_receptor o, si no hay, celular
+  wa_msisdn                TEXT
 );
 
 -- 3) rifas
@@ -95,10 +101,259 @@ CREATE TABLE IF NOT EXISTS pagos (
   fecha_confirmacion TIMESTAMPTZ
 );
 
+-- 8) outbox de notificaciones (lo envía notificaciones/despachador.py)
+CREATE TABLE IF NOT EXISTS notificaciones_outbox (
+  id               BIGSERIAL PRIMARY KEY,
+  canal            TEXT NOT NULL,                      -- 'whatsapp' | 'correo'
+  destinatario     TEXT NOT NULL,
+  asunto           TEXT,
+  cuerpo           TEXT NOT NULL,
+  clave            TEXT UNIQUE,                        -- evita encolar dos veces lo mismo
+  estado           TEXT NOT NULL DEFAULT 'pendiente',  -- pendiente | enviando | enviado | muerto
+  intentos         INTEGER NOT NULL DEFAULT 0,
+  proximo_intento  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  ultimo_error     TEXT,
+  creado           TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  enviado          TIMESTAMPTZ
+);
+
+-- 9) grilla en vivo: todo cambio de estado de numeros -> NOTIFY numeros_rifa
+--    (una sola notificación por rifa y por bloque de 200 números, por sentencia)
+CREATE OR REPLACE FUNCTION notificar_cambios_numeros() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  lote RECORD;
+BEGIN
+  FOR lote IN
+    WITH cambios AS (
+      SELECT n.id_rifa, n.numero,
+             CASE WHEN n.estado='reservado' AND n.reservado_hasta < NOW() THEN 'disponible'
+                  ELSE n.estado END AS estado,
+             (row_number() OVER (PARTITION BY n.id_rifa ORDER BY n.numero) - 1) / 200 AS bloque
+        FROM nuevos n
+        JOIN viejos o ON o.id = n.id
+       WHERE o.estado IS DISTINCT FROM n.estado
+          OR o.reservado_hasta IS DISTINCT FROM n.reservado_hasta
+    )
+    SELECT id_rifa, json_agg(json_build_array(numero, estado)) AS c
+      FROM cambios
+     GROUP BY id_rifa, bloque
+  LOOP
+    PERFORM pg_notify('numeros_rifa', json_build_object('r', lote.id_rifa, 'c', lote.c)::text);
+  END LOOP;
+  RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_numeros_notificar ON numeros;
+CREATE TRIGGER trg_numeros_notificar
+  AFTER UPDATE ON numeros
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+  FOR EACH STATEMENT EXECUTE PROCEDURE notificar_cambios_numeros();
+
+-- 10) contadores por rifa mantenidos por triggers (O(1) para paneles y bot)
+--     Repartidos en 8 "shards" por rifa (pg_backend_pid() % 8) para que los
+--     checkouts concurrentes de una misma rifa no se serialicen en una sola fila.
+--     Leer = SUM(...) WHERE id_rifa = X. Reconstruir: python -m tareas.reconciliar_stats
+--     'version' sube en cada sentencia que cambia el estado de números de la rifa: SUM(version)
+--     es la versión de la rifa (llave del cache de render de /r/<link>).
+CREATE TABLE IF NOT EXISTS rifa_stats (
+  id_rifa      BIGINT   NOT NULL REFERENCES rifas(id) ON DELETE CASCADE,
+  shard        SMALLINT NOT NULL DEFAULT 0,
+  total        INTEGER  NOT NULL DEFAULT 0,
+  disponibles  INTEGER  NOT NULL DEFAULT 0,
+  reservados   INTEGER  NOT NULL DEFAULT 0,
+  pagados      INTEGER  NOT NULL DEFAULT 0,
+  recaudado    BIGINT   NOT NULL DEFAULT 0,
+  version      BIGINT   NOT NULL DEFAULT 0,
+  PRIMARY KEY (id_rifa, shard)
+);
+
+-- carga inicial (solo si la tabla está recién creada)
+INSERT INTO rifa_stats (id_rifa, shard, total, disponibles, reservados, pagados, recaudado)
+SELECT n.id_rifa, 0,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE n.estado='disponible'),
+       COUNT(*) FILTER (WHERE n.estado='reservado'),
+       COUNT(*) FILTER (WHERE n.estado='pagado'),
+       COALESCE(SUM(r.valor_numero) FILTER (WHERE n.estado='pagado'), 0)
+  FROM numeros n
+  JOIN rifas r ON r.id = n.id_rifa
+ WHERE NOT EXISTS (SELECT 1 FROM rifa_stats)
+ GROUP BY n.id_rifa;
+
+CREATE OR REPLACE FUNCTION rifa_stats_aplicar() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  mi_shard SMALLINT := pg_backend_pid() % 8;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO rifa_stats AS s (id_rifa, shard, total, disponibles, reservados, pagados, recaudado, version)
+    SELECT v.id_rifa, mi_shard,
+           -COUNT(*),
+           -COUNT(*) FILTER (WHERE v.estado='disponible'),
+           -COUNT(*) FILTER (WHERE v.estado='reservado'),
+           -COUNT(*) FILTER (WHERE v.estado='pagado'),
+           -COALESCE(SUM(r.valor_numero) FILTER (WHERE v.estado='pagado'), 0),
+           1
+      FROM viejos v
+      JOIN rifas r ON r.id = v.id_rifa
+     GROUP BY v.id_rifa
+    ON CONFLICT (id_rifa, shard) DO UPDATE
+       SET total       = s.total       + EXCLUDED.total,
+           disponibles = s.disponibles + EXCLUDED.disponibles,
+           reservados  = s.reservados  + EXCLUDED.reservados,
+           pagados     = s.pagados     + EXCLUDED.pagados,
+           recaudado   = s.recaudado   + EXCLUDED.recaudado,
+           version     = s.version     + EXCLUDED.version;
+  END IF;
+  IF TG_OP = 'UPDATE' THEN
+    -- solo las filas cuyo estado (o rifa) cambió: un UPDATE que no cambia el
+    -- estado (p. ej. extender reservado_hasta) no toca el shard ni sube la versión
+    INSERT INTO rifa_stats AS s (id_rifa, shard, total, disponibles, reservados, pagados, recaudado, version)
+    SELECT d.id_rifa, mi_shard,
+           SUM(d.signo),
+           COALESCE(SUM(d.signo) FILTER (WHERE d.estado='disponible'), 0),
+           COALESCE(SUM(d.signo) FILTER (WHERE d.estado='reservado'), 0),
+           COALESCE(SUM(d.signo) FILTER (WHERE d.estado='pagado'), 0),
+           COALESCE(SUM(d.signo * r.valor_numero) FILTER (WHERE d.estado='pagado'), 0),
+           1
+      FROM (SELECT v.id_rifa, v.estado, -1 AS signo
+              FROM viejos v JOIN nuevos n ON n.id = v.id
+             WHERE (v.estado, v.id_rifa) IS DISTINCT FROM (n.estado, n.id_rifa)
+            UNION ALL
+            SELECT n.id_rifa, n.estado, 1
+              FROM viejos v JOIN nuevos n ON n.id = v.id
+             WHERE (v.estado, v.id_rifa) IS DISTINCT FROM (n.estado, n.id_rifa)) d
+      JOIN rifas r ON r.id = d.id_rifa
+     GROUP BY d.id_rifa
+    ON CONFLICT (id_rifa, shard) DO UPDATE
+       SET total       = s.total       + EXCLUDED.total,
+           disponibles = s.disponibles + EXCLUDED.disponibles,
+           reservados  = s.reservados  + EXCLUDED.reservados,
+           pagados     = s.pagados     + EXCLUDED.pagados,
+           recaudado   = s.recaudado   + EXCLUDED.recaudado,
+           version     = s.version     + EXCLUDED.version;
+  END IF;
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO rifa_stats AS s (id_rifa, shard, total, disponibles, reservados, pagados, recaudado, version)
+    SELECT n.id_rifa, mi_shard,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE n.estado='disponible'),
+           COUNT(*) FILTER (WHERE n.estado='reservado'),
+           COUNT(*) FILTER (WHERE n.estado='pagado'),
+           COALESCE(SUM(r.valor_numero) FILTER (WHERE n.estado='pagado'), 0),
+           1
+      FROM nuevos n
+      JOIN rifas r ON r.id = n.id_rifa
+     GROUP BY n.id_rifa
+    ON CONFLICT (id_rifa, shard) DO UPDATE
+       SET total       = s.total       + EXCLUDED.total,
+           disponibles = s.disponibles + EXCLUDED.disponibles,
+           reservados  = s.reservados  + EXCLUDED.reservados,
+           pagados     = s.pagados     + EXCLUDED.pagados,
+           recaudado   = s.recaudado   + EXCLUDED.recaudado,
+           version     = s.version     + EXCLUDED.version;
+  END IF;
+  RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_rifa_stats_ins ON numeros;
+CREATE TRIGGER trg_rifa_stats_ins
+  AFTER INSERT ON numeros
+  REFERENCING NEW TABLE AS nuevos
+  FOR EACH STATEMENT EXECUTE PROCEDURE rifa_stats_aplicar();
+
+DROP TRIGGER IF EXISTS trg_rifa_stats_upd ON numeros;
+CREATE TRIGGER trg_rifa_stats_upd
+  AFTER UPDATE ON numeros
+  REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+  FOR EACH STATEMENT EXECUTE PROCEDURE rifa_stats_aplicar();
+
+DROP TRIGGER IF EXISTS trg_rifa_stats_del ON numeros;
+CREATE TRIGGER trg_rifa_stats_del
+  AFTER DELETE ON numeros
+  REFERENCING OLD TABLE AS viejos
+  FOR EACH STATEMENT EXECUTE PROCEDURE rifa_stats_aplicar();
+
+-- 11) ledger de eventos de Wompi (webhook idempotente)
+--     Un evento = (transacción, estado). Un reintento choca con la UNIQUE y
+--     el webhook responde sin tocar compras/numeros ni notificar.
+--     compras.estado solo avanza: pendiente -> rechazado -> pagado, o
+--     conflicto (pagada sin todos sus números; el detalle queda en el evento).
+CREATE TABLE IF NOT EXISTS wompi_eventos (
+  id              BIGSERIAL PRIMARY KEY,
+  id_transaccion  TEXT NOT NULL,
+  estado          TEXT NOT NULL,                 -- APPROVED / DECLINED / VOIDED / ERROR ...
+  referencia      TEXT NOT NULL,
+  id_compra       BIGINT REFERENCES compras(id) ON DELETE CASCADE,
+  compra_antes    TEXT,                          -- estado de la compra al llegar el evento
+  compra_despues  TEXT,
+  resultado       TEXT,                          -- aplicado | ignorado | conflicto
+  detalle         TEXT,                          -- p. ej. qué números faltaron en un conflicto
+  recibido        TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  CONSTRAINT wompi_eventos_unq UNIQUE (id_transaccion, estado)
+);
+
+-- 12) números de cada compra (por id). compras.numeros queda solo para mostrar.
+--     "¿qué compra tiene este número?" = la fila más nueva por id_numero.
+CREATE TABLE IF NOT EXISTS compra_numeros (
+  id_compra  BIGINT NOT NULL REFERENCES compras(id) ON DELETE CASCADE,
+  id_numero  BIGINT NOT NULL REFERENCES numeros(id) ON DELETE CASCADE,
+  PRIMARY KEY (id_compra, id_numero)
+);
+
+-- migraciones de tablas existentes
+ALTER TABLE rifa_stats ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE negocios ADD COLUMN IF NOT EXISTS wa_msisdn TEXT;
+ALTER TABLE wompi_eventos ADD COLUMN IF NOT EXISTS detalle TEXT;
+UPDATE negocios
+   SET wa_msisdn = regexp_replace(COALESCE(NULLIF(TRIM(wa_numero_receptor), ''), celular, ''), '[^0-9]', '', 'g')
+ WHERE wa_msisdn IS NULL;
+
+-- compradores: una fila por cédula (el checkout hace upsert ON CONFLICT (cedula)).
+-- Antes de crear el índice único se fusionan los duplicados en el id más bajo.
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'compradores_cedula_unq') THEN
+    CREATE TEMP TABLE compradores_dup ON COMMIT DROP AS
+      SELECT id, MIN(id) OVER (PARTITION BY cedula) AS queda FROM compradores;
+    DELETE FROM compradores_dup WHERE id = queda;
+    UPDATE compras c SET id_comprador = d.queda
+      FROM compradores_dup d WHERE c.id_comprador = d.id;
+    UPDATE numeros n SET id_comprador = d.queda
+      FROM compradores_dup d WHERE n.id_comprador = d.id;
+    DELETE FROM compradores c USING compradores_dup d WHERE c.id = d.id;
+    CREATE UNIQUE INDEX compradores_cedula_unq ON compradores (cedula);
+  END IF;
+END $$;
+
+-- compras anteriores a compra_numeros: se arma la relación desde el texto "05,17,42"
+INSERT INTO compra_numeros (id_compra, id_numero)
+SELECT co.id, n.id
+  FROM compras co
+ CROSS JOIN LATERAL unnest(string_to_array(co.numeros, ',')) AS x(numero)
+  JOIN numeros n ON n.id_rifa = co.id_rifa AND n.numero = TRIM(x.numero)
+ WHERE NOT EXISTS (SELECT 1 FROM compra_numeros cn WHERE cn.id_compra = co.id)
+ON CONFLICT DO NOTHING;
+
 -- índices
 CREATE INDEX IF NOT EXISTS idx_numeros_rifa_estado ON numeros (id_rifa, estado);
 CREATE INDEX IF NOT EXISTS idx_compras_rifa        ON compras (id_rifa);
 CREATE INDEX IF NOT EXISTS idx_compras_referencia  ON compras (referencia);
+CREATE INDEX IF NOT EXISTS idx_wompi_eventos_compra ON wompi_eventos (id_compra);
+CREATE INDEX IF NOT EXISTS idx_compra_numeros_numero ON compra_numeros (id_numero, id_compra);
+-- webhooks de WhatsApp: negocio por número receptor normalizado
+CREATE INDEX IF NOT EXISTS idx_negocios_wa_msisdn  ON negocios (wa_msisdn);
+-- búsqueda de números por patrón (talonario/busqueda.py): sufijo y subcadena
+CREATE INDEX IF NOT EXISTS idx_numeros_reverso ON numeros (id_rifa, reverse(numero));
+CREATE INDEX IF NOT EXISTS idx_numeros_trgm    ON numeros USING gin (id_rifa, numero gin_trgm_ops);
+-- archivador en segundo plano: próxima fecha_fin de rifas activas
+CREATE INDEX IF NOT EXISTS idx_rifas_activas_fecha_fin ON rifas (fecha_fin) WHERE estado = 'activa';
+-- liberador de reservas en segundo plano: solo filas reservadas
+CREATE INDEX IF NOT EXISTS idx_numeros_reservado_hasta ON numeros (reservado_hasta) WHERE estado = 'reservado';
+-- despachador del outbox: solo filas por enviar
+CREATE INDEX IF NOT EXISTS idx_outbox_por_enviar ON notificaciones_outbox (proximo_intento)
+  WHERE estado IN ('pendiente', 'enviando');
 
 COMMIT;
 """
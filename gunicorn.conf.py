@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+"""
+Configuración de gunicorn (procfile: gunicorn -c gunicorn.conf.py app:app).
+
+GUNICORN_WORKER_CLASS:
+  - sync   (por defecto): un request a la vez por worker.
+  - gevent : modo cooperativo. Mientras un webhook espera a Postgres, a la API
+             de Twilio o al SMTP, el mismo worker atiende otros requests.
+             psycopg2 cede con un wait callback (basedatos/verde.py).
+  La grilla en vivo (SSE) solo se activa con gevent/gthread: con sync cada
+  stream tendría tomado un worker, así que la página sondea en su lugar.
+  Con gevent conviene subir DB_POOL_MAX: los requests concurrentes de un worker
+  comparten su pool y esperan cupo sin bloquear a los demás.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync").strip() or "sync"
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+# clase REAL del worker (también si vino con -k / --threads en la línea de comandos)
+_CLASES = {
+    "GeventWorker": "gevent",
+    "GeventPyWSGIWorker": "gevent",
+    "EventletWorker": "eventlet",
+    "ThreadWorker": "gthread",
+}
+
+
+def post_fork(server, worker):
+    clase = _CLASES.get(type(worker).__name__, "sync")
+    # la app decide con esto si usa SSE (app.sse_activo) y hasta cuándo
+    os.environ["GUNICORN_WORKER_CLASS"] = clase
+    os.environ["GUNICORN_TIMEOUT"] = str(server.cfg.timeout)
+    if clase == "gevent":
+        from basedatos import verde
+        verde.activar()
+        server.log.info("psycopg2 en modo cooperativo (gevent) en el worker %s", worker.pid)
@@ -0,0 +1,199 @@
+# imagenes/premio.py
+"""
+Pipeline de la imagen del premio (imagen_premio de rifas).
+
+1) guardar_original(): valida el archivo (tamaño, formato real, dimensiones)
+   y lo guarda con nombre = hash del contenido: uploads/<huella>.<ext>
+2) procesar_en_segundo_plano(): fuera del hilo del request genera variantes
+   WebP redimensionadas junto al original:
+       uploads/<huella>-thumb.webp   320 px de ancho
+       uploads/<huella>-card.webp    800 px de ancho
+       uploads/<huella>-og.webp      1200x630 recortada (previsualización OG)
+3) variantes(): qué variantes ya existen en disco, para srcset / og:image.
+
+Un original que no existe o que Pillow no pudo decodificar se recuerda
+IMAGEN_REINTENTO_SEGUNDOS: mientras tanto no se vuelve a encolar.
+
+Usa Pillow; si no está instalado, solo se valida la extensión y se sirve el
+original (sin variantes).
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from basedatos.cache import CacheTTL, FALTA
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # sin Pillow: se guarda el original tal cual
+    Image = None
+
+log = logging.getLogger(__name__)
+
+IMAGEN_MAX_MB       = float(os.getenv("IMAGEN_MAX_MB", "12"))
+IMAGEN_MAX_PIXELES  = int(os.getenv("IMAGEN_MAX_PIXELES", str(40_000_000)))
+IMAGEN_HILOS        = int(os.getenv("IMAGEN_HILOS", "1"))
+WEBP_CALIDAD        = int(os.getenv("IMAGEN_WEBP_CALIDAD", "80"))
+IMAGEN_REINTENTO_SEGUNDOS = float(os.getenv("IMAGEN_REINTENTO_SEGUNDOS", "3600"))
+
+FORMATOS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+EXTENSIONES = {"jpg", "jpeg", "png", "webp"}
+
+# nombre -> (ancho, alto o None para conservar la proporción)
+VARIANTES = {
+    "thumb": (320, None),
+    "card":  (800, None),
+    "og":    (1200, 630),
+}
+
+
+class ImagenInvalida(ValueError):
+    pass
+
+
+def _extension(nombre: str) -> str:
+    return nombre.rsplit(".", 1)[1].lower() if "." in nombre else ""
+
+
+def guardar_original(archivo, carpeta: str) -> str:
+    """
+    Valida y guarda el upload (FileStorage de Flask) en 'carpeta'.
+    Retorna el nombre del archivo guardado (<huella>.<ext>).
+    Lanza ImagenInvalida si no es una imagen aceptable.
+    """
+    datos = archivo.read(int(IMAGEN_MAX_MB * 1024 * 1024) + 1)
+    if len(datos) > IMAGEN_MAX_MB * 1024 * 1024:
+        raise ImagenInvalida(f"La imagen supera {IMAGEN_MAX_MB:g} MB.")
+    if not datos:
+        raise ImagenInvalida("El archivo está vacío.")
+
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(datos)) as img:
+                formato = img.format
+                ancho, alto = img.size
+                img.verify()
+        except Exception:
+            raise ImagenInvalida("El archivo no es una imagen válida.")
+        if formato not in FORMATOS:
+            raise ImagenInvalida("Formato no permitido (usa JPG, PNG o WEBP).")
+        if ancho * alto > IMAGEN_MAX_PIXELES:
+            raise ImagenInvalida("La imagen tiene demasiados píxeles.")
+        ext = FORMATOS[formato]
+    else:
+        ext = _extension(archivo.filename or "")
+        if ext not in EXTENSIONES:
+            raise ImagenInvalida("Formato no permitido (usa JPG, PNG o WEBP).")
+
+    huella = hashlib.sha256(datos).hexdigest()[:20]
+    nombre = f"{huella}.{ext}"
+    ruta = os.path.join(carpeta, nombre)
+    if not os.path.exists(ruta):  # mismo contenido = mismo archivo
+        _escribir_atomico(ruta, datos)
+    return nombre
+
+
+def _escribir_atomico(ruta: str, datos: bytes):
+    tmp = f"{ruta}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(datos)
+    os.replace(tmp, ruta)
+
+
+def nombre_variante(nombre_original: str, variante: str) -> str:
+    """'uploads/abc.jpg' -> 'uploads/abc-card.webp' (vale para rutas con carpeta)."""
+    base = nombre_original.rsplit(".", 1)[0]
+    return f"{base}-{variante}.webp"
+
+
+def generar_variantes(ruta_original: str) -> list:
+    """Genera las variantes WebP que falten. Retorna las rutas creadas."""
+    if Image is None:
+        return []
+    creadas = []
+    with Image.open(ruta_original) as img:
+        img = ImageOps.exif_transpose(img)  # fotos de celular giradas
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        for variante, (ancho, alto) in VARIANTES.items():
+            destino = nombre_variante(ruta_original, variante)
+            if os.path.exists(destino):
+                continue
+            if alto is None:
+                copia = img.copy()
+                copia.thumbnail((ancho, ancho * 10), Image.LANCZOS)  # nunca agranda
+            else:
+                copia = ImageOps.fit(img, (ancho, alto), Image.LANCZOS)
+            buf = io.BytesIO()
+            copia.save(buf, "WEBP", quality=WEBP_CALIDAD, method=4)
+            _escribir_atomico(destino, buf.getvalue())
+            creadas.append(destino)
+    return creadas
+
+
+# ================== HILO DE PROCESAMIENTO ==================
+_ejecutor = None
+_ejecutor_lock = threading.Lock()
+_en_proceso = set()  # rutas ya encoladas (evita encolar dos veces la misma)
+# originales sin variantes posibles (no existen o no se pudieron decodificar)
+_fallidos = CacheTTL(maximo=1024, ttl=IMAGEN_REINTENTO_SEGUNDOS)
+
+
+def _obtener_ejecutor() -> ThreadPoolExecutor:
+    global _ejecutor
+    with _ejecutor_lock:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=max(1, IMAGEN_HILOS),
+                                           thread_name_prefix="imagenes")
+        return _ejecutor
+
+
+def _procesar(ruta_original: str):
+    try:
+        creadas = generar_variantes(ruta_original)
+        if creadas:
+            log.info("%d variante(s) de %s", len(creadas), os.path.basename(ruta_original))
+    except Exception:
+        _fallidos.set(ruta_original, True)
+        log.exception("No se pudieron generar variantes de %s", ruta_original)
+    finally:
+        with _ejecutor_lock:
+            _en_proceso.discard(ruta_original)
+
+
+def procesar_en_segundo_plano(ruta_original: str) -> bool:
+    """
+    Encola la generación de variantes; el request no espera.
+    Retorna True si hay un trabajo en curso para esa ruta (recién encolado o
+    de antes) y False si no habrá variantes: sin Pillow, sin original o con
+    un fallo reciente.
+    """
+    if Image is None or _fallidos.get(ruta_original) is not FALTA:
+        return False
+    if not os.path.exists(ruta_original):
+        _fallidos.set(ruta_original, True)
+        return False
+    with _ejecutor_lock:
+        if ruta_original in _en_proceso:
+            return True
+        _en_proceso.add(ruta_original)
+    _obtener_ejecutor().submit(_procesar, ruta_original)
+    return True
+
+
+def variantes(carpeta_static: str, imagen: str | None) -> dict:
+    """
+    {nombre_variante: ruta relativa a static} de las que ya existen en disco.
+    'imagen' es la ruta relativa guardada en la DB (p. ej. 'uploads/abc.jpg').
+    """
+    if not imagen:
+        return {}
+    out = {}
+    for variante in VARIANTES:
+        rel = nombre_variante(imagen, variante)
+        if os.path.exists(os.path.join(carpeta_static, rel)):
+            out[variante] = rel
+    return out
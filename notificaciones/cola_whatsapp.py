@@ -0,0 +1,143 @@
+# notificaciones/cola_whatsapp.py
+"""
+Cola de envío de WhatsApp para las respuestas del bot (no bloquea el webhook).
+
+- encolar(numero, mensaje) retorna al instante; el envío real lo hace un
+  pool de WA_HILOS hilos usando el cliente Twilio de larga vida (keep-alive).
+- Ritmo por remitente: token bucket de WA_MENSAJES_POR_SEGUNDO (por worker).
+- Mensajes consecutivos al MISMO destinatario que llegan dentro de
+  WA_VENTANA_MS se juntan en uno solo (p. ej. saludo + menú), respetando el
+  límite de WA_MAX_CARACTERES por mensaje.
+- Nunca hay dos envíos en vuelo al mismo destinatario: se conserva el orden.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+WA_MENSAJES_POR_SEGUNDO  = float(os.getenv("WA_MENSAJES_POR_SEGUNDO", "5"))
+WA_VENTANA_MS            = float(os.getenv("WA_VENTANA_MS", "300"))
+WA_HILOS                 = int(os.getenv("WA_HILOS", "4"))
+WA_MAX_CARACTERES        = int(os.getenv("WA_MAX_CARACTERES", "1600"))
+
+
+def agrupar(partes: list, limite: int = WA_MAX_CARACTERES) -> list:
+    """Une partes con línea en blanco sin pasar 'limite' caracteres por mensaje."""
+    out, actual = [], ""
+    for p in partes:
+        p = p or ""
+        if not actual:
+            actual = p
+        elif len(actual) + 2 + len(p) <= limite:
+            actual = f"{actual}\n\n{p}"
+        else:
+            out.append(actual)
+            actual = p
+    if actual:
+        out.append(actual)
+    return out
+
+
+class ColaWhatsApp:
+    def __init__(self, enviar, por_segundo: float = WA_MENSAJES_POR_SEGUNDO,
+                 ventana_ms: float = WA_VENTANA_MS, hilos: int = WA_HILOS):
+        self._enviar = enviar  # enviar(numero, mensaje) -> str (lanza si falla)
+        self.por_segundo = max(0.1, por_segundo)
+        self.ventana = max(0.0, ventana_ms) / 1000.0
+        self._hilos = max(1, hilos)
+        self._cond = threading.Condition()
+        self._pendientes = OrderedDict()  # numero -> [listo_en, [partes]]
+        self._en_vuelo = set()
+        self._tokens = self.por_segundo
+        self._ultimo_token = time.monotonic()
+        self._pool = None
+        self._hilo = None
+        self._pid = None
+        self.stats = {"encolados": 0, "enviados": 0, "coalescidos": 0, "errores": 0}
+
+    # ---------- API ----------
+    def encolar(self, numero: str, mensaje: str):
+        if not numero or not mensaje:
+            return
+        self._asegurar_hilo()
+        with self._cond:
+            self.stats["encolados"] += 1
+            item = self._pendientes.get(numero)
+            if item is not None:
+                item[1].append(mensaje)
+                self.stats["coalescidos"] += 1
+            else:
+                self._pendientes[numero] = [time.monotonic() + self.ventana, [mensaje]]
+            self._cond.notify()
+
+    # ---------- interno ----------
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._cond:
+            if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+                self._pool = ThreadPoolExecutor(max_workers=self._hilos, thread_name_prefix="wa-envio")
+                self._hilo = threading.Thread(target=self._loop, name="wa-cola", daemon=True)
+                self._pid = os.getpid()
+                self._hilo.start()
+
+    def _recargar_tokens(self, ahora: float):
+        self._tokens = min(self.por_segundo,
+                           self._tokens + (ahora - self._ultimo_token) * self.por_segundo)
+        self._ultimo_token = ahora
+
+    def _siguiente(self):
+        """Con el lock tomado: (numero, partes) listo para salir, o segundos a esperar."""
+        ahora = time.monotonic()
+        espera = None
+        for numero, (listo_en, _partes) in self._pendientes.items():
+            if numero in self._en_vuelo:
+                continue
+            if listo_en > ahora:
+                espera = listo_en - ahora if espera is None else min(espera, listo_en - ahora)
+                continue
+            self._recargar_tokens(ahora)
+            if self._tokens < 1:
+                return None, (1 - self._tokens) / self.por_segundo
+            self._tokens -= 1
+            partes = self._pendientes.pop(numero)[1]
+            self._en_vuelo.add(numero)
+            return (numero, partes), None
+        return None, espera
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                listo, espera = self._siguiente()
+                while listo is None:
+                    self._cond.wait(espera)
+                    listo, espera = self._siguiente()
+            self._pool.submit(self._despachar, *listo)
+
+    def _despachar(self, numero: str, partes: list):
+        try:
+            for i, cuerpo in enumerate(agrupar(partes)):
+                if i:
+                    # mensajes extra por exceder el largo también pagan su token
+                    with self._cond:
+                        while True:
+                            self._recargar_tokens(time.monotonic())
+                            if self._tokens >= 1:
+                                self._tokens -= 1
+                                break
+                            self._cond.wait((1 - self._tokens) / self.por_segundo)
+                try:
+                    info = self._enviar(numero, cuerpo)
+                    self.stats["enviados"] += 1
+                    log.info("%s", info)
+                except Exception:
+                    self.stats["errores"] += 1
+                    log.exception("No se pudo enviar el WhatsApp a %s", numero)
+        finally:
+            with self._cond:
+                self._en_vuelo.discard(numero)
+                self._cond.notify()
@@ -0,0 +1,203 @@
+# notificaciones/despachador.py
+"""
+Despachador del outbox de notificaciones. Proceso aparte:
+    python -m notificaciones.despachador
+
+- Reclama lotes con FOR UPDATE SKIP LOCKED (se pueden correr varios).
+- Envía con un pool de hilos de OUTBOX_CONCURRENCIA envíos simultáneos.
+- Reintentos con backoff exponencial (OUTBOX_BACKOFF_SEGUNDOS * 2^intentos,
+  tope OUTBOX_BACKOFF_MAX_SEGUNDOS). Tras OUTBOX_MAX_INTENTOS, o ante un
+  error permanente, la fila queda en estado 'muerto' (dead-letter).
+- Una fila 'enviando' cuyo plazo (OUTBOX_PLAZO_SEGUNDOS) venció se
+  reclama de nuevo: cubre caídas del proceso a mitad de un envío.
+- Se despierta al instante con LISTEN outbox_notificaciones y, por si acaso,
+  revisa cada OUTBOX_POLL_SEGUNDOS.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from basedatos.pool import conexion, get_db_url
+from notificaciones.notificaciones import (
+    enviar_whatsapp_o_fallar, enviar_correo_o_fallar, enviar_correos_lote,
+    ErrorEnvioPermanente,
+)
+from notificaciones.outbox import CANAL_NOTIFY
+
+log = logging.getLogger(__name__)
+
+OUTBOX_CONCURRENCIA          = int(os.getenv("OUTBOX_CONCURRENCIA", "4"))
+OUTBOX_LOTE                  = int(os.getenv("OUTBOX_LOTE", "20"))
+OUTBOX_MAX_INTENTOS          = int(os.getenv("OUTBOX_MAX_INTENTOS", "6"))
+OUTBOX_BACKOFF_SEGUNDOS      = float(os.getenv("OUTBOX_BACKOFF_SEGUNDOS", "30"))
+OUTBOX_BACKOFF_MAX_SEGUNDOS  = float(os.getenv("OUTBOX_BACKOFF_MAX_SEGUNDOS", "3600"))
+OUTBOX_PLAZO_SEGUNDOS        = float(os.getenv("OUTBOX_PLAZO_SEGUNDOS", "120"))
+OUTBOX_POLL_SEGUNDOS         = float(os.getenv("OUTBOX_POLL_SEGUNDOS", "5"))
+
+
+def reclamar_lote(limite: int) -> list:
+    """Marca hasta 'limite' filas como 'enviando' (con plazo) y las retorna."""
+    with conexion() as con:
+        cur = con.cursor()
+        cur.execute("""
+            UPDATE notificaciones_outbox o
+               SET estado='enviando',
+                   intentos = o.intentos + 1,
+                   proximo_intento = NOW() + make_interval(secs => %s)
+             WHERE o.id IN (
+                SELECT id
+                  FROM notificaciones_outbox
+                 WHERE estado IN ('pendiente', 'enviando')
+                   AND proximo_intento <= NOW()
+                 ORDER BY proximo_intento
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+         RETURNING o.id, o.canal, o.destinatario, o.asunto, o.cuerpo, o.intentos
+        """, (OUTBOX_PLAZO_SEGUNDOS, limite))
+        return cur.fetchall()
+
+
+def _backoff(intentos: int) -> float:
+    return min(OUTBOX_BACKOFF_MAX_SEGUNDOS, OUTBOX_BACKOFF_SEGUNDOS * (2 ** max(0, intentos - 1)))
+
+
+def _enviar(fila):
+    _id, canal, destinatario, asunto, cuerpo, _intentos = fila
+    if canal == "whatsapp":
+        return enviar_whatsapp_o_fallar(destinatario, cuerpo)
+    if canal == "correo":
+        return enviar_correo_o_fallar(destinatario, asunto or "", cuerpo)
+    raise ErrorEnvioPermanente(f"Canal desconocido: {canal}")
+
+
+def _registrar_exito(fila, info):
+    _id, canal = fila[0], fila[1]
+    with conexion() as con:
+        con.cursor().execute("""
+            UPDATE notificaciones_outbox
+               SET estado='enviado', enviado=NOW(), ultimo_error=NULL
+             WHERE id=%s
+        """, (_id,))
+    log.info("#%s %s: %s", _id, canal, info)
+
+
+def _registrar_fallo(fila, e):
+    _id, canal, intentos = fila[0], fila[1], fila[5]
+    muerto = isinstance(e, ErrorEnvioPermanente) or intentos >= OUTBOX_MAX_INTENTOS
+    with conexion() as con:
+        con.cursor().execute("""
+            UPDATE notificaciones_outbox
+               SET estado=%s, ultimo_error=%s,
+                   proximo_intento = NOW() + make_interval(secs => %s)
+             WHERE id=%s
+        """, ("muerto" if muerto else "pendiente", str(e)[:1000], _backoff(intentos), _id))
+    log.log(logging.ERROR if muerto else logging.WARNING, "#%s %s intento %s (%s): %s",
+            _id, canal, intentos, "muerto" if muerto else "reintento", e)
+
+
+def procesar(fila):
+    """Envía una fila reclamada y registra el resultado."""
+    try:
+        info = _enviar(fila)
+    except Exception as e:
+        _registrar_fallo(fila, e)
+    else:
+        _registrar_exito(fila, info)
+
+
+def procesar_lote_correo(filas):
+    """Varios correos por UNA sesión SMTP (sin handshake ni login por mensaje)."""
+    resultados = enviar_correos_lote([(f[2], f[3] or "", f[4]) for f in filas])
+    for fila, res in zip(filas, resultados):
+        if isinstance(res, Exception):
+            _registrar_fallo(fila, res)
+        else:
+            _registrar_exito(fila, res)
+
+
+class Despachador:
+    def __init__(self, concurrencia: int = OUTBOX_CONCURRENCIA):
+        self.concurrencia = max(1, concurrencia)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="outbox")
+        self._cupos = threading.BoundedSemaphore(self.concurrencia)
+        self._despertar = threading.Event()
+
+    def _liberar_cupo(self, _fut):
+        self._cupos.release()
+        self._despertar.set()
+
+    def ciclo(self) -> int:
+        """Reclama tantas filas como cupos libres haya y las despacha."""
+        libres = 0
+        while self._cupos.acquire(blocking=False):
+            libres += 1
+        if not libres:
+            return 0
+        try:
+            filas = reclamar_lote(min(libres, OUTBOX_LOTE))
+        except Exception:
+            for _ in range(libres):
+                self._cupos.release()
+            raise
+        for _ in range(libres - len(filas)):
+            self._cupos.release()
+        correos = [f for f in filas if f[1] == "correo"]
+        for fila in filas:
+            if fila[1] != "correo":
+                self._pool.submit(procesar, fila).add_done_callback(self._liberar_cupo)
+        if correos:
+            def _liberar_cupos(fut, n=len(correos)):
+                for _ in range(n):
+                    self._liberar_cupo(fut)
+            self._pool.submit(procesar_lote_correo, correos).add_done_callback(_liberar_cupos)
+        return len(filas)
+
+    def _escuchar(self):
+        """Hilo LISTEN: despierta el ciclo apenas alguien encola."""
+        while True:
+            con = None
+            try:
+                con = psycopg2.connect(get_db_url())
+                con.autocommit = True
+                con.cursor().execute(f"LISTEN {CANAL_NOTIFY}")
+                while True:
+                    if select.select([con], [], [], 60) != ([], [], []):
+                        con.poll()
+                        if con.notifies:
+                            con.notifies.clear()
+                            self._despertar.set()
+            except Exception as e:
+                log.warning("LISTEN %s falló: %s (reintento en 5s)", CANAL_NOTIFY, e)
+                time.sleep(5)
+            finally:
+                try:
+                    if con is not None:
+                        con.close()
+                except Exception:
+                    pass
+
+    def correr(self):
+        threading.Thread(target=self._escuchar, name="outbox-listen", daemon=True).start()
+        log.info("Despachador de notificaciones (%d envíos simultáneos)", self.concurrencia)
+        while True:
+            try:
+                n = self.ciclo()
+            except Exception:
+                log.exception("Ciclo del despachador falló")
+                n = 0
+            if n:
+                continue
+            self._despertar.wait(OUTBOX_POLL_SEGUNDOS)
+            self._despertar.clear()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s")
+    Despachador().correr()
@@ -1,9 +1,16 @@
 import os
 from dotenv import load_dotenv
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 import smtplib
+import threading
 from email.mime.text import MIMEText
 
+from notificaciones.cola_whatsapp import ColaWhatsApp
+from notificaciones.smtp_pool import (
+    PoolSMTP, SMTP_HOST, SMTP_PORT, SMTP_SSL, SMTP_STARTTLS,
+)
+
 load_dotenv()
 
 # 🔐 Twilio
@@ -11,8 +18,9 @@ TWILIO_SID   = os.getenv("TWILIO_ACCOUNT_SID", "").strip()
 TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "").strip()
 # Debe venir en formato 'whatsapp:+14155238886' o el que tengas
 TWILIO_PHONE = os.getenv("TWILIO_PHONE", "").strip()   # remitente WA
+TWILIO_TIMEOUT = float(os.getenv("TWILIO_TIMEOUT", "15"))
 
-# 📧 Email (Gmail SSL 465 como tienes ahora)
+# 📧 Email (Gmail SSL 465 por defecto; servidor/timeouts en notificaciones/smtp_pool.py)
 EMAIL_USER     = os.getenv("EMAIL_USER", "").strip()
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "").strip()
 
@@ -40,12 +48,35 @@ def _format_wa_number(n: str) -> str:
     # Por defecto, si no trae '+', asumimos que ya está completo en tu cuenta de Twilio (no lo forzamos).
     return f"whatsapp:{n}"
 
+class ErrorEnvio(Exception):
+    """Falla transitoria (red, proveedor caído): se puede reintentar."""
+
+
+class ErrorEnvioPermanente(ErrorEnvio):
+    """Falla que no se arregla reintentando (sin destinatario, sin config)."""
+
+
 def _twilio_config_ok() -> bool:
     ok = bool(TWILIO_SID and TWILIO_TOKEN and TWILIO_PHONE)
     if not ok:
         print("[WA][CONFIG] Faltan TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN o TWILIO_PHONE")
     return ok
 
+# 🔁 Cliente Twilio de larga vida: una sola requests.Session con keep-alive
+_twilio_client = None
+_twilio_lock = threading.Lock()
+
+def cliente_twilio() -> Client:
+    global _twilio_client
+    if _twilio_client is None:
+        with _twilio_lock:
+            if _twilio_client is None:
+                _twilio_client = Client(
+                    TWILIO_SID, TWILIO_TOKEN,
+                    http_client=TwilioHttpClient(pool_connections=True, timeout=TWILIO_TIMEOUT),
+                )
+    return _twilio_client
+
 def enviar_whatsapp(*args, **kwargs):
     """
     Soporta:
@@ -69,18 +100,35 @@ def enviar_whatsapp(*args, **kwargs):
         numero_destino = kwargs.get("numero") or kwargs.get("to")
         mensaje = kwargs.get("mensaje") or kwargs.get("body") or ""
 
+    try:
+        info = enviar_whatsapp_o_fallar(numero_destino, mensaje)
+        print(f"[WA] {info}")
+        return info
+    except ErrorEnvioPermanente as e:
+        return f"[WA] {e}"
+    except Exception as e:
+        err = f"Error WhatsApp: {e}"
+        print(f"[WA][ERROR] {err}")
+        return err
+
+def enviar_whatsapp_o_fallar(numero_destino, mensaje) -> str:
+    """
+    Igual que enviar_whatsapp(numero, mensaje) pero LANZA ErrorEnvio /
+    ErrorEnvioPermanente en vez de retornar el texto del error
+    (lo usa el despachador del outbox para decidir reintentos).
+    """
     # --- Fallback de destinatario si no llega ---
     if not numero_destino:
         numero_destino = NOTIF_WA_TO
         if not numero_destino:
-            return "[WA] SIN DESTINATARIO (ni parámetro ni NOTIF_WA_TO). No se envía."
+            raise ErrorEnvioPermanente("SIN DESTINATARIO (ni parámetro ni NOTIF_WA_TO). No se envía.")
 
     # --- Validar config Twilio ---
     if not _twilio_config_ok():
-        return "[WA] Config Twilio incompleta. No se envía."
+        raise ErrorEnvioPermanente("Config Twilio incompleta. No se envía.")
 
     try:
-        client = Client(TWILIO_SID, TWILIO_TOKEN)
+        client = cliente_twilio()
         to_wa = _format_wa_number(numero_destino)
         if not TWILIO_PHONE.startswith("whatsapp:"):
             # Si el from no está en formato whatsapp:, lo normalizamos (no rompemos si ya venía bien)
@@ -93,43 +141,104 @@ def enviar_whatsapp(*args, **kwargs):
             body=mensaje,
             to=to_wa
         )
-        info = f"WhatsApp enviado a {to_wa}: SID {msg.sid}"
-        print(f"[WA] {info}")
-        return info
+        return f"WhatsApp enviado a {to_wa}: SID {msg.sid}"
     except Exception as e:
-        err = f"Error WhatsApp: {e}"
-        print(f"[WA][ERROR] {err}")
-        return err
+        raise ErrorEnvio(str(e)) from e
 
 def enviar_correo(destinatario, asunto, cuerpo_html):
     """
     Envía al destinatario recibido; si viene vacío, usa NOTIF_EMAIL_TO.
-    Mantiene tu transporte: Gmail SSL 465.
+    Mantiene tu transporte (Gmail SSL 465 por defecto, ver SMTP_*), pero
+    reutilizando sesiones ya autenticadas del pool SMTP.
     Retorna string de éxito/error (como ahora).
     """
-    to = (destinatario or "").strip() or NOTIF_EMAIL_TO
-    if not to:
-        return "[EMAIL] SIN DESTINATARIO (ni parámetro ni NOTIF_EMAIL_TO). No se envía."
-
-    if not (EMAIL_USER and EMAIL_PASSWORD):
-        return "[EMAIL] Falta EMAIL_USER/EMAIL_PASSWORD. No se envía."
-
     try:
-        # Aseguramos utf-8; si no es HTML, igual se verá bien
-        is_html = "<" in cuerpo_html and ">" in cuerpo_html
-        msg = MIMEText(cuerpo_html, "html" if is_html else "plain", "utf-8")
-        msg["Subject"] = asunto
-        msg["From"] = EMAIL_USER
-        msg["To"] = to
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(EMAIL_USER, EMAIL_PASSWORD)
-            smtp.send_message(msg)
-
-        info = f"Correo enviado a {to} (asunto='{asunto}')"
+        info = enviar_correo_o_fallar(destinatario, asunto, cuerpo_html)
         print(f"[EMAIL] {info}")
         return info
+    except ErrorEnvioPermanente as e:
+        return f"[EMAIL] {e}"
     except Exception as e:
         err = f"Error Correo: {e}"
         print(f"[EMAIL][ERROR] {err}")
-        return err
\ No newline at end of file
+        return err
+
+# 📨 Cola de WhatsApp del bot (no bloquea el webhook; ver cola_whatsapp.py)
+_cola_wa = ColaWhatsApp(enviar_whatsapp_o_fallar)
+
+def encolar_whatsapp(numero, mensaje):
+    """
+    Como enviar_whatsapp(numero, mensaje) pero retorna al instante: el envío
+    sale por la cola con ritmo por remitente y junta mensajes seguidos al
+    mismo número.
+    """
+    _cola_wa.encolar(numero, mensaje)
+
+def estado_cola_whatsapp() -> dict:
+    return dict(_cola_wa.stats)
+
+# 📧 Sesiones SMTP reutilizables (una sola vez TLS + login por sesión)
+_pool_smtp = None
+_pool_smtp_lock = threading.Lock()
+
+def pool_smtp() -> PoolSMTP:
+    global _pool_smtp
+    if _pool_smtp is None:
+        with _pool_smtp_lock:
+            if _pool_smtp is None:
+                _pool_smtp = PoolSMTP(
+                    SMTP_HOST, SMTP_PORT, EMAIL_USER, EMAIL_PASSWORD,
+                    ssl=SMTP_SSL, starttls=SMTP_STARTTLS,
+                )
+    return _pool_smtp
+
+def _armar_correo(destinatario, asunto, cuerpo_html):
+    """Valida y arma el MIME. Retorna (to, msg)."""
+    to = (destinatario or "").strip() or NOTIF_EMAIL_TO
+    if not to:
+        raise ErrorEnvioPermanente("SIN DESTINATARIO (ni parámetro ni NOTIF_EMAIL_TO). No se envía.")
+
+    if not (EMAIL_USER and EMAIL_PASSWORD):
+        raise ErrorEnvioPermanente("Falta EMAIL_USER/EMAIL_PASSWORD. No se envía.")
+
+    # Aseguramos utf-8; si no es HTML, igual se verá bien
+    is_html = "<" in cuerpo_html and ">" in cuerpo_html
+    msg = MIMEText(cuerpo_html, "html" if is_html else "plain", "utf-8")
+    msg["Subject"] = asunto
+    msg["From"] = EMAIL_USER
+    msg["To"] = to
+    return to, msg
+
+def _error_correo(e: Exception) -> ErrorEnvio:
+    if isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return ErrorEnvioPermanente(str(e))
+    return ErrorEnvio(str(e))
+
+def enviar_correo_o_fallar(destinatario, asunto, cuerpo_html) -> str:
+    """Igual que enviar_correo pero LANZA ErrorEnvio / ErrorEnvioPermanente."""
+    to, msg = _armar_correo(destinatario, asunto, cuerpo_html)
+    try:
+        pool_smtp().enviar(msg)
+    except Exception as e:
+        raise _error_correo(e) from e
+    return f"Correo enviado a {to} (asunto='{asunto}')"
+
+def enviar_correos_lote(correos) -> list:
+    """
+    Envía varios correos [(destinatario, asunto, cuerpo_html), ...] por UNA sesión SMTP.
+    Retorna, por cada uno, el texto de éxito o la excepción (ErrorEnvio / ErrorEnvioPermanente).
+    """
+    resultados = [None] * len(correos)
+    pendientes = []  # (indice, to, asunto, msg)
+    for i, (destinatario, asunto, cuerpo_html) in enumerate(correos):
+        try:
+            to, msg = _armar_correo(destinatario, asunto, cuerpo_html)
+            pendientes.append((i, to, asunto, msg))
+        except ErrorEnvio as e:
+            resultados[i] = e
+    if pendientes:
+        errores = pool_smtp().enviar_lote([p[3] for p in pendientes])
+        for (i, to, asunto, _msg), err in zip(pendientes, errores):
+            resultados[i] = (_error_correo(err) if err is not None
+                             else f"Correo enviado a {to} (asunto='{asunto}')")
+    return resultados
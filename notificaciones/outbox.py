@@ -0,0 +1,31 @@
+# notificaciones/outbox.py
+"""
+Outbox de notificaciones (WhatsApp / correo).
+
+En lugar de enviar dentro del request, se INSERTA la notificación en
+notificaciones_outbox usando el MISMO cursor/transacción del cambio de
+estado: si la transacción hace rollback, no se envía nada; si hace commit,
+el despachador (notificaciones/despachador.py) la enviará con reintentos.
+"""
+CANAL_NOTIFY = "outbox_notificaciones"
+
+CANALES = ("whatsapp", "correo")
+
+
+def encolar(cur, canal: str, destinatario: str, cuerpo: str, asunto: str | None = None,
+            clave: str | None = None):
+    """
+    Agrega una notificación al outbox (no hace commit).
+    'clave' (opcional) evita duplicados: una misma clave solo se encola una vez.
+    Al confirmar la transacción se despierta al despachador con NOTIFY.
+    """
+    if canal not in CANALES:
+        raise ValueError(f"Canal de notificación inválido: {canal}")
+    if not destinatario:
+        return
+    cur.execute("""
+        INSERT INTO notificaciones_outbox (canal, destinatario, asunto, cuerpo, clave)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (clave) DO NOTHING
+    """, (canal, destinatario, asunto, cuerpo, clave))
+    cur.execute("SELECT pg_notify(%s, '')", (CANAL_NOTIFY,))
@@ -0,0 +1,195 @@
+# notificaciones/smtp_pool.py
+"""
+Pool de sesiones SMTP autenticadas y reutilizables.
+
+- Mantiene hasta SMTP_POOL_MAX sesiones abiertas (login una sola vez).
+- Una sesión ociosa más de SMTP_NOOP_SEGUNDOS se valida con NOOP; una
+  ociosa más de SMTP_IDLE_SEGUNDOS se cierra (Gmail las corta igual).
+- Se recicla tras SMTP_MAX_MENSAJES_SESION mensajes.
+- Si el servidor cortó la sesión, se reconecta y se reintenta UNA vez.
+- enviar_lote() manda varios mensajes por la misma sesión.
+- Timeouts: SMTP_TIMEOUT_CONEXION (connect + TLS + login) y
+  SMTP_TIMEOUT_ENVIO (cada comando del envío).
+
+Para probar en local con aiosmtpd (sin TLS ni login):
+    python -m aiosmtpd -n -l localhost:8025
+    PoolSMTP("localhost", 8025, usuario="", clave="", ssl=False)
+"""
+import os
+import smtplib
+import threading
+import time
+
+SMTP_HOST                 = os.getenv("SMTP_HOST", "smtp.gmail.com").strip()
+SMTP_PORT                 = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL                  = os.getenv("SMTP_SSL", "1").strip() != "0"
+SMTP_STARTTLS             = os.getenv("SMTP_STARTTLS", "0").strip() == "1"
+SMTP_POOL_MAX             = int(os.getenv("SMTP_POOL_MAX", "2"))
+SMTP_TIMEOUT_CONEXION     = float(os.getenv("SMTP_TIMEOUT_CONEXION", "10"))
+SMTP_TIMEOUT_ENVIO        = float(os.getenv("SMTP_TIMEOUT_ENVIO", "20"))
+SMTP_NOOP_SEGUNDOS        = float(os.getenv("SMTP_NOOP_SEGUNDOS", "30"))
+SMTP_IDLE_SEGUNDOS        = float(os.getenv("SMTP_IDLE_SEGUNDOS", "240"))
+SMTP_MAX_MENSAJES_SESION  = int(os.getenv("SMTP_MAX_MENSAJES_SESION", "90"))
+
+# Errores propios del mensaje (o de credenciales): reintentar por otra sesión no sirve.
+# Van primero porque en Python 3 toda SMTPException también es OSError.
+_ERRORES_MENSAJE = (
+    smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+    smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError,
+)
+# Errores que indican sesión muerta: vale la pena reconectar y reintentar
+_ERRORES_SESION = (smtplib.SMTPServerDisconnected, smtplib.SMTPHeloError, OSError)
+
+
+class _Sesion:
+    __slots__ = ("smtp", "ultimo_uso", "enviados")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.ultimo_uso = time.monotonic()
+        self.enviados = 0
+
+
+class PoolSMTP:
+    def __init__(self, host: str, port: int, usuario: str, clave: str,
+                 ssl: bool = True, starttls: bool = False, maximo: int = SMTP_POOL_MAX,
+                 timeout_conexion: float = SMTP_TIMEOUT_CONEXION,
+                 timeout_envio: float = SMTP_TIMEOUT_ENVIO):
+        self.host, self.port = host, port
+        self.usuario, self.clave = usuario, clave
+        self.ssl, self.starttls = ssl, starttls
+        self.timeout_conexion = timeout_conexion
+        self.timeout_envio = timeout_envio
+        self._libres = []  # pila LIFO: la más reciente es la más probable de seguir viva
+        self._cupos = threading.BoundedSemaphore(max(1, maximo))
+        self._lock = threading.Lock()
+        self.stats = {"conexiones": 0, "reconexiones": 0, "enviados": 0, "errores": 0}
+
+    # ---------- sesiones ----------
+    def _conectar(self) -> _Sesion:
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout_conexion)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout_conexion)
+            if self.starttls:
+                smtp.starttls()
+        if self.usuario:
+            smtp.login(self.usuario, self.clave)
+        if smtp.sock is not None:
+            smtp.sock.settimeout(self.timeout_envio)
+        with self._lock:
+            self.stats["conexiones"] += 1
+        return _Sesion(smtp)
+
+    @staticmethod
+    def _cerrar(sesion: _Sesion):
+        try:
+            sesion.smtp.quit()
+        except Exception:
+            try:
+                sesion.smtp.close()
+            except Exception:
+                pass
+
+    def _tomar(self) -> _Sesion:
+        while True:
+            with self._lock:
+                sesion = self._libres.pop() if self._libres else None
+            if sesion is None:
+                return self._conectar()
+            ocio = time.monotonic() - sesion.ultimo_uso
+            if ocio > SMTP_IDLE_SEGUNDOS or sesion.enviados >= SMTP_MAX_MENSAJES_SESION:
+                self._cerrar(sesion)
+                continue
+            if ocio > SMTP_NOOP_SEGUNDOS:
+                try:
+                    if sesion.smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP falló")
+                except Exception:
+                    self._cerrar(sesion)
+                    continue
+            return sesion
+
+    def _devolver(self, sesion: _Sesion):
+        sesion.ultimo_uso = time.monotonic()
+        with self._lock:
+            self._libres.append(sesion)
+
+    # ---------- envío ----------
+    def enviar_lote(self, mensajes: list) -> list:
+        """
+        Envía varios email.message.Message por UNA sesión.
+        Retorna una lista del mismo largo con None (ok) o la excepción de ese mensaje.
+        """
+        resultados = []
+        if not self._cupos.acquire(timeout=self.timeout_conexion + self.timeout_envio):
+            err = smtplib.SMTPException("Pool SMTP ocupado")
+            return [err for _ in mensajes]
+        sesion = None
+        try:
+            for msg in mensajes:
+                reintentado = False
+                while True:
+                    try:
+                        if sesion is None:
+                            sesion = self._tomar()
+                        sesion.smtp.send_message(msg)
+                        sesion.enviados += 1
+                        resultados.append(None)
+                        with self._lock:
+                            self.stats["enviados"] += 1
+                        break
+                    except _ERRORES_MENSAJE as e:
+                        self._error_de_mensaje(resultados, e)
+                        if sesion is not None and not self._rset(sesion):
+                            sesion = None
+                        break
+                    except _ERRORES_SESION as e:
+                        if sesion is not None:
+                            self._cerrar(sesion)
+                            sesion = None
+                        if reintentado:
+                            resultados.append(e)
+                            with self._lock:
+                                self.stats["errores"] += 1
+                            break
+                        reintentado = True
+                        with self._lock:
+                            self.stats["reconexiones"] += 1
+                    except Exception as e:
+                        # p. ej. error armando el mensaje: la sesión sigue sirviendo
+                        self._error_de_mensaje(resultados, e)
+                        if sesion is not None and not self._rset(sesion):
+                            sesion = None
+                        break
+        finally:
+            if sesion is not None:
+                self._devolver(sesion)
+            self._cupos.release()
+        return resultados
+
+    def _error_de_mensaje(self, resultados, e):
+        resultados.append(e)
+        with self._lock:
+            self.stats["errores"] += 1
+
+    def _rset(self, sesion: _Sesion) -> bool:
+        """Limpia la transacción SMTP tras un error; False si la sesión murió."""
+        try:
+            sesion.smtp.rset()
+            return True
+        except Exception:
+            self._cerrar(sesion)
+            return False
+
+    def enviar(self, msg):
+        """Envía un mensaje; lanza la excepción si falla."""
+        err = self.enviar_lote([msg])[0]
+        if err is not None:
+            raise err
+
+    def cerrar_todo(self):
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for s in libres:
+            self._cerrar(s)
@@ -69,6 +69,8 @@ def verificar_evento_webhook(evento: dict) -> dict:
         tx = (evento.get("data") or {}).get("transaction") or {}
         reference = tx.get("reference") or evento.get("reference") or ""
         status = tx.get("status") or "ERROR"
-        return {"ok": bool(reference), "reference": reference, "status": status}
+        transaction_id = str(tx.get("id") or "")
+        return {"ok": bool(reference), "reference": reference, "status": status,
+                "transaction_id": transaction_id}
     except Exception:
-        return {"ok": False, "reference": "", "status": "ERROR"}
\ No newline at end of file
+        return {"ok": False, "reference": "", "status": "ERROR", "transaction_id": ""}
\ No newline at end of file
@@ -0,0 +1,48 @@
+# talonario/azar.py
+"""
+Números al azar entre los DISPONIBLES de una rifa, sin ORDER BY random()
+sobre todo el talonario: se muestrea en memoria sobre la foto del talonario
+(talonario/snapshot.py, 2 bits por número, cacheada en el proceso).
+
+- Si al menos 1 de cada AZAR_RECHAZO_MIN números está libre: muestreo por
+  rechazo (posiciones al azar hasta juntar las libres que hagan falta),
+  costo proporcional a lo pedido y no al tamaño del talonario.
+- Si quedan pocos libres: se listan las posiciones libres y se toma una
+  muestra (un recorrido de la foto, sin ir a la DB).
+
+La foto puede estar unos segundos atrasada, por eso se piden candidatos de
+más (AZAR_HOLGURA) y la reserva final la hace reservar_y_crear_compra en
+una sola sentencia, tomando los primeros candidatos que sigan libres.
+"""
+import os
+import random
+
+AZAR_HOLGURA = int(os.getenv("AZAR_HOLGURA", "3"))
+AZAR_RECHAZO_MIN = int(os.getenv("AZAR_RECHAZO_MIN", "4"))
+
+# generador del sistema: el orden de los candidatos no se puede predecir
+_rng = random.SystemRandom()
+
+
+def candidatos_al_azar(snap, cantidad: int, holgura: int = AZAR_HOLGURA):
+    """
+    Hasta cantidad*holgura números libres según la foto, en orden aleatorio
+    (cualquier prefijo es una muestra uniforme). None si no alcanzan.
+    """
+    if cantidad <= 0 or snap.disponibles < cantidad:
+        return None
+    objetivo = min(snap.disponibles, cantidad * max(1, holgura))
+    total = len(snap)
+
+    if snap.disponibles * AZAR_RECHAZO_MIN >= total:
+        elegidos = set()
+        while len(elegidos) < objetivo:
+            i = _rng.randrange(total)
+            if snap.codigo(i) == 0:
+                elegidos.add(i)
+        orden = list(elegidos)
+        _rng.shuffle(orden)  # el orden de un set no es aleatorio
+    else:
+        libres = [i for i in range(total) if snap.codigo(i) == 0]
+        orden = _rng.sample(libres, objetivo)
+    return [snap.numeros[i] for i in orden]
@@ -0,0 +1,63 @@
+# talonario/busqueda.py
+"""
+Búsqueda de números DISPONIBLES por patrón dentro de una rifa:
+  empieza "12" -> 1200..1299   rango sobre numeros_unq (id_rifa, numero)
+  termina "7"  -> ...7         rango sobre idx_numeros_reverso (id_rifa, reverse(numero))
+  contiene "13"                GIN de trigramas idx_numeros_trgm (id_rifa, numero)
+
+Todos los números de una rifa tienen 'cifras' dígitos, así que prefijo y
+sufijo se vuelven un rango entre p+"000" y p+"999" (comparar strings de
+dígitos del mismo largo no depende de la collation). Con 3 o más dígitos
+"contiene" usa los trigramas; con menos, Postgres recorre solo las filas de
+la rifa por numeros_unq. Siempre con LIMIT.
+"""
+import os
+import re
+
+BUSQUEDA_LIMITE_MAX = int(os.getenv("BUSQUEDA_LIMITE_MAX", "100"))
+
+MODOS = ("empieza", "termina", "contiene")
+PATRON_VALIDO = re.compile(r"^[0-9]{1,6}$")
+
+# disponible "efectivo": una reserva vencida también cuenta (igual que la grilla)
+_SQL_DISPONIBLE = "(estado='disponible' OR (estado='reservado' AND reservado_hasta < NOW()))"
+
+
+def buscar_disponibles(cur, rifa_id: int, cifras: int, patron: str, modo: str = "contiene",
+                       limite: int = 20):
+    """
+    Retorna (numeros, hay_mas): números disponibles que cumplen el patrón,
+    en orden, como mucho 'limite'. Lanza ValueError si el patrón o el modo
+    no son válidos.
+    """
+    patron = (patron or "").strip()
+    if not PATRON_VALIDO.match(patron):
+        raise ValueError("El patrón debe tener solo dígitos (1 a 6).")
+    if modo not in MODOS:
+        raise ValueError(f"Modo inválido: {modo}")
+    limite = max(1, min(int(limite), BUSQUEDA_LIMITE_MAX))
+    if len(patron) > cifras:
+        return [], False
+
+    relleno = cifras - len(patron)
+    if modo == "empieza":
+        condicion = "numero BETWEEN %s AND %s"
+        params = (patron + "0" * relleno, patron + "9" * relleno)
+    elif modo == "termina":
+        inverso = patron[::-1]
+        condicion = "reverse(numero) BETWEEN %s AND %s"
+        params = (inverso + "0" * relleno, inverso + "9" * relleno)
+    else:
+        condicion = "numero LIKE %s"
+        params = (f"%{patron}%",)
+
+    # se pide uno de más para saber si hay más resultados
+    cur.execute(f"""
+        SELECT numero
+          FROM numeros
+         WHERE id_rifa = %s AND {condicion} AND {_SQL_DISPONIBLE}
+         ORDER BY numero ASC
+         LIMIT %s
+    """, (rifa_id, *params, limite + 1))
+    numeros = [fila[0] for fila in cur.fetchall()]
+    return numeros[:limite], len(numeros) > limite
@@ -0,0 +1,123 @@
+# talonario/eventos.py
+"""
+Cambios de estado de números en vivo (LISTEN/NOTIFY -> suscriptores SSE).
+
+El trigger trg_numeros_notificar (crear_db_postgres.py) hace
+pg_notify('numeros_rifa', '{"r": <rifa_id>, "c": [["05","reservado"], ...]}')
+en cada UPDATE de numeros: reserva (generar_pago), webhook de Wompi y
+liberador de reservas. Aquí, un hilo por worker escucha ese canal con una
+conexión propia (fuera del pool) y reparte cada mensaje a las colas de los
+navegadores suscritos a esa rifa. También invalida la foto del talonario
+en este worker, así el cache queda al día aunque el cambio venga de otro:
+por eso el hilo arranca con el primer uso del cache (obtener_snapshot), no
+solo con el primer suscriptor SSE.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+
+from basedatos.pool import get_db_url
+from talonario.snapshot import invalidar as invalidar_snapshot
+
+log = logging.getLogger(__name__)
+
+CANAL = "numeros_rifa"
+COLA_MAX = int(os.getenv("SSE_COLA_MAX", "100"))
+
+# Mensaje especial: el suscriptor se atrasó y debe pedir la foto completa
+RESINCRONIZAR = "__resync__"
+
+_suscriptores = {}  # rifa_id -> set(queue.Queue)
+_lock = threading.Lock()
+_hilo = None
+_hilo_pid = None
+
+
+def suscribir(rifa_id: int) -> queue.Queue:
+    iniciar()
+    q = queue.Queue(maxsize=COLA_MAX)
+    with _lock:
+        _suscriptores.setdefault(rifa_id, set()).add(q)
+    return q
+
+
+def desuscribir(rifa_id: int, q: queue.Queue):
+    with _lock:
+        subs = _suscriptores.get(rifa_id)
+        if subs:
+            subs.discard(q)
+            if not subs:
+                _suscriptores.pop(rifa_id, None)
+
+
+def suscriptores_activos() -> int:
+    with _lock:
+        return sum(len(s) for s in _suscriptores.values())
+
+
+def _repartir(payload: str):
+    try:
+        data = json.loads(payload)
+        rifa_id = int(data["r"])
+    except Exception:
+        return
+    invalidar_snapshot(rifa_id)
+    with _lock:
+        subs = list(_suscriptores.get(rifa_id, ()))
+    for q in subs:
+        try:
+            q.put_nowait(payload)
+        except queue.Full:
+            # navegador lento: vaciamos y le pedimos que se resincronice
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+            q.put_nowait(RESINCRONIZAR)
+
+
+def _escuchar():
+    espera = 1
+    while True:
+        con = None
+        try:
+            con = psycopg2.connect(get_db_url())
+            con.autocommit = True
+            con.cursor().execute(f"LISTEN {CANAL}")
+            espera = 1
+            while True:
+                if select.select([con], [], [], 30) == ([], [], []):
+                    con.cursor().execute("SELECT 1")  # mantiene viva la conexión
+                    continue
+                con.poll()
+                while con.notifies:
+                    _repartir(con.notifies.pop(0).payload)
+        except Exception as e:
+            log.warning("LISTEN %s falló: %s (reintento en %ss)", CANAL, e, espera)
+            time.sleep(espera)
+            espera = min(espera * 2, 30)
+        finally:
+            try:
+                if con is not None:
+                    con.close()
+            except Exception:
+                pass
+
+
+def iniciar():
+    """Arranca el hilo LISTEN de este proceso si no está corriendo (idempotente)."""
+    global _hilo, _hilo_pid
+    if _hilo is not None and _hilo_pid == os.getpid() and _hilo.is_alive():
+        return
+    with _lock:
+        if _hilo is None or _hilo_pid != os.getpid() or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_escuchar, name="eventos-numeros", daemon=True)
+            _hilo.start()
+            _hilo_pid = os.getpid()
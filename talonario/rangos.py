@@ -0,0 +1,91 @@
+# talonario/rangos.py
+"""
+Talonario por rangos, para rifas grandes (4 cifras) donde la grilla del
+navegador es virtual y solo pide los números que están a la vista.
+
+- universo(): qué números tiene la rifa, como bitmap de 1 bit por valor
+  0..10**cifras-1 (1.250 bytes para 4 cifras). Los números de una rifa no
+  cambian después de creada, así que se cachea en el proceso por rifa.
+- numeros_en_rango(): estado efectivo de los números de un rango, paginado
+  por llave (keyset) sobre (id_rifa, numero): usa el índice de numeros_unq
+  y cada página cuesta lo mismo sin importar en qué parte del talonario está.
+"""
+import os
+
+from basedatos.cache import CacheTTL, FALTA
+from talonario.snapshot import ESTADOS, universo_b64
+
+RANGO_LIMITE_MAX = int(os.getenv("RANGO_LIMITE_MAX", "1000"))
+
+_universos = CacheTTL(maximo=int(os.getenv("UNIVERSO_CACHE_MAX", "64")),
+                      ttl=float(os.getenv("UNIVERSO_CACHE_TTL", "3600")))
+
+
+def universo(cur, rifa_id: int, cifras: int):
+    """(total, bitmap base64) de la rifa; bitmap None si hay números no uniformes."""
+    valor = _universos.get(rifa_id)
+    if valor is FALTA:
+        cur.execute("SELECT numero FROM numeros WHERE id_rifa = %s", (rifa_id,))
+        numeros = [fila[0] for fila in cur]
+        valor = (len(numeros), universo_b64(numeros, cifras))
+        _universos.set(rifa_id, valor)
+    return valor
+
+
+def normalizar(numero: str | None, cifras: int):
+    """'5' -> '0005' en una rifa de 4 cifras (los números se guardan con ceros)."""
+    numero = (numero or "").strip()
+    if not numero:
+        return None
+    if numero.isdigit() and len(numero) < cifras:
+        numero = numero.zfill(cifras)
+    return numero
+
+
+def numeros_en_rango(cur, rifa_id: int, desde: str | None = None, hasta: str | None = None,
+                     despues: str | None = None, estado: str | None = None,
+                     limite: int = 500):
+    """
+    Números de la rifa con desde <= numero < hasta (y numero > despues, el
+    cursor de la página anterior), opcionalmente solo los de un estado.
+    Retorna (filas [(numero, estado)], siguiente): 'siguiente' es el cursor
+    para pedir la página que sigue, o None si no hay más.
+    """
+    limite = max(1, min(int(limite), RANGO_LIMITE_MAX))
+    condiciones = ["id_rifa = %s"]
+    params = [rifa_id]
+    # una sola cota inferior: la más alta entre 'desde' y el cursor
+    if despues is not None and (desde is None or despues >= desde):
+        condiciones.append("numero > %s")
+        params.append(despues)
+    elif desde is not None:
+        condiciones.append("numero >= %s")
+        params.append(desde)
+    if hasta is not None:
+        condiciones.append("numero < %s")
+        params.append(hasta)
+    if estado is not None:
+        if estado not in ESTADOS:
+            raise ValueError(f"Estado inválido: {estado}")
+        # (una reserva vencida se lee como disponible, igual que la grilla)
+        condiciones.append(
+            "CASE WHEN estado='reservado' AND reservado_hasta < NOW() "
+            "THEN 'disponible' ELSE estado END = %s")
+        params.append(estado)
+
+    # se pide uno de más para saber si hay otra página
+    cur.execute(f"""
+        SELECT numero,
+               CASE WHEN estado='reservado' AND reservado_hasta < NOW() THEN 'disponible'
+                    ELSE estado END
+          FROM numeros
+         WHERE {" AND ".join(condiciones)}
+         ORDER BY numero ASC
+         LIMIT %s
+    """, (*params, limite + 1))
+    filas = [tuple(f) for f in cur.fetchall()]
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = filas[-1][0]
+    return filas, siguiente
@@ -0,0 +1,166 @@
+# talonario/snapshot.py
+"""
+Foto compacta del estado de los números de una rifa (cache en el proceso).
+
+- numeros: lista ORDENADA de los números del talonario (strings)
+- estados: bytearray empaquetado a 2 bits por número, en el mismo orden
+      0 = disponible · 1 = reservado · 2 = pagado
+  (4 por byte, el primero en los bits bajos; el último byte puede ir a medias.
+  rifa_publica.html decodifica con la misma cuenta que desempaquetar()).
+- Una reserva vencida se toma como disponible (igual que SQL_ESTADO_EFECTIVO).
+
+El cache se invalida explícitamente en cada cambio de estado hecho por este
+worker (invalidar), con cada NOTIFY de otro worker (talonario/eventos.py,
+que arranca al primer uso del cache) y, por si se pierde alguno, expira a
+los SNAPSHOT_TTL_SEGUNDOS o cuando vence la primera reserva que contiene. Si el
+llamador conoce la versión de la rifa (rifa_stats.version) y no coincide con
+la de la foto, se reconstruye.
+"""
+import base64
+import os
+import threading
+import time
+from bisect import bisect_left
+
+SNAPSHOT_TTL_SEGUNDOS = float(os.getenv("SNAPSHOT_TTL_SEGUNDOS", "2"))
+
+ESTADOS = ("disponible", "reservado", "pagado")
+_CODIGO = {e: i for i, e in enumerate(ESTADOS)}
+
+
+class SnapshotRifa:
+    __slots__ = ("rifa_id", "cifras", "numeros", "estados", "creado", "vence", "version",
+                 "disponibles")
+
+    def __init__(self, rifa_id: int, cifras: int, numeros: list, estados: bytearray, vence: float,
+                 disponibles: int | None = None):
+        self.rifa_id = rifa_id
+        self.cifras = cifras
+        self.numeros = numeros
+        self.estados = estados
+        self.creado = time.monotonic()
+        self.vence = vence  # time.time() en que vence la primera reserva (o inf)
+        self.version = None
+        if disponibles is None:
+            disponibles = sum(1 for i in range(len(numeros)) if self.codigo(i) == 0)
+        self.disponibles = disponibles
+
+    def __len__(self):
+        return len(self.numeros)
+
+    def codigo(self, i: int) -> int:
+        return (self.estados[i >> 2] >> ((i & 3) * 2)) & 3
+
+    def estado_de(self, numero: str):
+        i = bisect_left(self.numeros, numero)
+        if i < len(self.numeros) and self.numeros[i] == numero:
+            return ESTADOS[self.codigo(i)]
+        return None
+
+    def conteos(self) -> dict:
+        out = dict.fromkeys(ESTADOS, 0)
+        for i in range(len(self.numeros)):
+            out[ESTADOS[self.codigo(i)]] += 1
+        return out
+
+    def vigente(self) -> bool:
+        return (time.monotonic() - self.creado < SNAPSHOT_TTL_SEGUNDOS
+                and time.time() < self.vence)
+
+    def payload(self) -> dict:
+        """
+        Lo que se envía al navegador (pocos KB incluso con 10.000 números):
+        - estados: base64 de los 2 bits por número
+        - universo: base64 de un bit por cada valor 0..10**cifras-1 que exista
+          en el talonario (1.250 bytes para 4 cifras)
+        Si algún número no es de 'cifras' dígitos se manda 'lista' en su lugar.
+        """
+        data = {
+            "cifras": self.cifras,
+            "total": len(self.numeros),
+            "estados": base64.b64encode(bytes(self.estados)).decode("ascii"),
+        }
+        universo = universo_b64(self.numeros, self.cifras)
+        if universo is not None:
+            data["universo"] = universo
+        else:
+            data["lista"] = self.numeros
+        return data
+
+
+def empaquetar(codigos) -> bytearray:
+    """Códigos 0..2 -> 2 bits por número."""
+    estados = bytearray()
+    for i, codigo in enumerate(codigos):
+        if i & 3 == 0:
+            estados.append(0)
+        estados[-1] |= codigo << ((i & 3) * 2)
+    return estados
+
+
+def desempaquetar(estados: bytes, total: int) -> list:
+    """Inverso de empaquetar (la cuenta de cargarSnapshot en rifa_publica.html)."""
+    return [(estados[i >> 2] >> ((i & 3) * 2)) & 3 for i in range(total)]
+
+
+def universo_b64(numeros, cifras: int):
+    """
+    Bitmap (base64) con un bit por cada valor 0..10**cifras-1 presente en
+    'numeros'. None si algún número no es de 'cifras' dígitos.
+    """
+    universo = bytearray((10 ** cifras + 7) // 8)
+    for n in numeros:
+        if len(n) != cifras or not n.isdigit():
+            return None
+        v = int(n)
+        universo[v >> 3] |= 1 << (v & 7)
+    return base64.b64encode(bytes(universo)).decode("ascii")
+
+
+def construir_snapshot(cur, rifa_id: int, cifras: int) -> SnapshotRifa:
+    """Una consulta con cursor de tuplas (sin dicts por fila)."""
+    cur.execute("""
+        SELECT numero,
+               CASE WHEN estado='reservado' AND reservado_hasta < NOW() THEN 'disponible'
+                    ELSE estado END,
+               CASE WHEN estado='reservado' AND reservado_hasta >= NOW()
+                    THEN EXTRACT(EPOCH FROM reservado_hasta) END
+          FROM numeros
+         WHERE id_rifa = %s
+         ORDER BY numero ASC
+    """, (rifa_id,))
+    numeros = []
+    codigos = []
+    vence = float("inf")
+    for numero, estado, hasta in cur:
+        numeros.append(numero)
+        codigos.append(_CODIGO.get(estado, 0))
+        if hasta is not None and float(hasta) < vence:
+            vence = float(hasta)
+    return SnapshotRifa(rifa_id, cifras, numeros, empaquetar(codigos), vence,
+                        codigos.count(0))
+
+
+# ================== CACHE EN PROCESO ==================
+_cache = {}
+_lock = threading.Lock()
+
+
+def obtener_snapshot(cur, rifa_id: int, cifras: int, version: int | None = None) -> SnapshotRifa:
+    with _lock:
+        snap = _cache.get(rifa_id)
+    if snap is not None and snap.vigente() and (version is None or snap.version == version):
+        return snap
+    # el cache solo es confiable si llegan los cambios de los otros workers
+    from talonario import eventos  # (importa este módulo: aquí evita el ciclo)
+    eventos.iniciar()
+    snap = construir_snapshot(cur, rifa_id, cifras)
+    snap.version = version
+    with _lock:
+        _cache[rifa_id] = snap
+    return snap
+
+
+def invalidar(rifa_id: int):
+    with _lock:
+        _cache.pop(rifa_id, None)
@@ -0,0 +1,18 @@
+# tareas/__main__.py
+"""
+Proceso dedicado para las tareas en segundo plano:
+    python -m tareas
+Útil si el web corre con TAREAS_EN_WEB=0.
+"""
+import logging
+import os
+import time
+
+os.environ["TAREAS_EN_WEB"] = "1"
+
+import app  # noqa: E402,F401  (registra y arranca las tareas)
+
+if __name__ == "__main__":
+    logging.getLogger("tareas").info("Tareas en segundo plano corriendo (Ctrl+C para salir)")
+    while True:
+        time.sleep(3600)
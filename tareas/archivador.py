@@ -0,0 +1,34 @@
+# tareas/archivador.py
+"""Archivado automático de rifas cuya fecha_fin ya pasó."""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def archivar_rifas_vencidas(cur):
+    """
+    Archiva toda rifa 'activa' cuya fecha_fin ya pasó.
+    Si fecha_fin es NULL, no hace nada. Es idempotente.
+    Retorna los segundos que faltan para el próximo cierre (o None),
+    para que el planificador despierte justo en esa fecha_fin.
+    """
+    cur.execute("""
+        UPDATE rifas
+           SET estado = 'archivada'
+         WHERE estado = 'activa'
+           AND fecha_fin IS NOT NULL
+           AND NOW() >= fecha_fin
+    """)
+    if cur.rowcount:
+        log.info("%d rifa(s) archivada(s)", cur.rowcount)
+
+    cur.execute("""
+        SELECT EXTRACT(EPOCH FROM (MIN(fecha_fin) - NOW()))
+          FROM rifas
+         WHERE estado = 'activa'
+           AND fecha_fin IS NOT NULL
+    """)
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return None
+    return max(0.0, float(row[0]))
@@ -0,0 +1,125 @@
+# tareas/planificador.py
+"""
+Planificador mínimo de tareas en segundo plano.
+
+Cada tarea corre en un hilo daemon y, en cada ciclo:
+  1) toma una conexión del pool (basedatos/pool.py)
+  2) intenta pg_try_advisory_xact_lock(lock_id): si otro worker de gunicorn
+     ya la está ejecutando, este ciclo se salta (seguro con N workers)
+  3) ejecuta la función con el cursor y hace COMMIT (libera el lock)
+
+La función puede retornar un número de segundos para adelantar el próximo
+ciclo (p. ej. despertar justo en la fecha_fin de una rifa); nunca se espera
+más que el intervalo configurado.
+"""
+import logging
+import os
+import threading
+import time
+
+from basedatos.pool import conexion
+
+log = logging.getLogger(__name__)
+
+# Llaves de advisory lock (una por tarea, fijas para todo el despliegue)
+LOCK_ARCHIVAR_RIFAS   = 740001
+LOCK_LIBERAR_RESERVAS = 740002
+
+# Pausa mínima entre ciclos para no martillar la DB si algo retorna 0
+_PAUSA_MINIMA = 0.5
+
+
+class TareaPeriodica:
+    def __init__(self, nombre: str, intervalo: float, funcion, lock_id: int):
+        self.nombre = nombre
+        self.intervalo = float(intervalo)
+        self.funcion = funcion
+        self.lock_id = lock_id
+        self._despertar = threading.Event()
+        self._hilo = None
+        self.ultima_ejecucion = None
+        self.ultimo_error = None
+
+    def ejecutar_una_vez(self):
+        """Un ciclo: retorna (ejecutada, segundos_sugeridos)."""
+        con = conexion()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (self.lock_id,))
+            if not cur.fetchone()[0]:
+                con.rollback()
+                return False, None
+            sugerido = self.funcion(cur)
+            con.commit()
+            self.ultima_ejecucion = time.time()
+            self.ultimo_error = None
+            return True, sugerido
+        finally:
+            con.close()
+
+    def _loop(self):
+        while True:
+            espera = self.intervalo
+            try:
+                _, sugerido = self.ejecutar_una_vez()
+                if sugerido is not None:
+                    espera = min(espera, max(_PAUSA_MINIMA, float(sugerido)))
+            except Exception as e:
+                self.ultimo_error = str(e)
+                log.exception("Tarea %s falló", self.nombre)
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def despertar(self):
+        """Adelanta el próximo ciclo (p. ej. al crear una rifa con fecha_fin)."""
+        self._despertar.set()
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._loop, name=f"tarea-{self.nombre}", daemon=True)
+        self._hilo.start()
+
+
+_tareas = {}
+_tareas_pid = None
+_tareas_lock = threading.Lock()
+
+
+def registrar(tarea: TareaPeriodica) -> TareaPeriodica:
+    _tareas[tarea.nombre] = tarea
+    return tarea
+
+
+def tarea(nombre: str):
+    return _tareas.get(nombre)
+
+
+def iniciar_tareas():
+    """
+    Arranca los hilos de las tareas registradas una sola vez por proceso.
+    Se desactiva con TAREAS_EN_WEB=0 (p. ej. si corren en un proceso aparte).
+    """
+    global _tareas_pid
+    if os.getenv("TAREAS_EN_WEB", "1").strip() == "0":
+        return
+    with _tareas_lock:
+        if _tareas_pid == os.getpid():
+            return
+        _tareas_pid = os.getpid()
+        for t in _tareas.values():
+            t._hilo = None  # tras un fork el hilo del padre no existe aquí
+            t.iniciar()
+
+
+def estado_tareas() -> list:
+    return [
+        {
+            "nombre": t.nombre,
+            "intervalo": t.intervalo,
+            "activa": bool(t._hilo and t._hilo.is_alive()),
+            "ultima_ejecucion": t.ultima_ejecucion,
+            "ultimo_error": t.ultimo_error,
+        }
+        for t in _tareas.values()
+    ]
@@ -0,0 +1,62 @@
+# tareas/reconciliar_stats.py
+"""
+Reconstruye los contadores de rifa_stats desde numeros (fuente de verdad).
+    python -m tareas.reconciliar_stats            # todas las rifas
+    python -m tareas.reconciliar_stats 12 15      # solo esas rifas
+Bloquea escrituras en numeros mientras recalcula (LOCK SHARE) para no perder
+deltas de los triggers; en tablas grandes córrelo en horas de poco tráfico.
+"""
+import logging
+import sys
+
+from basedatos.pool import conexion
+
+log = logging.getLogger(__name__)
+
+
+def reconstruir_rifa_stats(cur, rifa_ids=None) -> int:
+    """
+    Reemplaza los shards de cada rifa por un único shard 0 recalculado. No hace commit.
+    La versión de la rifa se conserva y sube en 1 (nunca retrocede: es llave de cache).
+    """
+    cur.execute("LOCK TABLE numeros IN SHARE MODE")
+    # rifas = NULL -> todas; el filtro va siempre como parámetro, nunca pegado al SQL
+    params = {"rifas": list(rifa_ids) if rifa_ids else None}
+    cur.execute("""
+        CREATE TEMP TABLE _rifa_versiones ON COMMIT DROP AS
+        SELECT s.id_rifa, SUM(s.version) AS version
+          FROM rifa_stats s
+          JOIN rifas r ON r.id = s.id_rifa
+         WHERE (%(rifas)s::bigint[] IS NULL OR r.id = ANY(%(rifas)s::bigint[]))
+         GROUP BY s.id_rifa
+    """, params)
+    cur.execute("""
+        DELETE FROM rifa_stats s
+         USING rifas r
+         WHERE s.id_rifa = r.id
+           AND (%(rifas)s::bigint[] IS NULL OR r.id = ANY(%(rifas)s::bigint[]))
+    """, params)
+    cur.execute("""
+        INSERT INTO rifa_stats (id_rifa, shard, total, disponibles, reservados, pagados, recaudado, version)
+        SELECT r.id, 0,
+               COUNT(n.id),
+               COUNT(n.id) FILTER (WHERE n.estado='disponible'),
+               COUNT(n.id) FILTER (WHERE n.estado='reservado'),
+               COUNT(n.id) FILTER (WHERE n.estado='pagado'),
+               COALESCE(SUM(r.valor_numero) FILTER (WHERE n.estado='pagado'), 0),
+               COALESCE(MAX(v.version), 0) + 1
+          FROM rifas r
+          LEFT JOIN numeros n ON n.id_rifa = r.id
+          LEFT JOIN _rifa_versiones v ON v.id_rifa = r.id
+         WHERE (%(rifas)s::bigint[] IS NULL OR r.id = ANY(%(rifas)s::bigint[]))
+         GROUP BY r.id
+    """, params)
+    return cur.rowcount
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    ids = [int(x) for x in sys.argv[1:]] or None
+    with conexion() as con:
+        n = reconstruir_rifa_stats(con.cursor(), ids)
+    log.info("rifa_stats reconstruido para %d rifa(s)", n)
@@ -0,0 +1,55 @@
+# tareas/reservas.py
+"""Liberación en segundo plano de reservas vencidas (todas las rifas)."""
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+# Tamaño de lote y tope de lotes por ciclo (para no sostener locks mucho tiempo)
+LIBERAR_LOTE        = int(os.getenv("LIBERAR_LOTE", "500"))
+LIBERAR_MAX_LOTES   = int(os.getenv("LIBERAR_MAX_LOTES", "20"))
+
+
+def liberar_reservas_vencidas(cur):
+    """
+    Pone 'disponible' los números 'reservado' cuyo reservado_hasta ya pasó,
+    en lotes de LIBERAR_LOTE usando el índice parcial idx_numeros_reservado_hasta.
+    SKIP LOCKED: si un checkout está tocando esa fila, se libera en el próximo ciclo.
+    Retorna los segundos hasta el próximo vencimiento (o None).
+    """
+    total = 0
+    for _ in range(LIBERAR_MAX_LOTES):
+        cur.execute("""
+            WITH vencidos AS (
+                SELECT id
+                  FROM numeros
+                 WHERE estado = 'reservado'
+                   AND reservado_hasta < NOW()
+                 ORDER BY reservado_hasta
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            )
+            UPDATE numeros n
+               SET estado='disponible', reservado_hasta=NULL, id_comprador=NULL
+              FROM vencidos v
+             WHERE n.id = v.id
+        """, (LIBERAR_LOTE,))
+        total += cur.rowcount
+        if cur.rowcount < LIBERAR_LOTE:
+            break
+    else:
+        # quedó trabajo pendiente: volver a correr de inmediato
+        return 0
+
+    if total:
+        log.info("%d número(s) liberado(s)", total)
+
+    cur.execute("""
+        SELECT EXTRACT(EPOCH FROM (MIN(reservado_hasta) - NOW()))
+          FROM numeros
+         WHERE estado = 'reservado'
+    """)
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return None
+    return max(0.0, float(row[0]))
@@ -0,0 +1,116 @@
+# tests/conftest.py
+"""
+Pruebas con pytest (pip install -r requirements-dev.txt).
+
+Las que tocan la base necesitan un Postgres DESECHABLE (con pg_trgm y
+btree_gin): el esquema public se borra y se crea desde cero con SCHEMA_SQL.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/rifas_test python -m pytest -q
+
+Sin TEST_DATABASE_URL esas pruebas se omiten; las demás corren igual.
+"""
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+TEST_DATABASE_URL = (os.getenv("TEST_DATABASE_URL") or "").strip()
+if TEST_DATABASE_URL and "sslmode=" not in TEST_DATABASE_URL:
+    # Postgres local de pruebas: sin TLS (pool.get_db_url agregaría 'require')
+    TEST_DATABASE_URL += ("&" if "?" in TEST_DATABASE_URL else "?") + "sslmode=disable"
+if TEST_DATABASE_URL:
+    # la app y sus módulos leen DATABASE_URL; las tareas de fondo no arrancan
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ.setdefault("TAREAS_EN_WEB", "0")
+
+TABLAS = ("wompi_eventos", "compra_numeros", "pagos", "compras", "numeros", "rifa_stats",
+          "compradores", "rifas", "negocios", "notificaciones_outbox")
+
+
+@pytest.fixture(scope="session")
+def esquema():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL no está configurada (Postgres desechable)")
+    import psycopg2
+    from crear_db_postgres import SCHEMA_SQL
+
+    con = psycopg2.connect(TEST_DATABASE_URL)
+    con.autocommit = True
+    with con.cursor() as cur:
+        cur.execute("DROP SCHEMA IF EXISTS public CASCADE; CREATE SCHEMA public;")
+        cur.execute(SCHEMA_SQL)
+    con.close()
+    return TEST_DATABASE_URL
+
+
+@pytest.fixture
+def conectar(esquema):
+    """Fábrica de conexiones directas a la base de pruebas (se cierran al final)."""
+    import psycopg2
+
+    abiertas = []
+
+    def _conectar():
+        con = psycopg2.connect(esquema)
+        abiertas.append(con)
+        return con
+
+    yield _conectar
+    for con in abiertas:
+        con.close()
+
+
+@pytest.fixture
+def con(conectar):
+    """Conexión a una base vacía (cada prueba parte sin datos)."""
+    c = conectar()
+    with c.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(TABLAS)} RESTART IDENTITY CASCADE")
+    c.commit()
+    return c
+
+
+@pytest.fixture
+def sembrar(con):
+    """
+    sembrar(cifras=2, cantidad=100, valor=1000) -> dict(negocio_id, rifa_id, link)
+    Negocio + rifa activa con su talonario completo ('00'..'99' por defecto).
+    """
+    from basedatos.copia import copiar_filas
+
+    def _sembrar(cifras=2, cantidad=None, valor=1000, numeros=None):
+        if numeros is None:
+            cantidad = 10 ** cifras if cantidad is None else cantidad
+            numeros = [str(i).zfill(cifras) for i in range(cantidad)]
+        with con.cursor() as cur:
+            cur.execute("""
+                INSERT INTO negocios (nombre_negocio, nombre_propietario, celular, correo, contrasena)
+                VALUES ('Prueba', 'Dueño', '3000000000', 'negocio@example.com', 'x')
+                RETURNING id
+            """)
+            negocio_id = cur.fetchone()[0]
+            link = f"prueba{negocio_id:06d}"
+            cur.execute("""
+                INSERT INTO rifas (id_negocio, nombre, cifras, cantidad_numeros, valor_numero,
+                                   link_publico, estado)
+                VALUES (%s, 'Rifa de prueba', %s, %s, %s, %s, 'activa')
+                RETURNING id
+            """, (negocio_id, cifras, len(numeros), valor, link))
+            rifa_id = cur.fetchone()[0]
+            copiar_filas(cur, "numeros", ["id_rifa", "numero", "estado"],
+                         ((rifa_id, n, "disponible") for n in numeros))
+        con.commit()
+        return {"negocio_id": negocio_id, "rifa_id": rifa_id, "link": link}
+
+    return _sembrar
+
+
+@pytest.fixture
+def app_modulo(esquema):
+    """El módulo app.py importado contra la base de pruebas."""
+    import app as app_mod
+    return app_mod
@@ -0,0 +1,104 @@
+# tests/test_azar.py
+"""Números al azar sobre la foto del talonario (sin base de datos)."""
+import random
+
+import pytest
+
+from talonario import azar
+from talonario.snapshot import SnapshotRifa, empaquetar
+
+
+class Espia(random.Random):
+    """Generador con semilla que anota qué camino tomó candidatos_al_azar."""
+
+    def __init__(self, semilla=0):
+        super().__init__(semilla)
+        self.llamadas = set()
+
+    def randrange(self, *args, **kwargs):
+        self.llamadas.add("rechazo")
+        return super().randrange(*args, **kwargs)
+
+    def sample(self, *args, **kwargs):
+        self.llamadas.add("muestra")
+        return super().sample(*args, **kwargs)
+
+
+def _snap(total, libres, semilla=0):
+    """Foto de 'total' números con 'libres' disponibles; el resto reservado o pagado."""
+    rng = random.Random(semilla)
+    codigos = [0] * libres + [rng.choice((1, 2)) for _ in range(total - libres)]
+    rng.shuffle(codigos)
+    numeros = [f"{i:03d}" for i in range(total)]
+    return SnapshotRifa(1, 3, numeros, empaquetar(codigos), float("inf"))
+
+
+def _libres(snap):
+    return {snap.numeros[i] for i in range(len(snap)) if snap.codigo(i) == 0}
+
+
+@pytest.fixture
+def espia(monkeypatch):
+    e = Espia()
+    monkeypatch.setattr(azar, "_rng", e)
+    monkeypatch.setattr(azar, "AZAR_RECHAZO_MIN", 4)
+    return e
+
+
+@pytest.mark.parametrize("libres", [1, 5, 24, 25, 60, 100])
+@pytest.mark.parametrize("cantidad", [1, 3, 8])
+def test_solo_libres_y_sin_repetidos(espia, libres, cantidad):
+    for semilla in range(20):
+        snap = _snap(100, libres, semilla)
+        res = azar.candidatos_al_azar(snap, cantidad, holgura=3)
+        if cantidad > libres:
+            assert res is None
+            continue
+        assert len(res) == min(libres, cantidad * 3)
+        assert len(set(res)) == len(res)
+        assert set(res) <= _libres(snap)
+
+
+def test_pedir_mas_de_los_disponibles(espia):
+    snap = _snap(100, 5)
+    assert azar.candidatos_al_azar(snap, 6) is None
+    assert azar.candidatos_al_azar(snap, 0) is None
+    assert azar.candidatos_al_azar(_snap(100, 0), 1) is None
+    assert azar.candidatos_al_azar(_snap(0, 0), 1) is None
+    # justo los que hay: salen todos (y nada más)
+    assert set(azar.candidatos_al_azar(snap, 5)) == _libres(snap)
+    assert espia.llamadas == {"muestra"}
+
+
+def test_rechazo_desde_un_cuarto_libre(espia):
+    # 25 de 100 libres: 25 * 4 >= 100 -> muestreo por rechazo
+    res = azar.candidatos_al_azar(_snap(100, 25), 5, holgura=3)
+    assert espia.llamadas == {"rechazo"}
+    assert len(res) == 15
+    # todos libres: el otro extremo del mismo camino
+    espia.llamadas.clear()
+    azar.candidatos_al_azar(_snap(100, 100), 2)
+    assert espia.llamadas == {"rechazo"}
+
+
+def test_muestra_por_debajo_de_un_cuarto(espia):
+    # 24 de 100 libres: 24 * 4 < 100 -> lista de libres + sample
+    res = azar.candidatos_al_azar(_snap(100, 24), 5, holgura=3)
+    assert espia.llamadas == {"muestra"}
+    assert len(res) == 15
+    espia.llamadas.clear()
+    azar.candidatos_al_azar(_snap(100, 1), 1)  # un solo libre
+    assert espia.llamadas == {"muestra"}
+
+
+def test_rechazo_pidiendo_todos_los_libres_termina(espia):
+    # holgura grande: el objetivo se acota a los disponibles y el rechazo los junta todos
+    snap = _snap(100, 30)
+    res = azar.candidatos_al_azar(snap, 10, holgura=50)
+    assert espia.llamadas == {"rechazo"}
+    assert set(res) == _libres(snap) and len(res) == 30
+
+
+def test_holgura_minima_es_uno(espia):
+    res = azar.candidatos_al_azar(_snap(100, 50), 4, holgura=0)
+    assert len(res) == 4
@@ -0,0 +1,76 @@
+# tests/test_busqueda.py
+"""Búsqueda de números disponibles por patrón (necesita TEST_DATABASE_URL)."""
+import pytest
+
+from talonario.busqueda import buscar_disponibles
+
+
+def _buscar(con, rifa, patron, modo="contiene", limite=100, cifras=3):
+    with con.cursor() as cur:
+        return buscar_disponibles(cur, rifa["rifa_id"], cifras, patron, modo, limite)
+
+
+def test_ceros_a_la_izquierda(con, sembrar):
+    rifa = sembrar(cifras=3)
+    numeros, hay_mas = _buscar(con, rifa, "07", "termina")
+    assert numeros == [f"{c}07" for c in range(10)]  # 007, 107, ..., 907
+    assert not hay_mas
+    assert _buscar(con, rifa, "00", "empieza")[0] == [f"00{u}" for u in range(10)]
+    assert _buscar(con, rifa, "007", "contiene")[0] == ["007"]
+    assert _buscar(con, rifa, "7", "termina", limite=3)[0] == ["007", "017", "027"]
+
+
+def test_contiene_cubre_todas_las_posiciones(con, sembrar):
+    rifa = sembrar(cifras=3)
+    numeros, _ = _buscar(con, rifa, "13")
+    assert numeros == sorted({f"{i:03d}" for i in range(1000) if "13" in f"{i:03d}"})
+
+
+def test_patron_mas_largo_que_las_cifras(con, sembrar):
+    rifa = sembrar(cifras=2)
+    for modo in ("empieza", "termina", "contiene"):
+        assert _buscar(con, rifa, "123", modo, cifras=2) == ([], False)
+
+
+@pytest.mark.parametrize("patron", ["", "   ", None, "1a", "-1", "1234567"])
+def test_patron_invalido(con, sembrar, patron):
+    rifa = sembrar(cifras=2)
+    with pytest.raises(ValueError):
+        _buscar(con, rifa, patron, cifras=2)
+
+
+def test_modo_invalido(con, sembrar):
+    rifa = sembrar(cifras=2)
+    with pytest.raises(ValueError):
+        _buscar(con, rifa, "1", "parecido", cifras=2)
+
+
+def test_hay_mas_y_limite(con, sembrar, monkeypatch):
+    rifa = sembrar(cifras=3)
+    # exactamente 'limite' resultados: no hay más
+    assert _buscar(con, rifa, "12", "empieza", limite=10) == ([f"12{u}" for u in range(10)], False)
+    # uno menos que los resultados: hay más
+    numeros, hay_mas = _buscar(con, rifa, "12", "empieza", limite=9)
+    assert numeros == [f"12{u}" for u in range(9)] and hay_mas
+    # el límite se acota a [1, BUSQUEDA_LIMITE_MAX]
+    assert _buscar(con, rifa, "1", "empieza", limite=0) == (["100"], True)
+    monkeypatch.setattr("talonario.busqueda.BUSQUEDA_LIMITE_MAX", 5)
+    numeros, hay_mas = _buscar(con, rifa, "1", "empieza", limite=50)
+    assert len(numeros) == 5 and hay_mas
+
+
+def test_solo_disponibles_y_reservas_vencidas(con, sembrar):
+    rifa = sembrar(cifras=3)
+    with con.cursor() as cur:
+        cur.execute("""
+            UPDATE numeros
+               SET estado = CASE numero WHEN '107' THEN 'pagado' ELSE 'reservado' END,
+                   reservado_hasta = CASE numero
+                       WHEN '207' THEN NOW() + interval '10 minutes'
+                       ELSE NOW() - interval '1 minute' END
+             WHERE id_rifa = %s AND numero IN ('107', '207', '307')
+        """, (rifa["rifa_id"],))
+    con.commit()
+    numeros, _ = _buscar(con, rifa, "07", "termina")
+    # 107 pagado y 207 con reserva vigente no salen; 307 (reserva vencida) sí
+    assert numeros == ["007", "307", "407", "507", "607", "707", "807", "907"]
@@ -0,0 +1,62 @@
+# tests/test_eventos.py
+"""LISTEN/NOTIFY: la foto cacheada se invalida con cambios de otra conexión."""
+import time
+
+from talonario import eventos, snapshot
+
+
+def _esperar(condicion, segundos=5.0):
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        if condicion():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_el_cache_arranca_el_listener_y_recibe_cambios_de_otros(con, sembrar, monkeypatch):
+    # la foto no vence sola durante la prueba: solo la puede invalidar el NOTIFY
+    monkeypatch.setattr(snapshot, "SNAPSHOT_TTL_SEGUNDOS", 3600)
+    rifa = sembrar(numeros=["00", "01", "02"])
+    with con.cursor() as cur:
+        snapshot.obtener_snapshot(cur, rifa["rifa_id"], 2)
+    con.commit()
+    assert _esperar(lambda: eventos._hilo is not None and eventos._hilo.is_alive())
+    time.sleep(0.5)  # que alcance a hacer LISTEN
+
+    with con.cursor() as cur:  # "otro worker": una conexión que no toca el cache
+        cur.execute("UPDATE numeros SET estado='pagado' WHERE id_rifa=%s AND numero='01'",
+                    (rifa["rifa_id"],))
+    con.commit()
+
+    assert _esperar(lambda: rifa["rifa_id"] not in snapshot._cache)
+    with con.cursor() as cur:
+        assert snapshot.obtener_snapshot(cur, rifa["rifa_id"], 2).estado_de("01") == "pagado"
+
+
+def test_sse_segun_el_worker_que_corre(app_modulo, monkeypatch):
+    monkeypatch.setattr(app_modulo, "SSE_ACTIVO", "")
+    monkeypatch.setattr(app_modulo.verde, "_activo", False)
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "sync")
+    assert not app_modulo.sse_activo()
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "gthread")
+    assert app_modulo.sse_activo()
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "sync")
+    monkeypatch.setattr(app_modulo.verde, "_activo", True)  # -k gevent: post_fork activó verde
+    assert app_modulo.sse_activo()
+    monkeypatch.setattr(app_modulo, "SSE_ACTIVO", "0")
+    assert not app_modulo.sse_activo()
+
+
+def test_stream_por_debajo_del_timeout(app_modulo, monkeypatch):
+    monkeypatch.setenv("GUNICORN_TIMEOUT", "60")
+    assert app_modulo._sse_max_segundos() == 50
+    monkeypatch.setenv("GUNICORN_TIMEOUT", "600")
+    assert app_modulo._sse_max_segundos() == app_modulo.SSE_MAX_SEGUNDOS
+
+
+def test_eventos_responde_204_con_workers_sync(app_modulo, sembrar, monkeypatch):
+    monkeypatch.setattr(app_modulo, "sse_activo", lambda: False)
+    rifa = sembrar()
+    resp = app_modulo.app.test_client().get(f"/r/{rifa['link']}/eventos")
+    assert resp.status_code == 204
@@ -0,0 +1,153 @@
+# tests/test_outbox.py
+"""Outbox de notificaciones y su despachador (necesita TEST_DATABASE_URL)."""
+import pytest
+
+from notificaciones import despachador
+from notificaciones.notificaciones import ErrorEnvioPermanente
+from notificaciones.outbox import encolar
+
+
+def _fila(con, _id):
+    with con.cursor() as cur:
+        cur.execute("""
+            SELECT estado, intentos, ultimo_error,
+                   EXTRACT(EPOCH FROM proximo_intento - NOW())::float
+              FROM notificaciones_outbox WHERE id = %s
+        """, (_id,))
+        return cur.fetchone()
+
+
+def _encolar(con, n, canal="whatsapp"):
+    with con.cursor() as cur:
+        for i in range(n):
+            encolar(cur, canal, f"30000000{i:02d}", f"mensaje {i}", clave=f"prueba:{i}")
+    con.commit()
+
+
+def test_encolar_una_sola_vez_por_clave(con):
+    with con.cursor() as cur:
+        encolar(cur, "whatsapp", "3001234567", "hola", clave="compra_1:wa_cliente")
+        encolar(cur, "whatsapp", "3001234567", "hola otra vez", clave="compra_1:wa_cliente")
+        encolar(cur, "whatsapp", "3001234567", "sin clave")
+        encolar(cur, "whatsapp", "3001234567", "sin clave")
+        encolar(cur, "whatsapp", "", "sin destinatario", clave="compra_1:vacio")
+        con.commit()
+        cur.execute("SELECT cuerpo FROM notificaciones_outbox ORDER BY id")
+        assert [f[0] for f in cur.fetchall()] == ["hola", "sin clave", "sin clave"]
+    with pytest.raises(ValueError):
+        with con.cursor() as cur:
+            encolar(cur, "fax", "3001234567", "hola")
+
+
+def test_reclamar_salta_las_filas_bloqueadas(con, conectar):
+    _encolar(con, 5)
+    otro = conectar()  # otro despachador con dos filas tomadas
+    with otro.cursor() as cur:
+        cur.execute("SELECT id FROM notificaciones_outbox WHERE id IN (1, 2) FOR UPDATE")
+        filas = despachador.reclamar_lote(10)
+    assert sorted(f[0] for f in filas) == [3, 4, 5]
+    assert all(f[5] == 1 for f in filas)  # intentos ya incrementado
+    otro.rollback()
+
+    estado, intentos, _, plazo = _fila(con, 3)
+    assert (estado, intentos) == ("enviando", 1)
+    assert plazo == pytest.approx(despachador.OUTBOX_PLAZO_SEGUNDOS, abs=5)
+    # ya reclamadas y con plazo vigente: solo quedan las que estaban bloqueadas
+    assert sorted(f[0] for f in despachador.reclamar_lote(10)) == [1, 2]
+    assert despachador.reclamar_lote(10) == []
+
+
+def test_enviando_con_plazo_vencido_se_reclama_de_nuevo(con):
+    _encolar(con, 1)
+    assert len(despachador.reclamar_lote(1)) == 1
+    with con.cursor() as cur:  # el proceso se cayó a mitad del envío
+        cur.execute("UPDATE notificaciones_outbox SET proximo_intento = NOW() - interval '1 second'")
+    con.commit()
+    (fila,) = despachador.reclamar_lote(1)
+    assert fila[5] == 2
+
+
+def test_backoff_exponencial_con_tope(monkeypatch):
+    monkeypatch.setattr(despachador, "OUTBOX_BACKOFF_SEGUNDOS", 30)
+    monkeypatch.setattr(despachador, "OUTBOX_BACKOFF_MAX_SEGUNDOS", 200)
+    assert [despachador._backoff(i) for i in range(0, 6)] == [30, 30, 60, 120, 200, 200]
+
+
+def test_fallo_reintenta_con_backoff_y_luego_muere(con, monkeypatch):
+    monkeypatch.setattr(despachador, "OUTBOX_MAX_INTENTOS", 3)
+    _encolar(con, 1)
+    for intento in (1, 2):
+        (fila,) = despachador.reclamar_lote(1)
+        despachador._registrar_fallo(fila, RuntimeError("timeout"))
+        estado, intentos, error, espera = _fila(con, fila[0])
+        assert (estado, intentos, error) == ("pendiente", intento, "timeout")
+        assert espera == pytest.approx(despachador._backoff(intento), abs=5)
+        with con.cursor() as cur:  # adelantar el reloj hasta el próximo intento
+            cur.execute("UPDATE notificaciones_outbox SET proximo_intento = NOW()")
+        con.commit()
+
+    (fila,) = despachador.reclamar_lote(1)
+    despachador._registrar_fallo(fila, RuntimeError("timeout"))
+    assert _fila(con, fila[0])[:2] == ("muerto", 3)
+    with con.cursor() as cur:
+        cur.execute("UPDATE notificaciones_outbox SET proximo_intento = NOW()")
+    con.commit()
+    assert despachador.reclamar_lote(1) == []  # dead-letter: no se reclama más
+
+
+def test_error_permanente_muere_al_primer_intento(con):
+    _encolar(con, 1)
+    (fila,) = despachador.reclamar_lote(1)
+    despachador._registrar_fallo(fila, ErrorEnvioPermanente("número inválido"))
+    assert _fila(con, fila[0])[:3] == ("muerto", 1, "número inválido")
+
+
+def test_canal_desconocido_es_error_permanente(con):
+    _encolar(con, 1)
+    (fila,) = despachador.reclamar_lote(1)
+    despachador.procesar(fila[:1] + ("fax",) + fila[2:])
+    assert _fila(con, fila[0])[:2] == ("muerto", 1)
+
+
+def test_lote_de_correo_registra_cada_resultado(con, monkeypatch):
+    _encolar(con, 3, canal="correo")
+    monkeypatch.setattr(despachador, "enviar_correos_lote",
+                        lambda msgs: ["ok", RuntimeError("421"), "ok"])
+    filas = sorted(despachador.reclamar_lote(10))
+    despachador.procesar_lote_correo(filas)
+    assert [_fila(con, f[0])[0] for f in filas] == ["enviado", "pendiente", "enviado"]
+
+
+def test_webhook_confirma_el_pago_aunque_falle_una_notificacion(app_modulo, con, sembrar,
+                                                                monkeypatch):
+    from psycopg2.extras import RealDictCursor
+
+    rifa = sembrar()
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        res = app_modulo.reservar_y_crear_compra(
+            cur, rifa["rifa_id"], ["05"], 1000, nombre="Ana", cedula="111",
+            correo="ana@example.com", telefono="3001234567")
+    con.commit()
+
+    real = app_modulo.encolar_notificacion
+
+    def encolar_que_falla(cur, canal, destinatario, cuerpo, asunto=None, clave=None):
+        if clave.endswith(":wa_admin"):
+            cur.execute("SELECT 1 / 0")  # error de la base: aborta la transacción
+        return real(cur, canal, destinatario, cuerpo, asunto=asunto, clave=clave)
+
+    monkeypatch.setattr(app_modulo, "encolar_notificacion", encolar_que_falla)
+    resp = app_modulo.app.test_client().post("/webhook-pago", json={"data": {"transaction": {
+        "reference": f"compra_{res['compra_id']}", "status": "APPROVED", "id": "tx-1"}}})
+    assert resp.status_code == 200
+
+    with con.cursor() as cur:
+        cur.execute("SELECT estado FROM compras WHERE id = %s", (res["compra_id"],))
+        assert cur.fetchone()[0] == "pagado"
+        cur.execute("SELECT clave FROM notificaciones_outbox ORDER BY clave")
+        assert [f[0] for f in cur.fetchall()] == [
+            f"compra_{res['compra_id']}:{k}" for k in ("correo_admin", "correo_cliente", "wa_cliente")]
+        cur.execute("SELECT resultado, detalle FROM wompi_eventos")
+        resultado, detalle = cur.fetchone()
+    assert resultado == "aplicado"
+    assert "wa_admin" in detalle and "division by zero" in detalle
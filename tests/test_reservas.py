@@ -0,0 +1,108 @@
+# tests/test_reservas.py
+"""Checkout: reservar_y_crear_compra bajo concurrencia (necesita TEST_DATABASE_URL)."""
+import threading
+
+from psycopg2.extras import RealDictCursor
+
+
+def _reservar(app_modulo, con, rifa_id, numeros, cedula, cantidad=None):
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        res = app_modulo.reservar_y_crear_compra(
+            cur, rifa_id, numeros, 1000 * (cantidad or len(numeros)),
+            nombre=f"Comprador {cedula}", cedula=cedula,
+            correo=f"{cedula}@example.com", telefono="3001234567",
+            cantidad=cantidad,
+        )
+    if res:
+        con.commit()
+    else:
+        con.rollback()
+    return res
+
+
+def _en_paralelo(*funciones):
+    """Corre las funciones a la vez (arrancan juntas) y retorna sus resultados."""
+    barrera = threading.Barrier(len(funciones))
+    resultados = [None] * len(funciones)
+    errores = []
+
+    def correr(i, f):
+        try:
+            barrera.wait()
+            resultados[i] = f()
+        except Exception as e:  # se re-lanza en el hilo principal
+            errores.append(e)
+
+    hilos = [threading.Thread(target=correr, args=(i, f)) for i, f in enumerate(funciones)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join(30)
+    if errores:
+        raise errores[0]
+    return resultados
+
+
+def test_reserva_y_compra_pendiente(app_modulo, con, sembrar):
+    rifa = sembrar()
+    res = _reservar(app_modulo, con, rifa["rifa_id"], ["07", "03"], "111")
+    assert res and res["numeros"] == ["03", "07"]
+    with con.cursor() as cur:
+        cur.execute("SELECT estado, numeros FROM compras WHERE id = %s", (res["compra_id"],))
+        assert cur.fetchone() == ("pendiente", "07,03")
+        cur.execute("SELECT numero FROM numeros WHERE estado = 'reservado' ORDER BY numero")
+        assert [f[0] for f in cur.fetchall()] == ["03", "07"]
+
+
+def test_numero_ocupado_no_reserva_nada(app_modulo, con, sembrar):
+    rifa = sembrar()
+    assert _reservar(app_modulo, con, rifa["rifa_id"], ["10"], "111")
+    assert _reservar(app_modulo, con, rifa["rifa_id"], ["11", "10"], "222") is None
+    with con.cursor() as cur:
+        cur.execute("SELECT estado FROM numeros WHERE numero = '11'")
+        assert cur.fetchone()[0] == "disponible"  # todo o nada
+        cur.execute("SELECT COUNT(*) FROM compras")
+        assert cur.fetchone()[0] == 1
+
+
+def test_reservas_concurrentes_solapadas_nunca_ganan_ambas(app_modulo, conectar, con, sembrar):
+    rifa = sembrar()
+    c1, c2 = conectar(), conectar()
+    for ronda in range(15):
+        a = [f"{2 * ronda:02d}", f"{2 * ronda + 1:02d}", f"{60 + ronda:02d}"]
+        b = [f"{60 + ronda:02d}", f"{2 * ronda + 1:02d}", f"{2 * ronda:02d}"]  # orden inverso
+        r1, r2 = _en_paralelo(
+            lambda: _reservar(app_modulo, c1, rifa["rifa_id"], a, f"a{ronda}"),
+            lambda: _reservar(app_modulo, c2, rifa["rifa_id"], b, f"b{ronda}"),
+        )
+        assert bool(r1) != bool(r2), f"ronda {ronda}: {r1!r} / {r2!r}"
+
+    with con.cursor() as cur:
+        # cada número reservado pertenece a UNA sola compra
+        cur.execute("""
+            SELECT id_numero, COUNT(*) FROM compra_numeros GROUP BY id_numero HAVING COUNT(*) > 1
+        """)
+        assert cur.fetchall() == []
+        cur.execute("SELECT COUNT(*) FROM numeros WHERE estado = 'reservado'")
+        assert cur.fetchone()[0] == 15 * 3
+
+
+def test_misma_cedula_en_paralelo_no_duplica_comprador(app_modulo, conectar, con, sembrar):
+    rifa = sembrar()
+    c1, c2 = conectar(), conectar()
+    r1, r2 = _en_paralelo(
+        lambda: _reservar(app_modulo, c1, rifa["rifa_id"], ["01"], "999"),
+        lambda: _reservar(app_modulo, c2, rifa["rifa_id"], ["02"], "999"),
+    )
+    assert r1 and r2
+    assert r1["comprador_id"] == r2["comprador_id"]
+    with con.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM compradores WHERE cedula = '999'")
+        assert cur.fetchone()[0] == 1
+
+
+def test_al_azar_toma_los_primeros_candidatos_libres(app_modulo, con, sembrar):
+    rifa = sembrar()
+    assert _reservar(app_modulo, con, rifa["rifa_id"], ["05"], "111")
+    res = _reservar(app_modulo, con, rifa["rifa_id"], ["05", "42", "17", "30"], "222", cantidad=2)
+    assert res and res["numeros"] == ["17", "42"]
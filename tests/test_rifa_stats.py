@@ -0,0 +1,114 @@
+# tests/test_rifa_stats.py
+"""Contadores de rifa_stats mantenidos por triggers (necesita TEST_DATABASE_URL)."""
+
+CAMPOS = ("total", "disponibles", "reservados", "pagados", "recaudado", "version")
+
+
+def _stats(con, rifa_id):
+    with con.cursor() as cur:
+        cur.execute(f"""
+            SELECT {', '.join(f'COALESCE(SUM({c}), 0)::bigint' for c in CAMPOS)}
+              FROM rifa_stats WHERE id_rifa = %s
+        """, (rifa_id,))
+        return dict(zip(CAMPOS, cur.fetchone()))
+
+
+def _contado(con, rifa_id):
+    """Lo mismo contado desde numeros (sin versión)."""
+    with con.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE n.estado = 'disponible'),
+                   COUNT(*) FILTER (WHERE n.estado = 'reservado'),
+                   COUNT(*) FILTER (WHERE n.estado = 'pagado'),
+                   COALESCE(SUM(r.valor_numero) FILTER (WHERE n.estado = 'pagado'), 0)::bigint
+              FROM numeros n JOIN rifas r ON r.id = n.id_rifa
+             WHERE n.id_rifa = %s
+        """, (rifa_id,))
+        return dict(zip(CAMPOS, cur.fetchone()))
+
+
+def _ejecutar(con, sql, *params):
+    with con.cursor() as cur:
+        cur.execute(sql, params)
+    con.commit()
+
+
+def _sin_version(stats):
+    return {k: v for k, v in stats.items() if k != "version"}
+
+
+def test_update_sin_cambio_de_estado_no_sube_la_version(con, sembrar):
+    rifa = sembrar()
+    antes = _stats(con, rifa["rifa_id"])
+    assert _sin_version(antes) == _contado(con, rifa["rifa_id"])
+
+    _ejecutar(con, "UPDATE numeros SET reservado_hasta = NOW() WHERE id_rifa = %s", rifa["rifa_id"])
+    _ejecutar(con, "UPDATE numeros SET estado = estado WHERE id_rifa = %s", rifa["rifa_id"])
+    _ejecutar(con, "UPDATE numeros SET estado = 'pagado' WHERE id_rifa = %s AND false",
+              rifa["rifa_id"])
+    assert _stats(con, rifa["rifa_id"]) == antes
+
+
+def test_cambio_de_estado_mueve_contadores_y_version(con, sembrar):
+    rifa = sembrar(valor=2500)
+    v0 = _stats(con, rifa["rifa_id"])["version"]
+
+    # una sola sentencia: cambia '01' y '02'; '03' solo cambia reservado_hasta
+    _ejecutar(con, """
+        UPDATE numeros
+           SET estado = CASE numero WHEN '03' THEN estado ELSE 'pagado' END,
+               reservado_hasta = NOW()
+         WHERE id_rifa = %s AND numero IN ('01', '02', '03')
+    """, rifa["rifa_id"])
+    stats = _stats(con, rifa["rifa_id"])
+    assert stats["version"] == v0 + 1
+    assert stats["pagados"] == 2 and stats["recaudado"] == 5000
+    assert _sin_version(stats) == _contado(con, rifa["rifa_id"])
+
+    # dos números intercambian estado: los totales quedan igual, pero la grilla cambió
+    _ejecutar(con, """
+        UPDATE numeros
+           SET estado = CASE estado WHEN 'pagado' THEN 'disponible' ELSE 'pagado' END
+         WHERE id_rifa = %s AND numero IN ('02', '04')
+    """, rifa["rifa_id"])
+    stats = _stats(con, rifa["rifa_id"])
+    assert stats["version"] == v0 + 2
+    assert _sin_version(stats) == _contado(con, rifa["rifa_id"])
+
+
+def test_insert_y_delete_siguen_contando(con, sembrar):
+    rifa = sembrar(cantidad=10)
+    v0 = _stats(con, rifa["rifa_id"])["version"]
+    _ejecutar(con, "UPDATE numeros SET estado = 'pagado' WHERE id_rifa = %s AND numero = '00'",
+              rifa["rifa_id"])
+    _ejecutar(con, "DELETE FROM numeros WHERE id_rifa = %s AND numero IN ('00', '01')",
+              rifa["rifa_id"])
+    _ejecutar(con, "INSERT INTO numeros (id_rifa, numero, estado) VALUES (%s, '10', 'reservado')",
+              rifa["rifa_id"])
+    stats = _stats(con, rifa["rifa_id"])
+    assert stats["version"] == v0 + 3
+    assert _sin_version(stats) == _contado(con, rifa["rifa_id"])
+    assert (stats["total"], stats["pagados"], stats["reservados"]) == (9, 0, 1)
+
+
+def test_reconciliar_solo_las_rifas_pedidas(con, sembrar):
+    from tareas.reconciliar_stats import reconstruir_rifa_stats
+
+    a, b = sembrar(cantidad=10), sembrar(cantidad=10)
+    for rifa in (a, b):  # contadores corruptos a propósito
+        _ejecutar(con, "UPDATE rifa_stats SET pagados = 7 WHERE id_rifa = %s", rifa["rifa_id"])
+    va, vb = _stats(con, a["rifa_id"])["version"], _stats(con, b["rifa_id"])["version"]
+
+    with con.cursor() as cur:
+        assert reconstruir_rifa_stats(cur, [a["rifa_id"]]) == 1
+    con.commit()
+    assert _sin_version(_stats(con, a["rifa_id"])) == _contado(con, a["rifa_id"])
+    assert _stats(con, a["rifa_id"])["version"] == va + 1
+    assert _stats(con, b["rifa_id"])["pagados"] == 7  # la otra no se tocó
+
+    with con.cursor() as cur:  # sin ids: todas
+        assert reconstruir_rifa_stats(cur) == 2
+    con.commit()
+    assert _sin_version(_stats(con, b["rifa_id"])) == _contado(con, b["rifa_id"])
+    assert _stats(con, b["rifa_id"])["version"] == vb + 1
@@ -0,0 +1,128 @@
+# tests/test_smtp_pool.py
+"""PoolSMTP contra un servidor aiosmtpd local (sin TLS ni login)."""
+import smtplib
+import socket
+from email.message import EmailMessage
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+from notificaciones import smtp_pool
+from notificaciones.smtp_pool import PoolSMTP
+
+
+class Buzon:
+    """Handler de aiosmtpd: guarda lo recibido y puede fallar a pedido."""
+
+    def __init__(self):
+        self.recibidos = []  # (puerto del cliente, destinatarios)
+        self.noop_falla = False
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("rechazado"):
+            return "550 buzón inexistente"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recibidos.append((session.peer[1], envelope.rcpt_tos))
+        return "250 OK"
+
+    async def handle_NOOP(self, server, session, envelope, arg):
+        return "421 cerrando la sesión" if self.noop_falla else "250 OK"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def servidor():
+    buzon = Buzon()
+    ctl = aiosmtpd_controller.Controller(buzon, hostname="127.0.0.1", port=_puerto_libre())
+    ctl.start()
+    yield ctl, buzon
+    ctl.stop()
+
+
+@pytest.fixture
+def pool(servidor):
+    ctl, _ = servidor
+    p = PoolSMTP(ctl.hostname, ctl.port, usuario="", clave="", ssl=False, maximo=1,
+                 timeout_conexion=5, timeout_envio=5)
+    yield p
+    p.cerrar_todo()
+
+
+def _msg(para):
+    msg = EmailMessage()
+    msg["From"] = "rifas@example.com"
+    msg["To"] = para
+    msg["Subject"] = "Prueba"
+    msg.set_content("hola")
+    return msg
+
+
+def test_reutiliza_la_sesion_entre_envios(servidor, pool):
+    _, buzon = servidor
+    for i in range(3):
+        pool.enviar(_msg(f"cliente{i}@example.com"))
+    assert pool.stats["conexiones"] == 1
+    assert pool.stats["enviados"] == 3
+    assert len({puerto for puerto, _ in buzon.recibidos}) == 1  # una sola conexión TCP
+
+
+def test_lote_por_una_sesion_y_errores_por_mensaje(servidor, pool):
+    _, buzon = servidor
+    res = pool.enviar_lote([_msg("a@example.com"), _msg("rechazado@example.com"),
+                            _msg("b@example.com")])
+    assert res[0] is None and res[2] is None
+    assert isinstance(res[1], smtplib.SMTPRecipientsRefused)
+    # un destinatario malo no se reintenta ni tumba la sesión (RSET y sigue)
+    assert pool.stats["conexiones"] == 1 and pool.stats["reconexiones"] == 0
+    assert [rcpt for _, rcpt in buzon.recibidos] == [["a@example.com"], ["b@example.com"]]
+
+
+def test_noop_fallido_reconecta(servidor, pool, monkeypatch):
+    _, buzon = servidor
+    pool.enviar(_msg("a@example.com"))
+    monkeypatch.setattr(smtp_pool, "SMTP_NOOP_SEGUNDOS", -1)  # toda sesión ociosa se valida
+    pool.enviar(_msg("b@example.com"))
+    assert pool.stats["conexiones"] == 1  # NOOP 250: la misma sesión
+
+    buzon.noop_falla = True
+    pool.enviar(_msg("c@example.com"))
+    assert pool.stats["conexiones"] == 2
+    assert pool.stats["reconexiones"] == 0  # se descartó antes de enviar, sin reintento
+    assert len(buzon.recibidos) == 3
+    assert buzon.recibidos[1][0] != buzon.recibidos[2][0]
+
+
+def test_sesion_cortada_se_reintenta_una_vez(servidor, pool):
+    _, buzon = servidor
+    pool.enviar(_msg("a@example.com"))
+    pool._libres[-1].smtp.sock.shutdown(socket.SHUT_RDWR)  # el servidor "cortó" la sesión ociosa
+
+    res = pool.enviar_lote([_msg("b@example.com"), _msg("c@example.com")])
+    assert res == [None, None]
+    assert pool.stats["reconexiones"] == 1
+    assert pool.stats["conexiones"] == 2
+    assert [rcpt for _, rcpt in buzon.recibidos][1:] == [["b@example.com"], ["c@example.com"]]
+
+
+def test_sin_servidor_no_reintenta_mas_de_una_vez(pool, monkeypatch):
+    pool.enviar(_msg("a@example.com"))
+    pool._libres[-1].smtp.sock.shutdown(socket.SHUT_RDWR)
+    pool.port = _puerto_libre()  # y ya nadie escucha: la reconexión también falla
+
+    intentos = []
+    conectar = pool._conectar
+    monkeypatch.setattr(pool, "_conectar", lambda: intentos.append(1) or conectar())
+    res = pool.enviar_lote([_msg("b@example.com")])
+    assert isinstance(res[0], OSError)
+    assert len(intentos) == 1  # la sesión muerta + UNA reconexión, y se rinde
+    assert pool.stats["reconexiones"] == 1 and pool.stats["errores"] == 1
+
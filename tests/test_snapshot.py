@@ -0,0 +1,85 @@
+# tests/test_snapshot.py
+"""Foto compacta del talonario: 2 bits por número y bitmap del universo."""
+import base64
+import os
+import random
+
+import pytest
+
+from talonario.snapshot import (ESTADOS, SnapshotRifa, construir_snapshot, desempaquetar,
+                                empaquetar, universo_b64)
+
+PLANTILLA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "templates", "rifa_publica.html")
+
+
+@pytest.mark.parametrize("total", list(range(0, 14)) + [99, 100, 1001])
+def test_empaquetar_ida_y_vuelta(total):
+    # todos los estados, en todas las posiciones dentro del byte
+    codigos = [i % len(ESTADOS) for i in range(total)]
+    random.Random(total).shuffle(codigos)
+    estados = empaquetar(codigos)
+    assert len(estados) == (total + 3) // 4  # el último byte puede ir a medias
+    assert desempaquetar(estados, total) == codigos
+
+
+def test_cada_estado_en_cada_posicion_del_byte():
+    for estado in range(len(ESTADOS)):
+        for pos in range(4):
+            codigos = [0] * 4
+            codigos[pos] = estado
+            assert desempaquetar(empaquetar(codigos), 4) == codigos
+
+
+def test_payload_se_decodifica_igual_que_en_el_navegador():
+    numeros = [f"{i:02d}" for i in range(0, 100, 3)]  # 34 números: byte final a medias
+    codigos = [(i * 7) % 3 for i in range(len(numeros))]
+    snap = SnapshotRifa(1, 2, numeros, empaquetar(codigos), float("inf"))
+    data = snap.payload()
+
+    assert data["total"] == len(numeros)
+    assert desempaquetar(base64.b64decode(data["estados"]), data["total"]) == codigos
+    assert [snap.codigo(i) for i in range(len(numeros))] == codigos
+    assert snap.disponibles == codigos.count(0)
+    assert snap.estado_de("03") == ESTADOS[codigos[1]]
+    assert snap.estado_de("04") is None
+
+    # universo: bit v = el número v existe (numerosDe en rifa_publica.html)
+    uni = base64.b64decode(data["universo"])
+    presentes = [f"{v:02d}" for v in range(len(uni) * 8) if uni[v >> 3] & (1 << (v & 7))]
+    assert presentes == numeros
+
+
+def test_universo_con_numeros_no_uniformes_manda_lista():
+    assert universo_b64(["01", "100"], 2) is None
+    snap = SnapshotRifa(1, 2, ["01", "100"], empaquetar([0, 1]), float("inf"))
+    assert snap.payload()["lista"] == ["01", "100"]
+
+
+def test_plantilla_decodifica_con_la_misma_cuenta():
+    """Si cambia el formato, hay que cambiar también el decodificador JS."""
+    with open(PLANTILLA, encoding="utf-8") as f:
+        js = f.read()
+    assert "codigos[j] = (est[j >> 2] >> ((j & 3) * 2)) & 3" in js
+    assert "if (uni[b] & (1 << k)) out.push(pad(b * 8 + k, snap.cifras))" in js
+    assert "var ESTADOS = ['disponible', 'reservado', 'pagado'];" in js
+    assert ESTADOS == ("disponible", "reservado", "pagado")
+
+
+def test_construir_snapshot_desde_la_base(con, sembrar):
+    rifa = sembrar(numeros=["00", "01", "02", "03", "04"])
+    with con.cursor() as cur:
+        cur.execute("""
+            UPDATE numeros SET estado = CASE numero
+                WHEN '01' THEN 'reservado' WHEN '02' THEN 'pagado' ELSE 'reservado' END,
+                reservado_hasta = CASE numero
+                WHEN '01' THEN NOW() + interval '10 minutes' ELSE NOW() - interval '1 minute' END
+             WHERE id_rifa = %s AND numero IN ('01', '02', '04')
+        """, (rifa["rifa_id"],))
+        con.commit()
+        snap = construir_snapshot(cur, rifa["rifa_id"], 2)
+    # '04' tiene la reserva vencida: cuenta como disponible
+    assert [ESTADOS[snap.codigo(i)] for i in range(len(snap))] == [
+        "disponible", "reservado", "pagado", "disponible", "disponible"]
+    assert snap.disponibles == 3
+    assert snap.vence != float("inf")
@@ -0,0 +1,157 @@
+# tests/test_webhook.py
+"""Webhook de Wompi: ledger idempotente y eventos fuera de orden (necesita TEST_DATABASE_URL)."""
+from psycopg2.extras import RealDictCursor
+
+
+def _compra(app_modulo, con, rifa_id, numeros, cedula):
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        res = app_modulo.reservar_y_crear_compra(
+            cur, rifa_id, numeros, 1000 * len(numeros), nombre=f"Comprador {cedula}",
+            cedula=cedula, correo=f"{cedula}@example.com", telefono="3001234567")
+    con.commit()
+    assert res
+    return res["compra_id"]
+
+
+def _vencer_reserva(con, compra_id):
+    """La reserva de esa compra expira (el cliente tardó en pagar)."""
+    with con.cursor() as cur:
+        cur.execute("""
+            UPDATE numeros n SET reservado_hasta = NOW() - interval '1 minute'
+              FROM compra_numeros cn
+             WHERE cn.id_compra = %s AND n.id = cn.id_numero
+        """, (compra_id,))
+    con.commit()
+
+
+def _evento(app_modulo, compra_id, estado, tx):
+    resp = app_modulo.app.test_client().post("/webhook-pago", json={"data": {"transaction": {
+        "reference": f"compra_{compra_id}", "status": estado, "id": tx}}})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def _estado_compra(con, compra_id):
+    with con.cursor() as cur:
+        cur.execute("SELECT estado FROM compras WHERE id = %s", (compra_id,))
+        return cur.fetchone()[0]
+
+
+def _numeros(con, rifa_id, *numeros):
+    """{numero: (estado, id_comprador)}"""
+    with con.cursor() as cur:
+        cur.execute("""
+            SELECT numero, estado, id_comprador FROM numeros
+             WHERE id_rifa = %s AND numero = ANY(%s)
+        """, (rifa_id, list(numeros)))
+        return {n: (e, c) for n, e, c in cur.fetchall()}
+
+
+def _comprador(con, compra_id):
+    with con.cursor() as cur:
+        cur.execute("SELECT id_comprador FROM compras WHERE id = %s", (compra_id,))
+        return cur.fetchone()[0]
+
+
+def _eventos(con):
+    with con.cursor() as cur:
+        cur.execute("""
+            SELECT estado, compra_antes, compra_despues, resultado, detalle
+              FROM wompi_eventos ORDER BY id
+        """)
+        return cur.fetchall()
+
+
+def test_evento_repetido_se_procesa_una_sola_vez(app_modulo, con, sembrar):
+    rifa = sembrar()
+    compra = _compra(app_modulo, con, rifa["rifa_id"], ["05", "06"], "111")
+
+    assert _evento(app_modulo, compra, "APPROVED", "tx-1") == {"ok": True}
+    assert _evento(app_modulo, compra, "APPROVED", "tx-1") == {"ok": True, "duplicado": True}
+
+    assert _estado_compra(con, compra) == "pagado"
+    assert _eventos(con) == [("APPROVED", "pendiente", "pagado", "aplicado", None)]
+    with con.cursor() as cur:  # las notificaciones tampoco se duplican
+        cur.execute("SELECT clave, COUNT(*) FROM notificaciones_outbox GROUP BY clave")
+        assert {c for c, n in cur.fetchall() if n == 1} == {
+            f"compra_{compra}:{k}" for k in ("wa_cliente", "wa_admin", "correo_cliente", "correo_admin")}
+
+
+def test_approved_despues_de_declined_cierra_como_pagada(app_modulo, con, sembrar):
+    rifa = sembrar()
+    compra = _compra(app_modulo, con, rifa["rifa_id"], ["05"], "111")
+
+    _evento(app_modulo, compra, "DECLINED", "tx-1")
+    assert _estado_compra(con, compra) == "rechazado"
+    assert _numeros(con, rifa["rifa_id"], "05")["05"][0] == "disponible"
+
+    # el cliente reintentó con otra transacción y esta sí pasó (nadie tomó el número)
+    _evento(app_modulo, compra, "APPROVED", "tx-2")
+    assert _estado_compra(con, compra) == "pagado"
+    assert _numeros(con, rifa["rifa_id"], "05")["05"] == ("pagado", _comprador(con, compra))
+
+
+def test_declined_despues_de_approved_se_ignora(app_modulo, con, sembrar):
+    rifa = sembrar()
+    compra = _compra(app_modulo, con, rifa["rifa_id"], ["05"], "111")
+
+    _evento(app_modulo, compra, "APPROVED", "tx-1")
+    assert _evento(app_modulo, compra, "DECLINED", "tx-2") == {"ok": True, "ignorado": True}
+    assert _estado_compra(con, compra) == "pagado"
+    assert _numeros(con, rifa["rifa_id"], "05")["05"][0] == "pagado"
+    assert _eventos(con)[-1] == ("DECLINED", "pagado", "pagado", "ignorado", None)
+
+
+def test_approved_tardio_con_numero_ya_reservado_por_otro_queda_en_conflicto(app_modulo, con,
+                                                                              sembrar):
+    rifa = sembrar()
+    vieja = _compra(app_modulo, con, rifa["rifa_id"], ["05", "06"], "111")
+    _vencer_reserva(con, vieja)
+    nueva = _compra(app_modulo, con, rifa["rifa_id"], ["06"], "222")  # tomó el '06' vencido
+
+    _evento(app_modulo, vieja, "APPROVED", "tx-1")
+
+    assert _estado_compra(con, vieja) == "conflicto"
+    assert _estado_compra(con, nueva) == "pendiente"
+    assert _numeros(con, rifa["rifa_id"], "05", "06") == {
+        "05": ("pagado", _comprador(con, vieja)),
+        "06": ("reservado", None),  # la reserva vigente de la nueva manda
+    }
+    ((estado, antes, despues, resultado, detalle),) = _eventos(con)
+    assert (estado, antes, despues, resultado) == ("APPROVED", "pendiente", "conflicto", "conflicto")
+    assert "06" in detalle and "05" not in detalle
+
+    # y si la compra nueva paga después, su número sigue siendo suyo
+    _evento(app_modulo, nueva, "APPROVED", "tx-2")
+    assert _estado_compra(con, nueva) == "pagado"
+    assert _numeros(con, rifa["rifa_id"], "06")["06"] == ("pagado", _comprador(con, nueva))
+
+
+def test_approved_tardio_recupera_numeros_si_la_otra_reserva_tambien_vencio(app_modulo, con,
+                                                                             sembrar):
+    rifa = sembrar()
+    vieja = _compra(app_modulo, con, rifa["rifa_id"], ["05"], "111")
+    _vencer_reserva(con, vieja)
+    nueva = _compra(app_modulo, con, rifa["rifa_id"], ["05"], "222")
+    _vencer_reserva(con, nueva)  # la nueva tampoco pagó a tiempo
+
+    _evento(app_modulo, vieja, "APPROVED", "tx-1")
+    assert _estado_compra(con, vieja) == "pagado"
+    assert _numeros(con, rifa["rifa_id"], "05")["05"] == ("pagado", _comprador(con, vieja))
+
+
+def test_declined_de_compra_vieja_no_libera_numeros_revendidos(app_modulo, con, sembrar):
+    rifa = sembrar()
+    vieja = _compra(app_modulo, con, rifa["rifa_id"], ["05", "06"], "111")
+    _vencer_reserva(con, vieja)
+    _compra(app_modulo, con, rifa["rifa_id"], ["05"], "222")
+    pagada = _compra(app_modulo, con, rifa["rifa_id"], ["06"], "333")
+    _evento(app_modulo, pagada, "APPROVED", "tx-pagada")
+
+    _evento(app_modulo, vieja, "DECLINED", "tx-1")
+
+    assert _estado_compra(con, vieja) == "rechazado"
+    assert _numeros(con, rifa["rifa_id"], "05", "06") == {
+        "05": ("reservado", None),  # sigue reservado para la otra compra
+        "06": ("pagado", _comprador(con, pagada)),
+    }